@@ -48,9 +48,8 @@ setup(
     ],
     python_requires=">=3.6,<3.8",
     install_requires=[
+        "numpy",
         "pandas",
-        "pyranges",
-        "bamread>=0.0.11",
         "pysam>=0.15.4",
         "pyfaidx",
         "scanpy"
@@ -60,6 +59,7 @@ setup(
             'talon=talon.talon:main',
             'talon_label_reads=talon.talon_label_reads:main',
             'talon_initialize_database=talon.initialize_talon_database:main',
+            'talon_optimize_database=talon.optimize_talon_database:main',
             'talon_filter_transcripts=talon.post.filter_talon_transcripts:main',
             'talon_abundance=talon.post.create_abundance_file_from_database:main',
             'talon_create_GTF=talon.post.create_GTF_from_database:main',
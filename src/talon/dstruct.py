@@ -1,3 +1,11 @@
+import json
+import os
+from bisect import bisect_left, bisect_right, insort
+from itertools import count
+
+import numpy as np
+
+
 class Struct(dict):
     """
     Make a dict behave as a struct.
@@ -11,3 +19,516 @@ class Struct(dict):
     def __init__(self, **kw):
         dict.__init__(self, kw)
         self.__dict__ = self
+
+
+class PositionDict(dict):
+    """
+    A dict keyed on integer genomic positions that also keeps its keys in a
+    sorted list, so that the closest key inside a window can be found with a
+    binary search instead of probing the dict one position at a time.
+    Insertion order is recorded as well so that ties can be broken the same
+    way as iterating over a plain dict would.
+
+    Example:
+
+        locs = PositionDict()
+        locs[100] = vertex
+        locs.closest(95, 90, 110)  # -> 100
+
+    """
+
+    def __init__(self, *args, **kw):
+        dict.__init__(self)
+        self.positions = []
+        self.order = {}
+        self._rank = count()
+        self.update(*args, **kw)
+
+    def __setitem__(self, position, value):
+        if position not in self:
+            insort(self.positions, position)
+            self.order[position] = next(self._rank)
+        dict.__setitem__(self, position, value)
+
+    def __delitem__(self, position):
+        dict.__delitem__(self, position)
+        self.positions.pop(bisect_left(self.positions, position))
+        del self.order[position]
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def update(self, *args, **kw):
+        # Bulk inserts sort once at the end rather than insorting each key
+        new_positions = []
+        for position, value in dict(*args, **kw).items():
+            if position not in self:
+                new_positions.append(position)
+                self.order[position] = next(self._rank)
+            dict.__setitem__(self, position, value)
+
+        if new_positions:
+            self.positions.extend(new_positions)
+            self.positions.sort()
+
+    def setdefault(self, position, default=None):
+        if position not in self:
+            self[position] = default
+        return self[position]
+
+    def nearest(self, position, lo, hi):
+        """Return the closest stored positions on either side of `position`
+        that fall inside the closed window [lo, hi], as a (left, right)
+        tuple. Either side is None if there is no such position. A stored
+        position equal to `position` is reported on both sides."""
+
+        positions = self.positions
+
+        left = None
+        i = bisect_right(positions, min(position, hi)) - 1
+        if i >= 0 and positions[i] >= lo:
+            left = positions[i]
+
+        right = None
+        i = bisect_left(positions, max(position, lo))
+        if i < len(positions) and positions[i] <= hi:
+            right = positions[i]
+
+        return left, right
+
+    def closest(self, position, lo, hi, prefer=-1):
+        """Return the stored position closest to `position` inside the closed
+        window [lo, hi], or None if the window is empty. When a position on
+        each side is equally close, the one on the `prefer` side (-1 for
+        smaller, 1 for larger, None for whichever was inserted first) wins."""
+
+        left, right = self.nearest(position, lo, hi)
+        if left is None:
+            return right
+        if right is None:
+            return left
+
+        left_dist = position - left
+        right_dist = right - position
+        if left_dist < right_dist:
+            return left
+        if right_dist < left_dist:
+            return right
+
+        if prefer is None:
+            return left if self.order[left] <= self.order[right] else right
+        return left if prefer < 0 else right
+
+
+class PathDict(dict):
+    """
+    A dict keyed on transcript paths (frozensets of edge IDs) that also
+    keeps an inverted index from each edge ID to the paths that use it.
+    This makes it possible to find every path containing a given set of
+    edges by intersecting a few short posting lists rather than testing
+    every key in the dict.
+
+    Adding a new path never changes where existing paths fall in the
+    iteration order, but replacing or removing one can. The generation
+    counter is bumped whenever that happens so that anything derived from
+    the dict's contents can tell it is out of date.
+
+    Example:
+
+        transcripts = PathDict()
+        transcripts[frozenset([1, 2, 3])] = transcript
+        transcripts.supersets(frozenset([2, 3]))  # -> [frozenset({1, 2, 3})]
+
+    """
+
+    def __init__(self, *args, **kw):
+        dict.__init__(self)
+        self.edge_index = {}
+        self.order = {}
+        self.generation = 0
+        self._rank = count()
+        self.update(*args, **kw)
+
+    def __setitem__(self, path, value):
+        if path not in self:
+            self.order[path] = next(self._rank)
+            for edge in path:
+                try:
+                    self.edge_index[edge].add(path)
+                except KeyError:
+                    self.edge_index[edge] = {path}
+        else:
+            self.generation += 1
+        dict.__setitem__(self, path, value)
+
+    def __delitem__(self, path):
+        dict.__delitem__(self, path)
+        self.generation += 1
+        del self.order[path]
+        for edge in path:
+            self.edge_index[edge].discard(path)
+            if not self.edge_index[edge]:
+                del self.edge_index[edge]
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def update(self, *args, **kw):
+        for path, value in dict(*args, **kw).items():
+            self[path] = value
+
+    def setdefault(self, path, default=None):
+        if path not in self:
+            self[path] = default
+        return self[path]
+
+    def supersets(self, edges):
+        """Return every path that contains all of the provided edges, in the
+        order that the paths were added to the dict."""
+
+        if not edges:
+            return list(self)
+
+        try:
+            postings = sorted((self.edge_index[edge] for edge in edges), key=len)
+        except KeyError:
+            return []
+
+        # Start from the rarest edge so the candidate set is small
+        candidates = postings[0]
+        for posting in postings[1:]:
+            candidates = candidates.intersection(posting)
+            if not candidates:
+                return []
+
+        return sorted(candidates, key=self.order.__getitem__)
+
+
+class ReadStructureCache(dict):
+    """
+    Remembers how reads with a given intron chain were classified, keyed on
+    (chromosome, strand, splice sites). Only full splice matches that did
+    not add anything to the reference structures are stored, since those
+    stay valid as new vertices, edges and transcripts are appended. If an
+    existing transcript path is replaced, the cache empties itself.
+    Lookups are counted so that the hit rate can be logged.
+
+    Example:
+
+        cache = ReadStructureCache(transcript_dict)
+        cache[("chr1", "+", (200, 300))] = (vertex_IDs, edge_IDs, match)
+        cache.lookup(("chr1", "+", (200, 300)))  # -> (vertex_IDs, ...)
+
+    """
+
+    def __init__(self, transcript_dict):
+        dict.__init__(self)
+        self.transcript_dict = transcript_dict
+        self.generation = transcript_dict.generation
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Return the cached value for the key, or None if there isn't one"""
+        if self.transcript_dict.generation != self.generation:
+            self.clear()
+            self.generation = self.transcript_dict.generation
+
+        try:
+            value = self[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+
+class IntervalIndex(object):
+    """
+    An in-memory index of genomic intervals, binned by chromosome and strand.
+    Each bin keeps its intervals sorted by start position and tracks the
+    longest interval it holds, so an overlap query only has to look at the
+    intervals that start within one max-length of the query. Entries can be
+    added at any point and are always reported in the order they were added.
+
+    If group_by is set, entries are also grouped on that field so that all
+    entries sharing a value (e.g. a gene ID) can be fetched directly.
+
+    Example:
+
+        transcripts = IntervalIndex(group_by="gene_ID")
+        transcripts.add("chr1", "+", 100, 500, {"gene_ID": 1, ...})
+        transcripts.overlapping("chr1", 450, 900)  # -> [{"gene_ID": 1, ...}]
+        transcripts.lookup([1])                    # -> [{"gene_ID": 1, ...}]
+
+    """
+
+    def __init__(self, group_by=None):
+        self.group_by = group_by
+        self.entries = []
+        self.groups = {}
+        self.bins = {}
+        self.chrom_bins = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def add(self, chromosome, strand, start, end, entry):
+        """Add an entry covering the closed interval [start, end]"""
+        rank = len(self.entries)
+        self.entries.append(entry)
+
+        if self.group_by is not None:
+            try:
+                self.groups[entry[self.group_by]].append(rank)
+            except KeyError:
+                self.groups[entry[self.group_by]] = [rank]
+
+        key = (chromosome, strand)
+        if key not in self.bins:
+            self.bins[key] = _IntervalBin()
+            try:
+                self.chrom_bins[chromosome].append(self.bins[key])
+            except KeyError:
+                self.chrom_bins[chromosome] = [self.bins[key]]
+        self.bins[key].add(min(start, end), max(start, end), rank)
+
+    def overlapping(self, chromosome, start, end, strand=None):
+        """Return the entries whose interval overlaps the closed interval
+        [start, end] on the chromosome, in the order they were added. If
+        strand is None, both strands are searched."""
+        start, end = min(start, end), max(start, end)
+        if strand is None:
+            bins = self.chrom_bins.get(chromosome, [])
+        else:
+            bins = [self.bins[(chromosome, strand)]] if (chromosome, strand) in self.bins else []
+
+        ranks = []
+        for interval_bin in bins:
+            ranks.extend(interval_bin.overlapping(start, end))
+        return [self.entries[rank] for rank in sorted(ranks)]
+
+    def lookup(self, values):
+        """Return the entries whose group_by field is one of the provided
+        values, in the order they were added."""
+        ranks = []
+        for value in set(values):
+            ranks.extend(self.groups.get(value, []))
+        return [self.entries[rank] for rank in sorted(ranks)]
+
+
+class _IntervalBin(object):
+    """Intervals from one chromosome/strand, sorted lazily by start"""
+
+    def __init__(self):
+        self.starts = []
+        self.intervals = []
+        self.max_len = 0
+        self.is_sorted = True
+
+    def add(self, start, end, rank):
+        if self.intervals and start < self.intervals[-1][0]:
+            self.is_sorted = False
+        self.intervals.append((start, end, rank))
+        self.starts.append(start)
+        self.max_len = max(self.max_len, end - start)
+
+    def overlapping(self, start, end):
+        if not self.is_sorted:
+            self.intervals.sort()
+            self.starts = [interval[0] for interval in self.intervals]
+            self.is_sorted = True
+
+        first = bisect_left(self.starts, start - self.max_len)
+        last = bisect_right(self.starts, end)
+        return [rank for s, e, rank in self.intervals[first:last] if e >= start]
+
+
+class RefRow(dict):
+    """A row from a ReferenceTable. It behaves like a dict, but is a type of
+    its own so that known entries can still be told apart from the plain
+    dicts used for entries created during the run."""
+
+    __slots__ = ()
+
+
+class ReferenceTable(object):
+    """
+    A read-only table of reference rows, stored column by column in numpy
+    arrays and sorted by chromosome and start position so that the rows in
+    a region can be found by binary search. Integer columns are stored as
+    int64 arrays, columns with few distinct values as codes into a list of
+    levels, and any other text as a UTF-8 buffer with offsets.
+
+    Tables can be saved to a directory and loaded back memory-mapped, so
+    every process that loads the same table shares one copy of it through
+    the page cache. Queries return rows in the order the table was built
+    from, as RefRow dicts.
+
+    Example:
+
+        genes = ReferenceTable.from_rows(rows, "chromosome", "start", "end")
+        genes.save("talon_tmp/reference", "genes")
+        genes = ReferenceTable.load("talon_tmp/reference", "genes")
+        genes.query("chr1", 100, 500)               # rows overlapping
+        genes.query("chr1", 100, 500, within=True)  # rows inside
+
+    """
+
+    max_levels = 1024
+
+    def __init__(self, columns, arrays, chroms):
+        self.columns = columns
+        self.arrays = arrays
+        self.chroms = chroms
+        self.lo = arrays["_lo"]
+        self.hi = arrays["_hi"]
+        self.rank = arrays["_rank"]
+
+    def __len__(self):
+        return len(self.rank)
+
+    @classmethod
+    def from_rows(cls, rows, chrom_key, lo_key, hi_key):
+        """Build a table from a list of mappings (e.g. sqlite3.Row). Rows
+        without a chromosome or position can never match a query and are
+        left out."""
+        rows = [row for row in rows if None not in (row[chrom_key], row[lo_key], row[hi_key])]
+        names = list(rows[0].keys()) if rows else []
+
+        order = sorted(range(len(rows)), key=lambda i: (rows[i][chrom_key], rows[i][lo_key]))
+        rows = [rows[i] for i in order]
+
+        columns = {}
+        arrays = {
+            "_lo": np.array([row[lo_key] for row in rows], dtype=np.int64),
+            "_hi": np.array([row[hi_key] for row in rows], dtype=np.int64),
+            "_rank": np.array(order, dtype=np.int64),
+        }
+        for name in names:
+            values = [row[name] for row in rows]
+            if all(type(value) is int for value in values):
+                columns[name] = {"kind": "int"}
+                arrays[name] = np.array(values, dtype=np.int64)
+            elif len(set(values)) <= cls.max_levels:
+                levels = sorted(set(values), key=lambda x: (x is None, str(x)))
+                codes = {level: i for i, level in enumerate(levels)}
+                columns[name] = {"kind": "level", "levels": levels}
+                arrays[name] = np.array([codes[value] for value in values], dtype=np.int32)
+            elif all(value is None or type(value) is str for value in values):
+                encoded = [b"" if value is None else value.encode() for value in values]
+                columns[name] = {"kind": "text"}
+                arrays[name] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+                arrays[name + ".offsets"] = np.cumsum([0] + [len(x) for x in encoded], dtype=np.int64)
+                arrays[name + ".null"] = np.array([value is None for value in values], dtype=bool)
+            else:
+                raise ValueError("Column '%s' mixes types that can't be stored in a ReferenceTable" % name)
+
+        chroms = {}
+        for i, row in enumerate(rows):
+            chrom = row[chrom_key]
+            if chrom not in chroms:
+                chroms[chrom] = [i, i + 1, 0]
+            chroms[chrom][1] = i + 1
+            chroms[chrom][2] = max(chroms[chrom][2], row[hi_key] - row[lo_key])
+
+        return cls(columns, arrays, chroms)
+
+    def save(self, directory, name):
+        """Write the table to files prefixed with name in the directory"""
+        for key, array in self.arrays.items():
+            np.save(os.path.join(directory, "%s.%s.npy" % (name, key)), array)
+        with open(os.path.join(directory, name + ".json"), "w") as f:
+            json.dump({"columns": self.columns, "chroms": self.chroms}, f)
+
+    @classmethod
+    def load(cls, directory, name):
+        """Load a saved table, memory-mapping its arrays"""
+        with open(os.path.join(directory, name + ".json")) as f:
+            meta = json.load(f)
+        columns = meta["columns"]
+
+        keys = ["_lo", "_hi", "_rank"]
+        for column, info in columns.items():
+            keys.append(column)
+            if info["kind"] == "text":
+                keys.extend([column + ".offsets", column + ".null"])
+
+        arrays = {}
+        for key in keys:
+            path = os.path.join(directory, "%s.%s.npy" % (name, key))
+            try:
+                arrays[key] = np.load(path, mmap_mode="r")
+            except ValueError:
+                # Empty arrays can't be memory-mapped
+                arrays[key] = np.load(path)
+
+        return cls(columns, arrays, meta["chroms"])
+
+    def query(self, chrom, start, end, within=False, columns=None, where=None):
+        """Return the rows that overlap the closed interval [start, end] on
+        the chromosome, or with within=True, the rows that lie entirely
+        inside it. columns maps output field names to table columns
+        (default: all columns), and where is an optional (column, value)
+        pair that rows must match."""
+
+        if chrom not in self.chroms:
+            return []
+        first, last, max_len = self.chroms[chrom]
+        lo = self.lo[first:last]
+
+        if within:
+            i = np.searchsorted(lo, start, side="left")
+            j = np.searchsorted(lo, end, side="right")
+            idx = np.arange(first + i, first + j)
+            idx = idx[self.hi[idx] <= end]
+        else:
+            i = np.searchsorted(lo, start - max_len, side="left")
+            j = np.searchsorted(lo, end, side="right")
+            idx = np.arange(first + i, first + j)
+            idx = idx[self.hi[idx] >= start]
+
+        if where is not None:
+            column, value = where
+            idx = idx[self.arrays[column][idx] == value]
+
+        idx = idx[np.argsort(self.rank[idx], kind="stable")]
+        return self.select(idx, columns)
+
+    def rows(self, columns=None):
+        """Return every row of the table, in the order the table was built
+        from"""
+        idx = np.argsort(self.rank, kind="stable")
+        return self.select(idx, columns)
+
+    def select(self, idx, columns=None):
+        """Return the rows at the provided positions as RefRow dicts"""
+        if columns is None:
+            columns = {name: name for name in self.columns}
+        values = [self.column_values(column, idx) for column in columns.values()]
+        names = list(columns)
+        return [RefRow(zip(names, row)) for row in zip(*values)]
+
+    def column_values(self, column, idx):
+        """Decode a column at the provided row positions to Python values"""
+        info = self.columns[column]
+        array = self.arrays[column]
+        if info["kind"] == "int":
+            return array[idx].tolist()
+        if info["kind"] == "level":
+            levels = info["levels"]
+            return [levels[code] for code in array[idx].tolist()]
+
+        offsets = self.arrays[column + ".offsets"]
+        null = self.arrays[column + ".null"]
+        values = []
+        for i in idx.tolist():
+            if null[i]:
+                values.append(None)
+            else:
+                values.append(bytes(array[offsets[i] : offsets[i + 1]]).decode())
+        return values
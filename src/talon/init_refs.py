@@ -4,21 +4,36 @@
 # Contains functions that query the database to initialize various data
 # structures for the TALON run.
 # ---------------------------------------------------------------------
-# make_temp_novel_gene_table
-# make_temp_monoexonic_transcript_table
+# make_gene_interval_index
+# make_transcript_interval_index
+# make_monoexon_interval_index
 # make_location_dict
 # make_edge_dict
 # make_transcript_dict
+# make_known_splice_chains
 # make_vertex_2_gene_dict
 # make_gene_start_and_end_dict
-
+# make_reference_tables
+# load_reference_tables
+# load_reference_snapshot
+
+import json
+import logging
+import os
+import shutil
 from string import Template
 
 import pandas as pd
 
+from .dstruct import IntervalIndex, PathDict, PositionDict, ReadStructureCache, ReferenceTable, Struct
+
+# Reference tables already loaded by this process, by directory
+_loaded_references = {}
+
 
-def make_temp_novel_gene_table(cursor, build, chrom=None, start=None, end=None, tmp_tab="temp_gene"):
-    """Attaches a temporary database with a table that has the following fields:
+def make_gene_interval_index(cursor, build, chrom=None, start=None, end=None, reference=None):
+    """Builds an in-memory interval index of the genes in the database (or
+    those overlapping the provided region). Each entry has these fields:
         - gene_ID
         - chromosome
         - start
@@ -26,195 +41,223 @@ def make_temp_novel_gene_table(cursor, build, chrom=None, start=None, end=None,
         - strand
     The purpose is to track novel genes from this run in order to match
     transcripts to them when other forms of gene assignment have failed.
+    If reference tables are provided, the region is read from those instead
+    of the database.
     """
+    gene_index = IntervalIndex(group_by="gene_ID")
+    if reference is not None and None not in [chrom, start, end]:
+        for gene in reference.genes.query(chrom, start, end):
+            gene_index.add(gene["chromosome"], gene["strand"], gene["start"], gene["end"], gene)
+        return gene_index
+
     if any(val == None for val in [chrom, start, end]):
-        command = Template(
-            """ CREATE TEMPORARY TABLE IF NOT EXISTS $tmp_tab AS
-                                   SELECT gene_ID,
-                                     chromosome,
-                                     start,
-                                     end,
-                                     strand
-                                    FROM (SELECT g.gene_ID,
-                                              loc.chromosome,
-                                              MIN(loc.position) as start,
-                                              MAX(loc.position) as end,
-                                              g.strand
-                                        FROM genes as g
-                                        LEFT JOIN vertex as v ON g.gene_ID = v.gene_ID
-                                        LEFT JOIN location as loc ON loc.location_ID = v.vertex_ID
-                                        WHERE loc.genome_build = '$build'
-                                        GROUP BY g.gene_ID); """
+        query = Template(
+            """ SELECT g.gene_ID,
+                       x.chromosome,
+                       x.min_pos as start,
+                       x.max_pos as end,
+                       g.strand
+                FROM gene_extent as x
+                JOIN genes as g ON g.gene_ID = x.gene_ID
+                WHERE x.genome_build = '$build'
+                ORDER BY g.gene_ID; """
         )
     else:
-        command = Template(
-            """ CREATE TEMPORARY TABLE IF NOT EXISTS $tmp_tab AS
-                                   SELECT gene_ID,
-                                     chromosome,
-                                     start,
-                                     end,
-                                     strand
-                                    FROM (SELECT g.gene_ID,
-                                              loc.chromosome,
-                                              MIN(loc.position) as start,
-                                              MAX(loc.position) as end,
-                                              g.strand
-                                        FROM genes as g
-                                        LEFT JOIN vertex as v ON g.gene_ID = v.gene_ID
-                                        LEFT JOIN location as loc ON loc.location_ID = v.vertex_ID
-                                        WHERE loc.genome_build = '$build'
-                                        GROUP BY g.gene_ID)
-                                    WHERE chromosome = '$chrom'
-                                        AND ((start <= $start AND end >= $end)
-                                          OR (start >= $start AND end <= $end)
-                                          OR (start >= $start AND start <= $end)
-                                          OR (end >= $start AND end <= $end)); """
+        query = Template(
+            """ SELECT g.gene_ID,
+                       x.chromosome,
+                       x.min_pos as start,
+                       x.max_pos as end,
+                       g.strand
+                FROM gene_extent_rtree as r
+                JOIN gene_extent as x ON x.extent_ID = r.extent_ID
+                JOIN genes as g ON g.gene_ID = x.gene_ID
+                WHERE r.min_pos <= $end AND r.max_pos >= $start
+                    AND x.genome_build = '$build'
+                    AND x.chromosome = '$chrom'
+                    AND x.min_pos <= $end AND x.max_pos >= $start
+                ORDER BY g.gene_ID; """
         )
 
-    command = command.substitute({"tmp_tab": tmp_tab, "build": build, "chrom": chrom, "start": start, "end": end})
-    cursor.execute(command)
+    query = query.substitute({"build": build, "chrom": chrom, "start": start, "end": end})
+    cursor.execute(query)
+
+    for gene in cursor.fetchall():
+        gene_index.add(gene["chromosome"], gene["strand"], gene["start"], gene["end"], gene)
 
-    return tmp_tab
+    return gene_index
 
 
-def make_temp_transcript_table(cursor, build, chrom=None, start=None, end=None, tmp_tab="temp_transcript"):
-    """Attaches a temporary database with a table that has the following fields:
+def make_transcript_interval_index(cursor, build, chrom=None, start=None, end=None, reference=None):
+    """Builds an in-memory interval index of the transcripts in the database
+    (or those overlapping the provided region). Each entry has these fields:
         - gene_ID
         - transcript_ID
         - chromosome
-        - start (min position)
-        - end (max position)
         - strand
+        - min_pos
+        - max_pos
     The purpose is to allow location-based matching tiebreaking
-    transcripts."""
+    transcripts. If reference tables are provided, the region is read from
+    those instead of the database."""
 
+    if reference is not None and None not in [chrom, start, end]:
+        transcripts = reference.transcripts.query(chrom, start, end, columns=TRANSCRIPT_INDEX_COLUMNS)
+    else:
+        transcripts = query_transcript_interval_rows(cursor, build, chrom, start, end)
+
+    transcript_index = IntervalIndex(group_by="gene_ID")
+    for transcript in transcripts:
+        transcript_index.add(
+            transcript["chromosome"], transcript["strand"], transcript["min_pos"], transcript["max_pos"], transcript
+        )
+
+    return transcript_index
+
+
+def query_transcript_interval_rows(cursor, build, chrom, start, end):
     if any(val == None for val in [chrom, start, end]):
-        command = Template(
-            """ CREATE TEMPORARY TABLE IF NOT EXISTS $tmp_tab AS
-                                   SELECT t.gene_ID,
-                                      t.transcript_ID,
-                                      loc1.chromosome,
-                                      genes.strand,
-                                      MIN(loc1.position, loc2.position) as min_pos,
-                                      MAX(loc1.position, loc2.position) as max_pos
-                                   FROM transcripts as t
-                                   LEFT JOIN location as loc1
-                                       ON loc1.location_ID = t.start_vertex
-                                   LEFT JOIN location as loc2
-                                       ON loc2.location_ID = t.end_vertex
-                                   LEFT JOIN genes
-                                       ON genes.gene_ID = t.gene_ID
-                                   WHERE loc1.genome_build = '$build'
-                                       AND loc2.genome_build = '$build' """
+        query = Template(
+            """ SELECT t.gene_ID,
+                       t.transcript_ID,
+                       x.chromosome,
+                       genes.strand,
+                       x.min_pos,
+                       x.max_pos
+                FROM transcript_extent as x
+                JOIN transcripts as t ON t.transcript_ID = x.transcript_ID
+                LEFT JOIN genes
+                    ON genes.gene_ID = t.gene_ID
+                WHERE x.genome_build = '$build'
+                ORDER BY t.transcript_ID """
         )
     else:
-        command = Template(
-            """ CREATE TEMPORARY TABLE IF NOT EXISTS $tmp_tab AS
-                                   SELECT t.gene_ID,
-                                      t.transcript_ID,
-                                      loc1.chromosome,
-                                      genes.strand,
-                                      t.start_exon as exon_ID,
-                                      MIN(loc1.position, loc2.position) as min_pos,
-                                      MAX(loc1.position, loc2.position) as max_pos
-                                   FROM transcripts as t
-                                   LEFT JOIN location as loc1
-                                       ON loc1.location_ID = t.start_vertex
-                                   LEFT JOIN location as loc2
-                                       ON loc2.location_ID = t.end_vertex
-                                   LEFT JOIN genes
-                                       ON genes.gene_ID = t.gene_ID
-                                   WHERE loc1.genome_build = '$build'
-                                   AND loc2.genome_build = '$build'
-                                   AND loc1.chromosome = '$chrom'
-                                   AND ((min_pos <= $start AND max_pos >= $end)
-                                       OR (min_pos >= $start AND max_pos <= $end)
-                                       OR (min_pos >= $start AND min_pos <= $end)
-                                       OR (max_pos >= $start AND max_pos <= $end))"""
+        query = Template(
+            """ SELECT t.gene_ID,
+                       t.transcript_ID,
+                       x.chromosome,
+                       genes.strand,
+                       x.min_pos,
+                       x.max_pos
+                FROM transcript_extent_rtree as r
+                JOIN transcript_extent as x ON x.extent_ID = r.extent_ID
+                JOIN transcripts as t ON t.transcript_ID = x.transcript_ID
+                LEFT JOIN genes
+                    ON genes.gene_ID = t.gene_ID
+                WHERE r.min_pos <= $end AND r.max_pos >= $start
+                    AND x.genome_build = '$build'
+                    AND x.chromosome = '$chrom'
+                    AND x.min_pos <= $end AND x.max_pos >= $start
+                ORDER BY t.transcript_ID """
         )
 
-    command = command.substitute({"build": build, "chrom": chrom, "start": start, "end": end, "tmp_tab": tmp_tab})
-    cursor.execute(command)
-
-    return tmp_tab
+    query = query.substitute({"build": build, "chrom": chrom, "start": start, "end": end})
+    cursor.execute(query)
+    return cursor.fetchall()
 
 
-def make_temp_monoexonic_transcript_table(cursor, build, chrom=None, start=None, end=None, tmp_tab="temp_monoexon"):
-    """Attaches a temporary database with a table that has the following fields:
+def make_monoexon_interval_index(cursor, build, chrom=None, start=None, end=None, reference=None):
+    """Builds an in-memory interval index of the monoexonic transcripts in
+    the database (or those overlapping the provided region). Each entry has
+    these fields:
         - gene_ID
         - transcript_ID
         - chromosome
-        - start (min position)
-        - end (max position)
+        - start
+        - end
         - strand
+        - start_vertex
+        - end_vertex
+        - exon_ID
+        - min_pos
+        - max_pos
     The purpose is to allow location-based matching for monoexonic query
-    transcripts."""
+    transcripts. If reference tables are provided, the region is read from
+    those instead of the database."""
 
-    if any(val == None for val in [chrom, start, end]):
-        command = Template(
-            """ CREATE TEMPORARY TABLE IF NOT EXISTS $tmp_tab AS
-                                   SELECT t.gene_ID,
-                                      t.transcript_ID,
-                                      loc1.chromosome,
-                                      loc1.position as start,
-                                      loc2.position as end,
-                                      genes.strand,
-                                      t.start_vertex,
-                                      t.end_vertex,
-                                      t.start_exon as exon_ID,
-                                      MIN(loc1.position, loc2.position) as min_pos,
-                                      MAX(loc1.position, loc2.position) as max_pos
-                                   FROM transcripts as t
-                                   LEFT JOIN location as loc1
-                                       ON loc1.location_ID = t.start_vertex
-                                   LEFT JOIN location as loc2
-                                       ON loc2.location_ID = t.end_vertex
-                                   LEFT JOIN genes
-                                       ON genes.gene_ID = t.gene_ID
-                                   WHERE n_exons = 1
-                                       AND loc1.genome_build = '$build'
-                                       AND loc2.genome_build = '$build' """
+    if reference is not None and None not in [chrom, start, end]:
+        transcripts = reference.transcripts.query(
+            chrom, start, end, columns=MONOEXON_INDEX_COLUMNS, where=("n_exons", 1)
         )
     else:
-        command = Template(
-            """ CREATE TEMPORARY TABLE IF NOT EXISTS $tmp_tab AS
-                                   SELECT t.gene_ID,
-                                      t.transcript_ID,
-                                      loc1.chromosome,
-                                      loc1.position as start,
-                                      loc2.position as end,
-                                      genes.strand,
-                                      t.start_vertex,
-                                      t.end_vertex,
-                                      t.start_exon as exon_ID,
-                                      MIN(loc1.position, loc2.position) as min_pos,
-                                      MAX(loc1.position, loc2.position) as max_pos
-                                   FROM transcripts as t
-                                   LEFT JOIN location as loc1
-                                       ON loc1.location_ID = t.start_vertex
-                                   LEFT JOIN location as loc2
-                                       ON loc2.location_ID = t.end_vertex
-                                   LEFT JOIN genes
-                                       ON genes.gene_ID = t.gene_ID
-                                   WHERE n_exons = 1
-                                   AND loc1.genome_build = '$build'
-                                   AND loc2.genome_build = '$build'
-                                   AND loc1.chromosome = '$chrom'
-                                   AND ((min_pos <= $start AND max_pos >= $end)
-                                       OR (min_pos >= $start AND max_pos <= $end)
-                                       OR (min_pos >= $start AND min_pos <= $end)
-                                       OR (max_pos >= $start AND max_pos <= $end))"""
+        transcripts = query_monoexon_interval_rows(cursor, build, chrom, start, end)
+
+    monoexon_index = IntervalIndex()
+    for transcript in transcripts:
+        monoexon_index.add(
+            transcript["chromosome"], transcript["strand"], transcript["min_pos"], transcript["max_pos"], transcript
         )
 
-    command = command.substitute({"build": build, "chrom": chrom, "start": start, "end": end, "tmp_tab": tmp_tab})
-    cursor.execute(command)
+    return monoexon_index
 
-    return tmp_tab
+
+def query_monoexon_interval_rows(cursor, build, chrom, start, end):
+    if any(val == None for val in [chrom, start, end]):
+        query = Template(
+            """ SELECT t.gene_ID,
+                       t.transcript_ID,
+                       x.chromosome,
+                       loc1.position as start,
+                       loc2.position as end,
+                       genes.strand,
+                       t.start_vertex,
+                       t.end_vertex,
+                       t.start_exon as exon_ID,
+                       x.min_pos,
+                       x.max_pos
+                FROM transcript_extent as x
+                JOIN transcripts as t ON t.transcript_ID = x.transcript_ID
+                JOIN location as loc1
+                    ON loc1.location_ID = t.start_vertex AND loc1.genome_build = x.genome_build
+                JOIN location as loc2
+                    ON loc2.location_ID = t.end_vertex AND loc2.genome_build = x.genome_build
+                LEFT JOIN genes
+                    ON genes.gene_ID = t.gene_ID
+                WHERE t.n_exons = 1
+                    AND x.genome_build = '$build'
+                ORDER BY t.transcript_ID """
+        )
+    else:
+        query = Template(
+            """ SELECT t.gene_ID,
+                       t.transcript_ID,
+                       x.chromosome,
+                       loc1.position as start,
+                       loc2.position as end,
+                       genes.strand,
+                       t.start_vertex,
+                       t.end_vertex,
+                       t.start_exon as exon_ID,
+                       x.min_pos,
+                       x.max_pos
+                FROM transcript_extent_rtree as r
+                JOIN transcript_extent as x ON x.extent_ID = r.extent_ID
+                JOIN transcripts as t ON t.transcript_ID = x.transcript_ID
+                JOIN location as loc1
+                    ON loc1.location_ID = t.start_vertex AND loc1.genome_build = x.genome_build
+                JOIN location as loc2
+                    ON loc2.location_ID = t.end_vertex AND loc2.genome_build = x.genome_build
+                LEFT JOIN genes
+                    ON genes.gene_ID = t.gene_ID
+                WHERE r.min_pos <= $end AND r.max_pos >= $start
+                    AND t.n_exons = 1
+                    AND x.genome_build = '$build'
+                    AND x.chromosome = '$chrom'
+                    AND x.min_pos <= $end AND x.max_pos >= $start
+                ORDER BY t.transcript_ID """
+        )
+
+    query = query.substitute({"build": build, "chrom": chrom, "start": start, "end": end})
+    cursor.execute(query)
+    return cursor.fetchall()
 
 
-def make_location_dict(genome_build, cursor, chrom=None, start=None, end=None):
+def make_location_dict(genome_build, cursor, chrom=None, start=None, end=None, reference=None):
     """Format of dict:
-    chromosome -> dict(position -> SQLite3 row from location table)
+    chromosome -> PositionDict(position -> SQLite3 row from location table)
+
+    The per-chromosome PositionDict keeps its positions sorted so that
+    permissive start/end matching can search it by bisection.
 
     old:
         Key: chromosome, pos
@@ -222,19 +265,24 @@ def make_location_dict(genome_build, cursor, chrom=None, start=None, end=None):
     """
     location_dict = {}
 
-    if any(val == None for val in [chrom, start, end]):
-        query = Template("""SELECT * FROM location WHERE genome_build = '$build' """)
+    if reference is not None and None not in [chrom, start, end]:
+        locations = reference.locations.query(chrom, start, end)
     else:
-        query = Template(
-            """SELECT * FROM location
-                            WHERE genome_build = '$build'
-                            AND chromosome = '$chrom'
-                            AND position >= $start
-                            AND position <= $end"""
-        )
-    query = query.substitute({"build": genome_build, "chrom": chrom, "start": start, "end": end})
-    cursor.execute(query)
-    for location in cursor.fetchall():
+        if any(val == None for val in [chrom, start, end]):
+            query = Template("""SELECT * FROM location WHERE genome_build = '$build' """)
+        else:
+            query = Template(
+                """SELECT * FROM location
+                                WHERE genome_build = '$build'
+                                AND chromosome = '$chrom'
+                                AND position >= $start
+                                AND position <= $end"""
+            )
+        query = query.substitute({"build": genome_build, "chrom": chrom, "start": start, "end": end})
+        cursor.execute(query)
+        locations = cursor.fetchall()
+
+    for location in locations:
         chromosome = location["chromosome"]
         position = location["position"]
         try:
@@ -242,15 +290,34 @@ def make_location_dict(genome_build, cursor, chrom=None, start=None, end=None):
         except:
             location_dict[chromosome] = {position: location}
 
+    for chromosome in location_dict:
+        location_dict[chromosome] = PositionDict(location_dict[chromosome])
+
     return location_dict
 
 
-def make_edge_dict(cursor, build=None, chrom=None, start=None, end=None):
+def make_edge_dict(cursor, build=None, chrom=None, start=None, end=None, reference=None):
     """Format of dict:
     Key: vertex1_vertex2_type
     Value: SQLite3 row from edge table
     """
     edge_dict = {}
+    if reference is not None and None not in [chrom, start, end]:
+        edges = reference.edges.query(chrom, start, end, within=True, columns=EDGE_COLUMNS)
+    else:
+        edges = query_edge_rows(cursor, build, chrom, start, end)
+
+    for edge in edges:
+        vertex_1 = edge["v1"]
+        vertex_2 = edge["v2"]
+        edge_type = edge["edge_type"]
+        key = (vertex_1, vertex_2, edge_type)
+        edge_dict[key] = edge
+
+    return edge_dict
+
+
+def query_edge_rows(cursor, build, chrom, start, end):
     if any(val == None for val in [chrom, start, end, build]):
         query = """SELECT * FROM edge"""
     else:
@@ -267,22 +334,36 @@ def make_edge_dict(cursor, build=None, chrom=None, start=None, end=None):
         )
         query = query.substitute({"build": build, "chrom": chrom, "start": start, "end": end})
     cursor.execute(query)
-    for edge in cursor.fetchall():
-        vertex_1 = edge["v1"]
-        vertex_2 = edge["v2"]
-        edge_type = edge["edge_type"]
-        key = (vertex_1, vertex_2, edge_type)
-        edge_dict[key] = edge
+    return cursor.fetchall()
 
-    return edge_dict
 
-
-def make_transcript_dict(cursor, build, chrom=None, start=None, end=None):
+def make_transcript_dict(cursor, build, chrom=None, start=None, end=None, reference=None):
     """Format of dict:
-    Key: tuple consisting of edges in transcript path
+    Key: frozenset consisting of edges in transcript path
     Value: SQLite3 row from transcript table
+
+    The PathDict also indexes each path by its edges, which is what
+    search_for_ISM uses to find candidate matches.
     """
-    transcript_dict = {}
+    transcript_dict = PathDict()
+    if reference is not None and None not in [chrom, start, end]:
+        transcripts = reference.transcripts.query(chrom, start, end, columns=TRANSCRIPT_DICT_COLUMNS)
+    else:
+        transcripts = query_transcript_rows(cursor, build, chrom, start, end)
+
+    for transcript in transcripts:
+        transcript_path = transcript["jn_path"]
+        if transcript_path != None:
+            transcript_path = transcript_path.split(",") + [transcript["start_exon"], transcript["end_exon"]]
+            transcript_path = frozenset([int(x) for x in transcript_path])
+        else:
+            transcript_path = frozenset([transcript["start_exon"]])
+        transcript_dict[transcript_path] = transcript
+
+    return transcript_dict
+
+
+def query_transcript_rows(cursor, build, chrom, start, end):
     if any(val == None for val in [chrom, start, end]):
         query = Template(
             """SELECT t.*,
@@ -317,21 +398,87 @@ def make_transcript_dict(cursor, build, chrom=None, start=None, end=None):
 
     query = query.substitute({"build": build, "chrom": chrom, "start": start, "end": end})
     cursor.execute(query)
-    for transcript in cursor.fetchall():
-        transcript_path = transcript["jn_path"]
-        if transcript_path != None:
-            transcript_path = transcript_path.split(",") + [transcript["start_exon"], transcript["end_exon"]]
-            transcript_path = frozenset([int(x) for x in transcript_path])
-        else:
-            transcript_path = frozenset([transcript["start_exon"]])
-        transcript_dict[transcript_path] = transcript
+    return cursor.fetchall()
 
-    return transcript_dict
 
+def make_known_splice_chains(transcript_dict, edge_dict, location_dict):
+    """Precomputes the internal splice site chain of every multi-exon
+    transcript in the transcript dict, so that reads with exactly that chain
+    can be matched to the transcript without going through vertex and edge
+    matching. Format of the returned cache:
+    Key: (chromosome, strand, splice site positions in 5' to 3' order)
+    Value: (splice vertex IDs, splice edge IDs, transcript)
 
-def make_vertex_2_gene_dict(cursor, build=None, chrom=None, start=None, end=None):
+    When several transcripts share a chain, the one that comes first in
+    the transcript dict is kept, since that is the one process_FSM would
+    pick. Transcripts with vertices or edges that fall outside the loaded
+    structures are skipped.
+    """
+    vertex_locations = {}
+    for chrom_locs in location_dict.values():
+        for location in chrom_locs.values():
+            vertex_locations[location["location_ID"]] = location
+
+    edges_by_ID = {}
+    for edge in edge_dict.values():
+        edges_by_ID[edge["edge_ID"]] = edge
+
+    known_chains = ReadStructureCache(transcript_dict)
+    for transcript in transcript_dict.values():
+        if transcript["jn_path"] == None:
+            continue
+        edge_IDs = tuple(int(x) for x in transcript["jn_path"].split(","))
+        if transcript["n_exons"] != (len(edge_IDs) + 3) // 2:
+            continue
+        try:
+            edges = [edges_by_ID[edge_ID] for edge_ID in edge_IDs]
+            vertex_IDs = [edges[0]["v1"]] + [edge["v2"] for edge in edges]
+            locations = [vertex_locations[vertex_ID] for vertex_ID in vertex_IDs]
+        except KeyError:
+            continue
+
+        # Reads look up introns and exons alternately along a connected chain
+        edge_types = [edge["edge_type"] for edge in edges]
+        if edge_types != ["intron", "exon"] * (len(edges) // 2) + ["intron"]:
+            continue
+        if any(edges[i]["v2"] != edges[i + 1]["v1"] for i in range(len(edges) - 1)):
+            continue
+
+        chromosome = locations[0]["chromosome"]
+        if any(location["chromosome"] != chromosome for location in locations):
+            continue
+        positions = tuple(location["position"] for location in locations)
+        strand = "+" if positions[0] < positions[1] else "-"
+        key = (chromosome, strand, positions)
+        if key not in known_chains:
+            known_chains[key] = (tuple(vertex_IDs), edge_IDs, transcript)
+
+    return known_chains
+
+
+def make_vertex_2_gene_dict(cursor, build=None, chrom=None, start=None, end=None, reference=None):
     """Create a dictionary that maps vertices to the genes that they belong to."""
     vertex_2_gene = {}
+    if reference is not None and None not in [chrom, start, end]:
+        vertices = reference.vertex_genes.query(chrom, start, end, columns=VERTEX_GENE_COLUMNS)
+    else:
+        vertices = query_vertex_gene_rows(cursor, build, chrom, start, end)
+
+    for vertex_line in vertices:
+        vertex = vertex_line["vertex_ID"]
+        gene = vertex_line["gene_ID"]
+        strand = vertex_line["strand"]
+
+        if vertex in vertex_2_gene:
+            vertex_2_gene[vertex].add((gene, strand))
+        else:
+            vertex_2_gene[vertex] = set()
+            vertex_2_gene[vertex].add((gene, strand))
+
+    return vertex_2_gene
+
+
+def query_vertex_gene_rows(cursor, build, chrom, start, end):
     if any(val == None for val in [chrom, start, end, build]):
         query = """SELECT vertex_ID,
                           vertex.gene_ID,
@@ -354,33 +501,24 @@ def make_vertex_2_gene_dict(cursor, build=None, chrom=None, start=None, end=None
         query = query.substitute({"build": build, "chrom": chrom, "start": start, "end": end})
 
     cursor.execute(query)
-    for vertex_line in cursor.fetchall():
-        vertex = vertex_line["vertex_ID"]
-        gene = vertex_line["gene_ID"]
-        strand = vertex_line["strand"]
-
-        if vertex in vertex_2_gene:
-            vertex_2_gene[vertex].add((gene, strand))
-        else:
-            vertex_2_gene[vertex] = set()
-            vertex_2_gene[vertex].add((gene, strand))
-
-    return vertex_2_gene
+    return cursor.fetchall()
 
 
-def make_gene_start_or_end_dict(cursor, build, mode, chrom=None, start=None, end=None):
+def make_gene_start_or_end_dict(cursor, build, mode, chrom=None, start=None, end=None, reference=None):
     """Select the starts (or ends) of known genes in the database and store
     in a dict.
     Format of dict:
         Key: gene ID from database
-        Value: dict mapping positions to start vertices (or end vertices) of
-               KNOWN transcripts from that gene
+        Value: PositionDict mapping positions to start vertices (or end
+               vertices) of KNOWN transcripts from that gene
     """
     if mode not in ["start", "end"]:
         raise ValueError(("Incorrect mode supplied to 'make_gene_start_or_end_dict'." " Expected 'start' or 'end'."))
 
     output_dict = {}
-    if any(val == None for val in [chrom, start, end]):
+    if reference is not None and None not in [chrom, start, end]:
+        entries = reference["gene_%ss" % mode].query(chrom, start, end, columns=GENE_END_COLUMNS[mode])
+    elif any(val == None for val in [chrom, start, end]):
         query = """SELECT gene_ID,
                           %s_vertex as vertex,
                           loc1.position as %s
@@ -393,6 +531,7 @@ def make_gene_start_or_end_dict(cursor, build, mode, chrom=None, start=None, end
                          AND ta.value = 'KNOWN'
                          AND loc1.genome_build = '%s' """
         cursor.execute(query % (mode, mode, mode, build))
+        entries = cursor.fetchall()
 
     else:
         query = Template(
@@ -414,8 +553,9 @@ def make_gene_start_or_end_dict(cursor, build, mode, chrom=None, start=None, end
         )
         query = query.substitute({"build": build, "chrom": chrom, "start": start, "end": end, "mode": mode})
         cursor.execute(query)
+        entries = cursor.fetchall()
 
-    for entry in cursor.fetchall():
+    for entry in entries:
         gene_ID = entry["gene_ID"]
         vertex = entry["vertex"]
         pos = entry[mode]
@@ -426,4 +566,208 @@ def make_gene_start_or_end_dict(cursor, build, mode, chrom=None, start=None, end
             output_dict[gene_ID] = {}
             output_dict[gene_ID][pos] = vertex
 
+    for gene_ID in output_dict:
+        output_dict[gene_ID] = PositionDict(output_dict[gene_ID])
+
     return output_dict
+
+
+# Fields of the rows that the region queries above return, mapped to the
+# reference table columns that they are read from
+TRANSCRIPT_DICT_COLUMNS = {
+    name: name
+    for name in [
+        "transcript_ID",
+        "gene_ID",
+        "start_exon",
+        "jn_path",
+        "end_exon",
+        "start_vertex",
+        "end_vertex",
+        "n_exons",
+        "chrom",
+        "start_pos",
+        "end_pos",
+        "min_pos",
+        "max_pos",
+    ]
+}
+TRANSCRIPT_INDEX_COLUMNS = {
+    "gene_ID": "gene_ID",
+    "transcript_ID": "transcript_ID",
+    "chromosome": "chrom",
+    "strand": "gene_strand",
+    "min_pos": "min_pos",
+    "max_pos": "max_pos",
+}
+MONOEXON_INDEX_COLUMNS = {
+    "gene_ID": "gene_ID",
+    "transcript_ID": "transcript_ID",
+    "chromosome": "chrom",
+    "start": "start_pos",
+    "end": "end_pos",
+    "strand": "gene_strand",
+    "start_vertex": "start_vertex",
+    "end_vertex": "end_vertex",
+    "exon_ID": "start_exon",
+    "min_pos": "min_pos",
+    "max_pos": "max_pos",
+}
+EDGE_COLUMNS = {name: name for name in ["edge_ID", "v1", "v2", "edge_type", "strand"]}
+VERTEX_GENE_COLUMNS = {name: name for name in ["vertex_ID", "gene_ID", "strand"]}
+GENE_END_COLUMNS = {mode: {name: name for name in ["gene_ID", "vertex", "chrom", mode]} for mode in ["start", "end"]}
+
+
+def make_reference_tables(cursor, build, directory):
+    """Runs the reference queries once for the whole genome build and saves
+    the results as ReferenceTables in the directory. Worker processes can
+    then load the tables memory-mapped and share them, instead of each
+    querying the database for its own region. Returns the loaded tables.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    queries = {
+        "genes": (
+            """ SELECT g.gene_ID,
+                       x.chromosome,
+                       x.min_pos as start,
+                       x.max_pos as end,
+                       g.strand
+                FROM gene_extent as x
+                JOIN genes as g ON g.gene_ID = x.gene_ID
+                WHERE x.genome_build = '$build'
+                ORDER BY g.gene_ID """,
+            ("chromosome", "start", "end"),
+        ),
+        "transcripts": (
+            """ SELECT t.*,
+                       loc1.chromosome as chrom,
+                       loc1.position as start_pos,
+                       loc2.position as end_pos,
+                       MIN(loc1.position, loc2.position) as min_pos,
+                       MAX(loc1.position, loc2.position) as max_pos,
+                       genes.strand as gene_strand
+                FROM transcripts AS t
+                LEFT JOIN location as loc1 ON t.start_vertex = loc1.location_ID
+                LEFT JOIN location as loc2 ON t.end_vertex = loc2.location_ID
+                LEFT JOIN genes ON genes.gene_ID = t.gene_ID
+                WHERE loc1.genome_build = '$build' AND loc2.genome_build = '$build' """,
+            ("chrom", "min_pos", "max_pos"),
+        ),
+        "locations": (
+            """SELECT * FROM location WHERE genome_build = '$build' """,
+            ("chromosome", "position", "position"),
+        ),
+        "edges": (
+            """ SELECT e.*,
+                       loc1.chromosome as chrom,
+                       MIN(loc1.position, loc2.position) as min_pos,
+                       MAX(loc1.position, loc2.position) as max_pos
+                FROM edge AS e
+                LEFT JOIN location as loc1 ON e.v1 = loc1.location_ID
+                LEFT JOIN location as loc2 ON e.v2 = loc2.location_ID
+                WHERE loc1.genome_build = '$build' AND loc2.genome_build = '$build' """,
+            ("chrom", "min_pos", "max_pos"),
+        ),
+        "vertex_genes": (
+            """ SELECT vertex_ID,
+                       vertex.gene_ID,
+                       strand,
+                       loc.chromosome as chrom,
+                       loc.position as position
+                FROM vertex
+                LEFT JOIN genes ON vertex.gene_ID = genes.gene_ID
+                LEFT JOIN location AS loc ON vertex.vertex_ID = loc.location_ID
+                WHERE loc.genome_build = '$build' """,
+            ("chrom", "position", "position"),
+        ),
+    }
+    for mode in ["start", "end"]:
+        queries["gene_%ss" % mode] = (
+            Template(
+                """ SELECT gene_ID,
+                           ${mode}_vertex as vertex,
+                           loc1.chromosome as chrom,
+                           loc1.position as $mode
+                    FROM transcripts
+                    LEFT JOIN transcript_annotations as ta
+                        ON ta.ID = transcripts.transcript_ID
+                    LEFT JOIN location as loc1
+                        ON transcripts.${mode}_vertex = loc1.location_ID
+                    WHERE ta.attribute = 'transcript_status'
+                          AND ta.value = 'KNOWN'
+                          AND loc1.genome_build = '$$build' """
+            ).substitute({"mode": mode}),
+            ("chrom", mode, mode),
+        )
+
+    for name, (query, keys) in queries.items():
+        cursor.execute(Template(query).substitute({"build": build}))
+        ReferenceTable.from_rows(cursor.fetchall(), *keys).save(directory, name)
+
+    _loaded_references.pop(directory, None)
+    return load_reference_tables(directory)
+
+
+def load_reference_tables(directory):
+    """Load the reference tables saved by make_reference_tables. Each
+    process only loads a directory once."""
+    if directory not in _loaded_references:
+        tables = Struct()
+        for name in ["genes", "transcripts", "locations", "edges", "vertex_genes", "gene_starts", "gene_ends"]:
+            tables[name] = ReferenceTable.load(directory, name)
+        _loaded_references[directory] = tables
+    return _loaded_references[directory]
+
+
+# Bump this whenever the reference tables change, so old snapshots are rebuilt
+REFERENCE_FORMAT = 1
+
+# Counters that change whenever the reference part of the database does.
+# Observed reads and datasets don't affect the reference tables.
+REFERENCE_COUNTERS = ["genes", "transcripts", "vertex", "edge", "genome_build"]
+
+
+def reference_snapshot_key(cursor, build):
+    """Describe the reference state of the database for the build"""
+    cursor.execute("SELECT * FROM counters")
+    counters = {row[0]: row[1] for row in cursor.fetchall() if row[0] in REFERENCE_COUNTERS}
+    return {"format": REFERENCE_FORMAT, "build": build, "counters": counters}
+
+
+def reference_snapshot_dir(database, build):
+    """Snapshots live next to the database, one directory per build"""
+    return os.path.join(database + ".reference", build)
+
+
+def load_reference_snapshot(cursor, build, database):
+    """Load the reference tables saved next to the database if they were
+    built from the database's current state, and rebuild them if not.
+    Returns the tables and the directory they are in."""
+
+    directory = reference_snapshot_dir(database, build)
+    key_file = os.path.join(directory, "key.json")
+    key = reference_snapshot_key(cursor, build)
+
+    try:
+        with open(key_file) as f:
+            if json.load(f) == key:
+                logging.info(f"Using reference snapshot in {directory}")
+                return load_reference_tables(directory), directory
+    except (OSError, ValueError):
+        pass
+
+    logging.info(f"Building reference snapshot in {directory}")
+    tmp_directory = "%s.tmp%d" % (directory, os.getpid())
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    make_reference_tables(cursor, build, tmp_directory)
+    _loaded_references.pop(tmp_directory, None)
+
+    # The key is written last so that an incomplete snapshot never matches
+    with open(os.path.join(tmp_directory, "key.json"), "w") as f:
+        json.dump(key, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+    _loaded_references.pop(directory, None)
+
+    return load_reference_tables(directory), directory
@@ -7,10 +7,12 @@
 # known annotations as well as novel discoveries.
 
 import os
+import shutil
 import sqlite3
 import time
 from optparse import OptionParser
 from sqlite3 import Error
+from string import Template
 
 from . import edge as Edge
 from . import gene as Gene
@@ -64,11 +66,16 @@ def getOptions():
 
 def create_database(path):
     """Creates an SQLite database with the provided name. If a database
-    of the name already exists, an error is generated."""
+    of the name already exists, an error is generated. Any reference
+    snapshots next to the path are removed."""
 
     if os.path.isfile(path):
         raise ValueError("Database with name '" + path + "' already exists!")
 
+    # Reference snapshots left behind by a deleted database of the same name
+    # could match the new database's counters, so they have to go
+    shutil.rmtree(path + ".reference", ignore_errors=True)
+
     try:
         conn = sqlite3.connect(path)
     except Error as e:
@@ -385,6 +392,186 @@ def add_abundance_table(database):
     return
 
 
+# Secondary indexes for the lookups that TALON and the post-TALON utilities
+# run most often. Lookups by location_ID and abundance transcript_ID are
+# already covered by the primary keys of those tables.
+INDEXES = [
+    ("location_chromosome_position", "location", ["genome_build", "chromosome", "position"]),
+    ("vertex_gene", "vertex", ["gene_ID"]),
+    ("edge_v1", "edge", ["v1"]),
+    ("edge_v2", "edge", ["v2"]),
+    ("gene_annotations_attribute", "gene_annotations", ["attribute", "value"]),
+    ("transcript_annotations_attribute", "transcript_annotations", ["attribute", "value"]),
+    ("observed_dataset", "observed", ["dataset"]),
+    ("observed_transcript", "observed", ["transcript_ID"]),
+    ("abundance_dataset", "abundance", ["dataset"]),
+]
+
+
+def add_indexes(database):
+    """Create the secondary indexes in INDEXES. Indexes that already exist
+    are left alone, so this is safe to run on an existing database."""
+
+    # Connecting to the database file
+    conn = sqlite3.connect(database)
+    c = conn.cursor()
+
+    for command in index_commands():
+        c.execute(command)
+
+    conn.commit()
+    conn.close()
+    return
+
+
+def index_commands(names=None):
+    """Returns the commands that create the secondary indexes in INDEXES,
+    optionally limited to the indexes with the given names"""
+    commands = []
+    for name, table, columns in INDEXES:
+        if names is not None and name not in names:
+            continue
+        cols = ", ".join([str_wrap_double(x) for x in columns])
+        commands.append("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (name, table, cols))
+    return commands
+
+
+# Genomic extent (min and max position) of each gene and transcript in each
+# genome build. Overlap queries go through an R-tree over the extents, which
+# triggers keep in sync with the extent table itself.
+EXTENT_TABLES = {"gene_extent": "gene_ID", "transcript_extent": "transcript_ID"}
+
+GENE_EXTENT_QUERY = """ SELECT v.gene_ID,
+                               loc.genome_build,
+                               loc.chromosome,
+                               MIN(loc.position),
+                               MAX(loc.position)
+                        FROM vertex AS v
+                        JOIN location AS loc ON loc.location_ID = v.vertex_ID
+                        WHERE $where
+                        GROUP BY v.gene_ID, loc.genome_build """
+
+TRANSCRIPT_EXTENT_QUERY = """ SELECT t.transcript_ID,
+                                     loc1.genome_build,
+                                     loc1.chromosome,
+                                     MIN(loc1.position, loc2.position),
+                                     MAX(loc1.position, loc2.position)
+                              FROM transcripts AS t
+                              JOIN location AS loc1 ON loc1.location_ID = t.start_vertex
+                              JOIN location AS loc2 ON loc2.location_ID = t.end_vertex
+                                  AND loc2.genome_build = loc1.genome_build
+                              WHERE $where """
+
+
+def add_extent_tables(database):
+    """Add the gene and transcript extent tables and their R-tree indexes,
+    and fill them from the existing vertices and transcripts. Databases
+    that already have the extent tables are left alone."""
+
+    # Connecting to the database file
+    conn = sqlite3.connect(database)
+    c = conn.cursor()
+
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    existing = set([x[0] for x in c.fetchall()])
+
+    for table, id_col in EXTENT_TABLES.items():
+        if table in existing:
+            continue
+        c.execute(
+            """CREATE TABLE %s (
+                   extent_ID INTEGER PRIMARY KEY,
+                   %s INTEGER,
+                   genome_build TEXT,
+                   chromosome TEXT,
+                   min_pos INTEGER,
+                   max_pos INTEGER,
+
+                   UNIQUE (%s, genome_build)
+               )"""
+            % (table, id_col, id_col)
+        )
+        c.execute("CREATE VIRTUAL TABLE %s_rtree USING rtree(extent_ID, min_pos, max_pos)" % table)
+        c.execute(
+            """CREATE TRIGGER %s_insert AFTER INSERT ON %s BEGIN
+                   INSERT INTO %s_rtree VALUES (new.extent_ID, new.min_pos, new.max_pos);
+               END"""
+            % (table, table, table)
+        )
+        c.execute(
+            """CREATE TRIGGER %s_update AFTER UPDATE OF min_pos, max_pos ON %s BEGIN
+                   UPDATE %s_rtree SET min_pos = new.min_pos, max_pos = new.max_pos
+                   WHERE extent_ID = new.extent_ID;
+               END"""
+            % (table, table, table)
+        )
+        c.execute(
+            """CREATE TRIGGER %s_delete AFTER DELETE ON %s BEGIN
+                   DELETE FROM %s_rtree WHERE extent_ID = old.extent_ID;
+               END"""
+            % (table, table, table)
+        )
+
+    if "gene_extent" not in existing:
+        c.execute(insert_gene_extent_command("1"))
+    if "transcript_extent" not in existing:
+        c.execute(insert_transcript_extent_command("1"))
+
+    conn.commit()
+    conn.close()
+    return
+
+
+def insert_gene_extent_command(where):
+    """Returns the command that (re)computes the extents of the genes
+    selected by the where clause"""
+    query = Template(GENE_EXTENT_QUERY).substitute(where=where)
+    return (
+        """INSERT INTO gene_extent (gene_ID, genome_build, chromosome, min_pos, max_pos) """
+        + query
+        + """ ON CONFLICT (gene_ID, genome_build) DO UPDATE
+              SET chromosome = excluded.chromosome,
+                  min_pos = excluded.min_pos,
+                  max_pos = excluded.max_pos"""
+    )
+
+
+def insert_transcript_extent_command(where):
+    """Returns the command that adds the extents of the transcripts selected
+    by the where clause. Transcript structures never change, so existing
+    extents are kept."""
+    query = Template(TRANSCRIPT_EXTENT_QUERY).substitute(where=where)
+    return (
+        """INSERT OR IGNORE INTO transcript_extent
+               (transcript_ID, genome_build, chromosome, min_pos, max_pos) """
+        + query
+    )
+
+
+def update_gene_extents(cursor, gene_IDs):
+    """Recompute the extents of the given genes, for instance after new
+    vertices have been assigned to them"""
+    stage_extent_IDs(cursor, gene_IDs)
+    cursor.execute(insert_gene_extent_command("v.gene_ID IN (SELECT ID FROM temp.extent_IDs)"))
+    return
+
+
+def add_transcript_extents(cursor, transcript_IDs):
+    """Add the extents of newly added transcripts"""
+    stage_extent_IDs(cursor, transcript_IDs)
+    cursor.execute(insert_transcript_extent_command("t.transcript_ID IN (SELECT ID FROM temp.extent_IDs)"))
+    return
+
+
+def stage_extent_IDs(cursor, IDs):
+    """Load the IDs into a temporary table so that their extents can be
+    computed in a single statement"""
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS extent_IDs (ID INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.extent_IDs")
+    cursor.executemany("INSERT OR IGNORE INTO temp.extent_IDs (ID) VALUES (?)", [(x,) for x in IDs])
+    return
+
+
 def add_counter_table(database):
     """Add a table to the database to track novel events. Attributes are:
     - Category (gene, transcript, edge)
@@ -1072,6 +1259,10 @@ def main():
     # Populate the database tables
     populate_db(db_name, annot_name, chrom_genes, chrom_transcripts, exons, genome_build)
 
+    # Index the populated tables and record gene and transcript extents
+    add_indexes(db_name)
+    add_extent_tables(db_name)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,72 @@
+# TALON: Techonology-Agnostic Long Read Analysis Pipeline
+# -----------------------------------------------------------------------------
+# optimize_talon_database.py adds the standard secondary indexes and the
+# gene/transcript extent tables to an existing TALON database and refreshes
+# the query planner statistics. Databases created by talon_initialize_database
+# already have these, but older v5 databases do not.
+
+import argparse
+import sqlite3
+
+from .initialize_talon_database import add_extent_tables, add_indexes
+
+
+def get_args():
+    """Fetches the arguments for the program"""
+
+    program_desc = (
+        "Adds the standard secondary indexes and gene/transcript extent tables "
+        "to an existing TALON database and runs ANALYZE so that queries can "
+        "make use of them."
+    )
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument("--db", dest="database", metavar="FILE,", type=str, required=True, help="TALON database")
+
+    args = parser.parse_args()
+    return args
+
+
+def check_db_version(database):
+    """Make sure the user is using a v5 database"""
+
+    with sqlite3.connect(database) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT value FROM run_info WHERE item = 'schema_version'")
+            ver = cursor.fetchone()
+        except sqlite3.OperationalError:
+            ver = None
+    conn.close()
+
+    if ver is None or not str(ver[0]).startswith("v5"):
+        raise ValueError("Database '%s' is not a v5 TALON database." % database)
+
+
+def analyze_database(database):
+    """Collect the table and index statistics used by the query planner"""
+
+    conn = sqlite3.connect(database)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return
+
+
+def optimize_database(database):
+    """Add any missing secondary indexes and extent tables to the database
+    and then refresh its planner statistics."""
+
+    check_db_version(database)
+    add_indexes(database)
+    add_extent_tables(database)
+    analyze_database(database)
+    return
+
+
+def main():
+    options = get_args()
+    optimize_database(options.database)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,25 +4,28 @@
 # Functions related to processing the input SAM files and partitioning them
 # for processing in parallel
 
+import heapq
+import itertools
 import logging
 import os
+import re
 import time
+from operator import itemgetter
 
-import pyranges as pr
 import pysam
 
 save = pysam.set_verbosity(0)
 # pysam.set_verbosity(save)
 
+# Unmapped, QC-failed and duplicate reads do not count towards loci
+SKIPPED_FLAGS = 0x4 | 0x200 | 0x400
+
 
 def convert_to_bam(sam, bam, threads):
     """Convert provided sam file to bam file (provided name)."""
 
     try:
-        infile = pysam.AlignmentFile(sam, "r", threads=threads)
-        outfile = pysam.AlignmentFile(bam, "wb", template=infile, threads=threads)
-        for s in infile:
-            outfile.write(s)
+        pysam.view("-b", "-@", str(threads), "-o", bam, sam, catch_stdout=False)
 
     except Exception as e:
         logging.error(e)
@@ -32,67 +35,108 @@ def convert_to_bam(sam, bam, threads):
         # raise RuntimeError("Problem converting sam file '%s' to bam." % (sam))
 
 
+def is_coordinate_sorted(sam):
+    """Check whether the header of the SAM/BAM file declares it to be
+    sorted by coordinate"""
+
+    with pysam.AlignmentFile(sam, "r") as f:
+        return f.header.get("HD", {}).get("SO") == "coordinate"
+
+
+def is_ready_for_annotation(sam, dataset, use_cb_tag, n_threads=0):
+    """Check whether an input file can be used as it is: a coordinate-sorted
+    and indexed BAM file in which every read is already labeled with its
+    dataset (unless datasets come from the CB tag)."""
+
+    with pysam.AlignmentFile(sam, "r") as f:
+        if not f.is_bam or f.header.get("HD", {}).get("SO") != "coordinate" or not f.has_index():
+            return False
+        n_reads = sum(contig.total for contig in f.get_index_statistics()) + f.nocoordinate
+
+    if use_cb_tag:
+        return True
+    # Count the reads labeled with the dataset. samtools view -r would also
+    # count reads that have no RG tag at all.
+    if '"' in dataset or "\\" in dataset:
+        return False
+    # Filter expressions need samtools 1.12 or later. With an older pysam,
+    # the input is merged as usual instead.
+    try:
+        n_labeled = int(pysam.view("-c", "-@", str(n_threads), "-e", '[RG]=="%s"' % dataset, sam))
+    except pysam.SamtoolsError:
+        return False
+    return n_labeled == n_reads
+
+
+def sort_input(sam, prefix, n_threads=0, trust_header=True):
+    """Provide a coordinate-sorted version of the input file named after
+    prefix, so that samtools merge -r labels its reads with the prefix's
+    base name. Inputs whose header says that they are sorted already are
+    linked rather than copied (unless trust_header is False), and the rest
+    are sorted straight from SAM or BAM."""
+
+    if trust_header and is_coordinate_sorted(sam):
+        with pysam.AlignmentFile(sam, "r") as f:
+            suffix = ".bam" if f.is_bam else ".sam"
+        link = prefix + suffix
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.abspath(sam), link)
+        return link
+
+    sorted_bam = prefix + ".bam"
+    pysam.sort("-@", str(n_threads), "-o", sorted_bam, sam)
+    return sorted_bam
+
+
+def merge_inputs(sorted_sams, merged_bam, use_cb_tag, n_threads=0):
+    """Merge the sorted inputs in a single pass and index the result. With
+    the -r option, samtools sets the RG tag of each read to the base name
+    of the file it came from."""
+
+    merge_args = [merged_bam] + sorted_sams + ["-f", "-@", str(n_threads)]
+    if not use_cb_tag:
+        merge_args.append("-r")
+    pysam.merge(*merge_args)
+    pysam.index(merged_bam)
+
+
 def preprocess_sam(sam_files, datasets, use_cb_tag, tmp_dir="talon_tmp/", n_threads=0):
-    """Copy and rename the provided SAM/BAM file(s), merge them, and index.
-    This is necessary in order to use following commands on the reads.
-    The renaming is necessary in order to label the reads according to
-    their dataset."""
+    """Merge the provided SAM/BAM file(s) into one coordinate-sorted and
+    indexed BAM file, with each read labeled with its dataset in the RG tag
+    (unless datasets come from the CB tag). This is necessary in order to
+    use following commands on the reads.
+
+    Inputs that are not sorted yet are sorted first. The sorted inputs are
+    then combined in one k-way merge, which keeps them sorted. A single
+    input that is already sorted, indexed and labeled is used as it is."""
 
     # Create the tmp dir
     os.system("mkdir -p %s " % (tmp_dir))
 
-    renamed_sams = []
+    if len(sam_files) == 1 and is_ready_for_annotation(sam_files[0], datasets[0], use_cb_tag, n_threads=n_threads):
+        logging.info(f"Input file {sam_files[0]} is sorted, indexed and labeled already")
+        return sam_files[0]
+
+    # Name the sorted inputs after their datasets so that the merge labels
+    # each read with its dataset. Otherwise the datasets come from the CB
+    # tag and reads are merged without an RG tag.
+    names = [str(i) if use_cb_tag else dataset for i, dataset in enumerate(datasets)]
+    merged_bam = tmp_dir + "merged.bam"
 
-    # merge sam files if we're not pulling out dataset IDs from RG tag
-    if not use_cb_tag:
-        # Copy and rename SAM files with dataset names to ensure correct RG tags
-        for sam, dataset in zip(sam_files, datasets):
-            suffix = "." + sam.split(".")[-1]
-            if suffix == ".sam":
-                bam_copy = tmp_dir + dataset + "_unsorted.bam"
-                convert_to_bam(sam, bam_copy, n_threads)
-                sam = bam_copy
-            sorted_bam = tmp_dir + dataset + ".bam"
-            pysam.sort("-@", str(n_threads), "-o", sorted_bam, sam)
-            renamed_sams.append(sorted_bam)
-
-        merged_bam = tmp_dir + "merged.bam"
-        merge_args = [merged_bam] + renamed_sams + ["-f", "-r", "-@", str(n_threads)]
-        # index_args = [merged_bam, "-@", str(n_threads)]
-
-        # # Merge datasets and use -r option to include a read group tag
-        # try:
-        #     pysam.merge(*merge_args)
-        #     pysam.index(merged_bam)
-        #     ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-        #     print("[ %s ] Merged input SAM/BAM files" % (ts))
-        # except:
-        #     raise RuntimeError(("Problem merging and indexing SAM/BAM files. "
-        #                         "Check your file paths and make sure that all "
-        #                         "files have headers."))
-
-    # otherwise, merge without adding the RG tag and convert to bam
-    elif use_cb_tag:
-        for i, sam in enumerate(sam_files):
-            fname_split = sam.split(".")
-            suffix = "." + fname_split[-1]
-            if suffix == ".sam":
-                bam_copy = "{}{}_unsorted.bam".format(tmp_dir, i)
-                convert_to_bam(sam, bam_copy, n_threads)
-                sam = bam_copy
-            sorted_bam = "{}{}.bam".format(tmp_dir, i)
-            pysam.sort("-@", str(n_threads), "-o", sorted_bam, sam)
-            renamed_sams.append(sorted_bam)
-
-        merged_bam = tmp_dir + "merged.bam"
-        merge_args = [merged_bam] + renamed_sams + ["-f", "-@", str(n_threads)]
-
-    # Merge datasets and use -r option to include a read group tag
     try:
-        pysam.merge(*merge_args)
-        sorted_bam = tmp_dir + "merged_sorted.bam"
-        pysam.sort("-@", str(n_threads), "-o", sorted_bam, merged_bam)
-        pysam.index(sorted_bam)
+        try:
+            sorted_sams = [sort_input(sam, tmp_dir + name, n_threads) for sam, name in zip(sam_files, names)]
+            merge_inputs(sorted_sams, merged_bam, use_cb_tag, n_threads)
+        except pysam.SamtoolsError:
+            # A file's header may claim that it is sorted when it is not, in
+            # which case the merged file cannot be indexed. Sort every input
+            # and try again.
+            logging.warning("Could not index the merged input files. Sorting every input file and merging again.")
+            sorted_sams = [
+                sort_input(sam, tmp_dir + name, n_threads, trust_header=False) for sam, name in zip(sam_files, names)
+            ]
+            merge_inputs(sorted_sams, merged_bam, use_cb_tag, n_threads)
         # ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
         # print("[ %s ] Merged input SAM/BAM files" % (ts))
         logging.info("Merged input SAM/BAM files")
@@ -107,23 +151,45 @@ def preprocess_sam(sam_files, datasets, use_cb_tag, tmp_dir="talon_tmp/", n_thre
         )
         logging.error(msg)
         raise RuntimeError(msg)
-    return sorted_bam
+    return merged_bam
+
 
+def partition_reads(
+    sam_files,
+    datasets,
+    use_cb_tag,
+    tmp_dir="talon_tmp/",
+    n_threads=0,
+    gene_extents=None,
+    slack=0,
+    target_size=None,
+):
+    """Cut the genome into independent loci and group them into work units
+    of roughly target_size reads each. A locus is a cluster of overlapping
+    reads, merged with any reference gene extents that touch it and with
+    anything else lying within `slack` bp, so no read or reference model
+    is ever split between two work units.
 
-def partition_reads(sam_files, datasets, use_cb_tag, tmp_dir="talon_tmp/", n_threads=0):
-    """Use bedtools merge to create non-overlapping intervals from all of the
-    transcripts in a series of SAM/BAM files. Then, iterate over the intervals
-    to extract all reads inside of them from the pysam object.
+    Args:
+        gene_extents: iterable of (chromosome, start, end) tuples (1-based,
+            inclusive) giving the extent of each gene in the reference.
+        slack: loci closer than this are merged. Should be at least as far
+            as a read end can be matched to a vertex.
+        target_size: number of reads to aim for in each work unit. Loci
+            larger than this get a unit of their own. Default: enough to
+            make about four units per thread.
+
+    Reads are not loaded here. Each work unit's reads can be streamed from
+    the merged, indexed BAM file with get_reads_in_interval.
 
     Returns:
-        - List of lists: sublists contain pysam reads from a given interval
-        - List of tuple intervals
-        - filename of merged bam file (to keep track of the header)
+        - List of tuple intervals (1-based, inclusive)
+        - filename of merged, indexed bam file
     """
     merged_bam = preprocess_sam(sam_files, datasets, use_cb_tag, tmp_dir=tmp_dir, n_threads=n_threads)
 
     try:
-        gr = pr.read_bam(merged_bam)
+        sam = pysam.AlignmentFile(merged_bam, "rb", threads=n_threads)
     except Exception as e:
         # print(e)
         logging.error(e)
@@ -131,45 +197,96 @@ def partition_reads(sam_files, datasets, use_cb_tag, tmp_dir="talon_tmp/", n_thr
         logging.error(msg)
         raise RuntimeError(msg)
 
-    gr = gr.merge(slack=100000000, strand=False)
+    with sam:
+        loci = find_loci(read_extents(sam), gene_extents=gene_extents, slack=slack)
+
+    if target_size is None:
+        n_reads = sum(locus[3] for locus in loci)
+        target_size = max(1, -(-n_reads // (4 * max(n_threads, 1))))
+    work_units = group_loci(loci, target_size)
+    logging.info(f"Found {len(loci)} independent loci, grouped into {len(work_units)} work units")
+
+    coords = [(chrom, start + 1, end) for chrom, start, end in work_units]
+
+    return coords, merged_bam
 
-    # Now open each sam file using pysam and extract the reads
-    coords = []
-    read_groups = []
-    with pysam.AlignmentFile(merged_bam) as bam:  # type: pysam.AlignmentFile
-        for _, interval in gr.df.iterrows():
-            reads = get_reads_in_interval(bam, interval.Chromosome, interval.Start, interval.End)
-            read_groups.append(reads)
-            coords.append((interval.Chromosome, interval.Start + 1, interval.End))
 
-    return read_groups, coords, merged_bam
+def read_extents(sam):
+    """Iterate over the (chromosome, start, end) extents of the reads in an
+    open, coordinate-sorted BAM file (0-based, half-open), in file order.
+    Only one read is decoded at a time."""
+
+    for read in sam.fetch(until_eof=True):
+        if read.flag & SKIPPED_FLAGS:
+            continue
+        yield read.reference_name, read.reference_start, read.reference_end
+
+
+def chromosome_sort_key(chrom):
+    """Natural sort key for chromosome names (chr2 before chr10)"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", chrom)]
+
+
+def find_loci(reads, gene_extents=None, slack=0):
+    """Merge the read extents with the gene extents to get the independent
+    loci, as a list of (chromosome, start, end, n_reads) tuples in 0-based,
+    half-open coordinates. Loci without any reads are dropped.
+
+    The reads are (chromosome, start, end) tuples, grouped by chromosome and
+    sorted by start as in a coordinate-sorted BAM file. They are merged in a
+    single pass, so they can be streamed. Loci are returned with the
+    chromosomes in natural sort order."""
+
+    genes = {}
+    for chrom, start, end in gene_extents or []:
+        genes.setdefault(chrom, []).append((min(start, end) - 1, max(start, end), 0))
+
+    loci = []
+    for chrom, chrom_reads in itertools.groupby(reads, key=itemgetter(0)):
+        intervals = heapq.merge(
+            ((start, end, 1) for _, start, end in chrom_reads), sorted(genes.get(chrom, [])), key=itemgetter(0)
+        )
+        curr = None
+        for start, end, n_reads in intervals:
+            if curr is not None and start <= curr[2] + slack:
+                curr[2] = max(curr[2], end)
+                curr[3] += n_reads
+            else:
+                if curr is not None and curr[3] > 0:
+                    loci.append(tuple(curr))
+                curr = [chrom, start, end, n_reads]
+        if curr is not None and curr[3] > 0:
+            loci.append(tuple(curr))
 
+    loci.sort(key=lambda locus: chromosome_sort_key(locus[0]))
+    return loci
 
-def write_reads_to_file(read_groups, intervals, header_template, tmp_dir="talon_tmp/"):
-    """For each read group, iterate over the reads and write them to a file
-    named for the interval they belong to. This step is necessary because
-    Pysam objects cannot be pickled."""
 
-    tmp_dir = tmp_dir + "interval_files/"
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
+def group_loci(loci, target_size):
+    """Greedily pack consecutive loci on the same chromosome into work units
+    of at most target_size reads (a single locus may exceed it). Returns
+    (chromosome, start, end) tuples spanning each unit's loci."""
 
-    outbam_names = []
-    with pysam.AlignmentFile(header_template, "rb") as template:
-        for group, interval in zip(read_groups, intervals):
-            fname = tmp_dir + "_".join([str(x) for x in interval]) + ".bam"
-            outbam_names.append(fname)
-            with pysam.AlignmentFile(fname, "wb", template=template) as f:
-                for read in group:
-                    f.write(read)
+    work_units = []
+    curr = None
+    for chrom, start, end, n_reads in loci:
+        if curr is not None and curr[0] == chrom and curr[3] + n_reads <= target_size:
+            curr = (chrom, curr[1], end, curr[3] + n_reads)
+        else:
+            if curr is not None:
+                work_units.append(curr[:3])
+            curr = (chrom, start, end, n_reads)
+    if curr is not None:
+        work_units.append(curr[:3])
 
-    return outbam_names
+    return work_units
 
 
-def get_reads_in_interval(sam, chrom, start, end):
-    """Given an open pysam.AlignmentFile, return only the reads that overlap
-    the provided interval. Note that this means there may be reads that
-    extend beyond the bounds of the interval."""
-    iterator = sam.fetch(chrom, start, end)
-    reads = [x for x in iterator]
-    return reads
+def get_reads_in_interval(sam, interval):
+    """Given an open, indexed pysam.AlignmentFile and a work unit interval
+    from partition_reads, iterate over the reads that overlap it. Note that
+    this means there may be reads that extend beyond the bounds of the
+    interval. Reads are decoded as they are consumed, so they never have
+    to be held in memory all at once."""
+    chrom, start, end = interval
+    return sam.fetch(chrom, start - 1, end)
@@ -5,31 +5,35 @@
 # assigns them transcript and gene identifiers based on a GTF annotation.
 # Novel transcripts are assigned new identifiers.
 import argparse
+import collections
+import gc
 import logging
 import multiprocessing as mp
 import operator
 import os
-import queue
+import shutil
 import sqlite3
 import sys
 import time
 import warnings
-from datetime import datetime, timedelta
+from bisect import bisect_right
 from functools import reduce
 from itertools import islice, repeat
 from pathlib import Path
-from string import Template
 
 import pandas as pd
+import pyfaidx
 import pysam
 
 from talon.post import get_read_annotations
 
 from . import dstruct
 from . import init_refs as init_refs
+from . import initialize_talon_database as init_db
 from . import logger as logger
 from . import process_sams as procsams
 from . import query_utils as qutils
+from . import talon_label_reads as tlr
 from . import transcript_utils as tutils
 
 # set verbosity for pysam
@@ -37,12 +41,243 @@ save = pysam.set_verbosity(0)
 # pysam.set_verbosity(save)
 
 
+class OutputShard(object):
+    """Collects the output lines that one job produces for each of the run's
+    outfiles and appends them to a job-specific shard file in large batches.
+    Once all jobs are done, the shards are merged with merge_output_shards."""
+
+    def __init__(self, shard_dir, shard_id, batch_size=10000):
+        self.shard_dir = shard_dir
+        self.shard_id = shard_id
+        self.buffers = {}
+        self.batch_size = batch_size
+        self.n_buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def write_row(self, name, row):
+        """Queue up a row of values for the outfile with the provided name"""
+        self.write(name, "\t".join([str(x) for x in row]))
+
+    def write(self, name, line):
+        """Queue up a line for the outfile with the provided name"""
+        try:
+            self.buffers[name].append(line)
+        except KeyError:
+            self.buffers[name] = [line]
+        self.n_buffered += 1
+        if self.n_buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered lines to the shard files"""
+        for name, lines in self.buffers.items():
+            if lines:
+                with open(shard_path(self.shard_dir, self.shard_id, name), "a") as f:
+                    f.write("\n".join(lines) + "\n")
+                self.buffers[name] = []
+        self.n_buffered = 0
+
+
+def shard_path(shard_dir, shard_id, name):
+    """Path of the shard file that holds one job's lines for an outfile"""
+    return os.path.join(shard_dir, "%s.%s.tsv" % (shard_id, name))
+
+
+class DatabaseShard(OutputShard):
+    """Variant of OutputShard that stores the rows bound for the database
+    tables in a job-specific SQLite file with the main database's schema,
+    so that they can be merged without formatting and parsing text. The
+    other outfiles, such as the QC log, are still written as text. Once all
+    jobs are done, the shards are merged with merge_shard_databases."""
+
+    def __init__(self, shard_dir, shard_id, schema, batch_size=10000):
+        super().__init__(shard_dir, shard_id, batch_size=batch_size)
+        self.schema = schema
+        self.rows = {}
+
+    def write_row(self, name, row):
+        """Queue up a row for the table that the named outfile stands for"""
+        if name not in STAGED_TABLES:
+            return super().write_row(name, row)
+        try:
+            self.rows[name].append(row)
+        except KeyError:
+            self.rows[name] = [row]
+        self.n_buffered += 1
+        if self.n_buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered lines and rows to the shard files"""
+        super().flush()
+        if not any(self.rows.values()):
+            return
+
+        conn = create_shard_database(shard_db_path(self.shard_dir, self.shard_id), self.schema)
+        for name, rows in self.rows.items():
+            if rows:
+                table, insert = STAGED_TABLES[name]
+                conn.executemany("%s INTO %s VALUES (%s)" % (insert, table, ",".join(["?"] * len(rows[0]))), rows)
+                self.rows[name] = []
+        conn.commit()
+        conn.close()
+
+
+def shard_db_path(shard_dir, shard_id):
+    """Path of the SQLite shard that holds one job's database rows"""
+    return os.path.join(shard_dir, "%s.db" % shard_id)
+
+
+# Database table that each outfile stands for, and the insert used to add
+# rows to it. Tables whose rows may repeat across jobs ignore duplicates.
+STAGED_TABLES = {
+    "genes": ("genes", "INSERT OR IGNORE"),
+    "transcripts": ("transcripts", "INSERT"),
+    "edges": ("edge", "INSERT"),
+    "location": ("location", "INSERT"),
+    "v2g": ("vertex", "INSERT OR IGNORE"),
+    "observed": ("observed", "INSERT"),
+    "gene_annot": ("gene_annotations", "INSERT OR IGNORE"),
+    "transcript_annot": ("transcript_annotations", "INSERT OR IGNORE"),
+    "exon_annot": ("exon_annotations", "INSERT OR IGNORE"),
+}
+
+
+def get_shard_schema(cursor):
+    """Fetch the statements that create the STAGED_TABLES in the main
+    database, for creating database shards with the same schema"""
+
+    tables = [table for table, insert in STAGED_TABLES.values()]
+    cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name IN (%s)" % ",".join(["?"] * len(tables)),
+        tables,
+    )
+    return [x[0] for x in cursor.fetchall()]
+
+
+def create_shard_database(path, schema):
+    """Open the database shard at path, creating its tables if it is new"""
+
+    exists = os.path.exists(path)
+    conn = sqlite3.connect(path)
+    if not exists:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        for command in schema:
+            conn.execute(command)
+    return conn
+
+
+def merge_shard_databases(staged_db, shard_dir, shard_ids, schema, id_map):
+    """Combine the database shards written by each job into one staging
+    database, in the order of shard_ids, and remove the shards. The block
+    IDs in each row are renumbered with the IDMap on the way."""
+
+    conn = create_shard_database(staged_db, schema)
+    conn.create_function("renumber", 2, id_map.renumber_value)
+    conn.create_function("renumber_annotation", 2, id_map.renumber_annotation)
+
+    commands = []
+    for name, (table, insert) in STAGED_TABLES.items():
+        columns = [x[1] for x in conn.execute("PRAGMA table_info(%s)" % table)]
+        values = []
+        for i, column in enumerate(columns):
+            if i in ID_COLUMNS[name]:
+                values.append("renumber('%s', %s)" % (ID_COLUMNS[name][i], column))
+            elif name.endswith("_annot") and column == "value":
+                values.append("renumber_annotation(attribute, value)")
+            else:
+                values.append(column)
+        commands.append(
+            "%s INTO main.%s SELECT %s FROM shard.%s ORDER BY rowid" % (insert, table, ", ".join(values), table)
+        )
+
+    for shard_id in shard_ids:
+        path = shard_db_path(shard_dir, shard_id)
+        if not os.path.exists(path):
+            continue
+        conn.execute("ATTACH DATABASE ? AS shard", (path,))
+        for command in commands:
+            conn.execute(command)
+        conn.commit()
+        conn.execute("DETACH DATABASE shard")
+        os.remove(path)
+
+    conn.close()
+    return
+
+
+def merge_output_shards(outfiles, shard_dir, shard_ids, QC_header, id_map=None):
+    """Concatenate the shard files written by each job into the run's
+    outfiles, in the order of shard_ids, and remove the shards. If an IDMap
+    is provided, the block IDs in each line are renumbered on the way."""
+
+    for name, fpath in outfiles.items():
+        with open(fpath, "w") as out:
+            if name == "qc":
+                out.write(QC_header + "\n")
+            for shard_id in shard_ids:
+                path = shard_path(shard_dir, shard_id, name)
+                if not os.path.exists(path):
+                    continue
+                with open(path) as shard:
+                    if id_map is None or name not in ID_COLUMNS:
+                        shutil.copyfileobj(shard, out)
+                    else:
+                        out.writelines(id_map.renumber_line(name, line) for line in shard)
+                os.remove(path)
+
+    return
+
+
+# Columns of each outfile that hold IDs from the block counters
+ID_COLUMNS = {
+    "genes": {0: "gene"},
+    "transcripts": {0: "transcript", 1: "gene", 2: "edge", 3: "edge", 4: "edge", 5: "vertex", 6: "vertex"},
+    "edges": {0: "edge", 1: "vertex", 2: "vertex"},
+    "location": {0: "vertex"},
+    "v2g": {0: "vertex", 1: "gene"},
+    "observed": {0: "observed", 1: "gene", 2: "transcript", 5: "vertex", 6: "vertex", 7: "edge", 8: "edge"},
+    "gene_annot": {0: "gene"},
+    "transcript_annot": {0: "transcript"},
+    "exon_annot": {0: "edge"},
+}
+
+# Annotation attributes whose values refer to IDs, either as lists or as
+# TALON names built by construct_names
+ID_ATTRIBUTES = {
+    "ISM_to_IDs": "transcript",
+    "ISM-prefix_to_IDs": "transcript",
+    "ISM-suffix_to_IDs": "transcript",
+    "gene_antisense_to_IDs": "gene",
+}
+NAME_ATTRIBUTES = {
+    "gene_name": "gene",
+    "gene_id": "gene",
+    "transcript_name": "transcript",
+    "transcript_id": "transcript",
+}
+
+
 class Counter(object):
+    """An ID counter shared between processes. By default each increment
+    takes the lock. After start_blocks, increment instead hands out IDs from
+    blocks reserved in one locked step, and stop_blocks reports which IDs
+    were used so that they can be renumbered with an IDMap."""
+
     def __init__(self, initval=0):
         self.val = mp.Value("i", initval)
         self.lock = mp.Lock()
+        self.blocks = None
 
     def increment(self):
+        if self.blocks is not None:
+            return self.increment_block()
         with self.lock:
             self.val.value += 1
             return self.val.value
@@ -51,6 +286,142 @@ class Counter(object):
         with self.lock:
             return self.val.value
 
+    def set(self, value):
+        with self.lock:
+            self.val.value = value
+
+    def reserve(self, n):
+        """Claim the next n IDs and return the first one"""
+        with self.lock:
+            first = self.val.value + 1
+            self.val.value += n
+            return first
+
+    def start_blocks(self, block_size=1000):
+        """Take IDs from reserved blocks in this process until stop_blocks"""
+        self.block_size = block_size
+        self.blocks = []
+
+    def stop_blocks(self):
+        """Go back to locked increments and return the (first ID, number of
+        IDs used) of each block reserved since start_blocks"""
+        blocks = [tuple(block) for block in self.blocks]
+        self.blocks = None
+        return blocks
+
+    def increment_block(self):
+        if not self.blocks or self.blocks[-1][1] == self.block_size:
+            self.blocks.append([self.reserve(self.block_size), 0])
+        block = self.blocks[-1]
+        block[1] += 1
+        return block[0] + block[1] - 1
+
+
+class IDMap(object):
+    """Renumbers the IDs that jobs took from reserved blocks so that they
+    form a gap-free range after each counter's starting value. Blocks are
+    laid out in the order they are added, so adding them in job order makes
+    the final IDs independent of how the jobs were scheduled."""
+
+    def __init__(self, first_IDs, idprefix, n_places):
+        self.next_ID = dict(first_IDs)
+        self.blocks = {name: [] for name in first_IDs}
+        self.block_starts = {name: [] for name in first_IDs}
+        self.idprefix = idprefix
+        self.n_places = n_places
+
+    def add_block(self, name, first, n_used):
+        """Assign final IDs to a block of n_used IDs starting at first"""
+        self.blocks[name].append((first, n_used, self.next_ID[name]))
+        self.next_ID[name] += n_used
+
+    def finalize(self):
+        for name in self.blocks:
+            self.blocks[name].sort()
+            self.block_starts[name] = [block[0] for block in self.blocks[name]]
+
+    def last_ID(self, name):
+        return self.next_ID[name] - 1
+
+    def renumber(self, name, ID):
+        """Return the final ID for an ID of the named counter"""
+        i = bisect_right(self.block_starts[name], ID) - 1
+        if i < 0:
+            return ID
+        first, n_used, new_first = self.blocks[name][i]
+        if ID >= first + n_used:
+            return ID
+        return new_first + ID - first
+
+    def renumber_field(self, name, field):
+        if field == "None":
+            return field
+        return ",".join(str(self.renumber(name, int(ID))) for ID in field.split(","))
+
+    def renumber_name(self, name, field):
+        letter = "G" if name == "gene" else "T"
+        ID = int(field[len(self.idprefix) + 1 :])
+        return self.idprefix + letter + str(self.renumber(name, ID)).zfill(self.n_places)
+
+    def renumber_value(self, name, value):
+        """Renumber a value from a database shard, which is either an ID or
+        a comma-separated list of IDs such as a jn_path"""
+        if value is None:
+            return value
+        if type(value) is int:
+            return self.renumber(name, value)
+        return self.renumber_field(name, value)
+
+    def renumber_annotation(self, attribute, value):
+        """Renumber the IDs in an annotation value, if it refers to any"""
+        if attribute in ID_ATTRIBUTES:
+            return self.renumber_field(ID_ATTRIBUTES[attribute], value)
+        if attribute in NAME_ATTRIBUTES:
+            return self.renumber_name(NAME_ATTRIBUTES[attribute], value)
+        return value
+
+    def renumber_line(self, fname, line):
+        """Renumber the block IDs in a line from one of the outfiles"""
+        fields = line.rstrip("\n").split("\t")
+        for col, name in ID_COLUMNS[fname].items():
+            fields[col] = self.renumber_field(name, fields[col])
+        if fname.endswith("_annot"):
+            fields[4] = self.renumber_annotation(fields[3], fields[4])
+        return "\t".join(fields) + "\n"
+
+
+def block_counters():
+    """The counters that workers take IDs from, by name"""
+    return {
+        "gene": gene_counter,
+        "transcript": transcript_counter,
+        "vertex": vertex_counter,
+        "edge": edge_counter,
+        "observed": observed_counter,
+    }
+
+
+def make_id_map(shard_dir, shard_ids, first_IDs, idprefix, n_places):
+    """Build an IDMap from the ID blocks that each job recorded in its
+    shard, and update the counters to the final number of IDs used."""
+
+    id_map = IDMap(first_IDs, idprefix, n_places)
+    for shard_id in shard_ids:
+        path = shard_path(shard_dir, shard_id, "id_blocks")
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                name, first, n_used = line.split("\t")
+                id_map.add_block(name, int(first), int(n_used))
+        os.remove(path)
+    id_map.finalize()
+
+    for name, counter in block_counters().items():
+        counter.set(id_map.last_ID(name))
+
+    return id_map
+
 
 def get_counters(database):
     """Fetch counter values from the database and create counter objects
@@ -154,6 +525,88 @@ def get_args():
         + "splice junctions with any other models",
         default=False,
     )
+    parser.add_argument(
+        "--partition_size",
+        dest="partition_size",
+        help="Target number of reads per parallel work unit. Loci are never "
+        + "split, so a unit can be larger. Default: about four units per thread",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--no_read_cache",
+        dest="use_read_cache",
+        action="store_false",
+        help="Classify every read from scratch instead of reusing the "
+        + "result for reads with an identical splice chain",
+        default=True,
+    )
+    parser.add_argument(
+        "--sqlite_shards",
+        dest="sqlite_shards",
+        help=(
+            "Have each job write its new database entries to its own SQLite "
+            "file instead of text files, and merge those into the database "
+            "directly. Avoids formatting and re-parsing the entries."
+        ),
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--bulk_load",
+        dest="bulk_load",
+        help=(
+            "Load the results into the database in bulk mode: large batches, "
+            "SQLite settings tuned for the load, and secondary index updates "
+            "deferred until after the inserts. Recommended for large runs."
+        ),
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--label_reads",
+        dest="label_reads",
+        help=(
+            "Label the reads with their fraction of As after the alignment "
+            "end (fA) and, given site catalogs, their start and end site "
+            "support (tS, tE) while annotating them, as talon_label_reads "
+            "would. Use this to run TALON directly on the aligned reads "
+            "without writing a labeled copy of them first. Requires --genome."
+        ),
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--genome", dest="genome_file", metavar="FILE,", type=str, help="Reference genome FASTA, for --label_reads"
+    )
+    parser.add_argument(
+        "--ar",
+        dest="fracA_range_size",
+        help="Size of the window after the alignment end used to compute the fraction of As. Default = 20",
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "--tss",
+        dest="tss_file",
+        metavar="FILE,",
+        type=str,
+        help="BED file of known transcription start sites, for the tS label of --label_reads",
+    )
+    parser.add_argument(
+        "--pas",
+        dest="pas_file",
+        metavar="FILE,",
+        type=str,
+        help="BED file of known polyA sites, for the tE label of --label_reads",
+    )
+    parser.add_argument(
+        "--site_window",
+        dest="site_window",
+        help="Maximum distance between a read end and a catalog site for the read to count as supported. Default = 50",
+        type=int,
+        default=50,
+    )
     parser.add_argument(
         "--tmpDir",
         dest="tmp_dir",
@@ -366,23 +819,22 @@ def permissive_match_with_gene_priority(
             search_window_start = sj_pos
             search_window_end = position + max_dist
 
-        # Compute distance to all of the gene positions on file
-        min_abs_dist = max_dist + 1
-        best_dist = None
-        closest_vertex = None
-        for known_location in gene_locs[gene_ID]:
-            if known_location < search_window_start or known_location > search_window_end:
-                continue
+        # Find the closest known gene position that is inside the search
+        # window and within the cutoff distance. Ties go to the position
+        # that was recorded first.
+        known_locs = gene_locs[gene_ID]
 
-            curr_dist = compute_delta(known_location, position, strand)
-            if abs(curr_dist) < min_abs_dist:
-                best_dist = curr_dist
-                min_abs_dist = abs(curr_dist)
-                closest_vertex = gene_locs[gene_ID][known_location]
+        known_location = known_locs.closest(
+            position,
+            max(search_window_start, position - max_dist),
+            min(search_window_end, position + max_dist),
+            prefer=None,
+        )
 
         # If a valid match is found, return it
-        if min_abs_dist <= max_dist:
-            return closest_vertex, best_dist, 1
+        if known_location != None:
+            best_dist = compute_delta(known_location, position, strand)
+            return known_locs[known_location], best_dist, 1
 
     # Otherwise, revert to permissive match approach.
     match, dist = permissive_vertex_search(chromosome, position, strand, sj_pos, pos_type, locations, run_info)
@@ -432,20 +884,22 @@ def permissive_vertex_search(chromosome, position, strand, sj_pos, pos_type, loc
         search_window_start = sj_pos
         search_window_end = position + max_dist
 
-    for dist in range(1, max_dist):
-        curr_pos = position + dist * direction_priority
-        if curr_pos > search_window_start and curr_pos < search_window_end:
-            match = search_for_vertex_at_pos(chromosome, curr_pos, locations)
-            if match != None:
-                dist = compute_delta(curr_pos, position, strand)
-                return match["location_ID"], dist
-
-        curr_pos = position - dist * direction_priority
-        if curr_pos > search_window_start and curr_pos < search_window_end:
-            match = search_for_vertex_at_pos(chromosome, curr_pos, locations)
-            if match != None:
-                dist = compute_delta(curr_pos, position, strand)
-                return match["location_ID"], dist
+    if chromosome not in locations:
+        return None, None
+    chrom_locs = locations[chromosome]
+
+    # Candidates lie strictly inside the search window and strictly less
+    # than max_dist away. On a tie, the direction_priority side wins.
+    curr_pos = chrom_locs.closest(
+        position,
+        max(search_window_start, position - max_dist) + 1,
+        min(search_window_end, position + max_dist) - 1,
+        prefer=direction_priority,
+    )
+    if curr_pos != None:
+        match = chrom_locs[curr_pos]
+        dist = compute_delta(curr_pos, position, strand)
+        return match["location_ID"], dist
 
     return None, None
 
@@ -458,7 +912,7 @@ def create_vertex(chromosome, position, location_dict, run_info):
     try:
         location_dict[chromosome][position] = new_vertex
     except:
-        location_dict[chromosome] = {position: new_vertex}
+        location_dict[chromosome] = dstruct.PositionDict({position: new_vertex})
 
     return new_vertex
 
@@ -472,24 +926,27 @@ def create_edge(vertex_1, vertex_2, edge_type, strand, edge_dict):
     return new_edge
 
 
-def create_gene(chromosome, start, end, strand, memory_cursor, tmp_gene):
-    """Create a novel gene and add it to the temporary table."""
+def create_gene(chromosome, start, end, strand, gene_index):
+    """Create a novel gene and add it to the gene interval index."""
     new_ID = gene_counter.increment()
     logging.debug(f'Creating new gene with id {new_ID}')
 
-
-    new_gene = (new_ID, chromosome, min(start, end), max(start, end), strand)
-    cols = ' ("gene_ID", "chromosome", "start", "end", "strand")'
-    command = "INSERT INTO " + tmp_gene + cols + " VALUES " + "(?,?,?,?,?)"
-    memory_cursor.execute(command, new_gene)
+    new_gene = {
+        "gene_ID": new_ID,
+        "chromosome": chromosome,
+        "start": min(start, end),
+        "end": max(start, end),
+        "strand": strand,
+    }
+    gene_index.add(chromosome, strand, new_gene["start"], new_gene["end"], new_gene)
     return new_ID
 
 
 def create_transcript(
-    strand, chromosome, start_pos, end_pos, gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, memory_cursor
+    strand, chromosome, start_pos, end_pos, gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
 ):
     """Creates a novel transcript, add it to the transcript data structure,
-    and add to tmp_t
+    and add it to the transcript interval index
     """
     # print("creating new transcript")
     new_ID = transcript_counter.increment()
@@ -519,11 +976,16 @@ def create_transcript(
     path_key = frozenset(edge_IDs)
     transcript_dict[path_key] = new_transcript
 
-    # updating tmp_t
-    new_t = (gene_ID, new_ID, chromosome, strand, min(start_pos, end_pos), max(start_pos, end_pos))
-    cols = ' ("gene_ID", "transcript_ID", "chromosome", "strand", "min_pos", "max_pos")'
-    command = "INSERT INTO " + tmp_t + cols + " VALUES " + "(?,?,?,?,?,?)"
-    memory_cursor.execute(command, new_t)
+    # updating transcript_index
+    new_t = {
+        "gene_ID": gene_ID,
+        "transcript_ID": new_ID,
+        "chromosome": chromosome,
+        "strand": strand,
+        "min_pos": min(start_pos, end_pos),
+        "max_pos": max(start_pos, end_pos),
+    }
+    transcript_index.add(chromosome, strand, new_t["min_pos"], new_t["max_pos"], new_t)
 
     return new_transcript
 
@@ -654,7 +1116,10 @@ def search_for_ISM(edge_IDs, transcript_dict):
 
     edges = frozenset(edge_IDs)
 
-    ISM_matches = [transcript_dict[x] for x in transcript_dict if edges.issubset(x)]
+    if isinstance(transcript_dict, dstruct.PathDict):
+        ISM_matches = [transcript_dict[x] for x in transcript_dict.supersets(edges)]
+    else:
+        ISM_matches = [transcript_dict[x] for x in transcript_dict if edges.issubset(x)]
 
     if len(ISM_matches) > 0:
         return ISM_matches
@@ -662,9 +1127,9 @@ def search_for_ISM(edge_IDs, transcript_dict):
         return None
 
 
-def search_for_overlap_with_gene(chromosome, start, end, strand, cursor, run_info, tmp_gene, tmp_t, gene_IDs=None):
-    """Given a start and an end value for an interval, query the database to
-    determine whether the interval overlaps with any genes. If it there is
+def search_for_overlap_with_gene(chromosome, start, end, strand, run_info, transcript_index, gene_IDs=None):
+    """Given a start and an end value for an interval, query the transcript
+    interval index to determine whether the interval overlaps with any genes. If it there is
     more than one match, prioritize same-strand first and foremost.
     If there is more than one same-strand option, prioritize distance from 3' / 5'.
     Antisense matches may be returned if there is no same strand
@@ -679,34 +1144,15 @@ def search_for_overlap_with_gene(chromosome, start, end, strand, cursor, run_inf
     query_interval = [min_start, max_end]
 
     if isinstance(gene_IDs, list):
-        query = Template(
-            """SELECT gene_ID,
-                           transcript_ID,
-                           chromosome,
-                           min_pos,
-                           max_pos,
-                           strand
-                    FROM $tmp_t
-                    WHERE gene_ID IN $gene_ids"""
-        ).substitute({"tmp_t": tmp_t, "gene_ids": qutils.format_for_IN(gene_IDs)})
+        matches = transcript_index.lookup(gene_IDs)
     elif not gene_IDs:
-        query = Template(
-            """SELECT gene_ID,
-                           transcript_ID,
-                           chromosome,
-                           min_pos,
-                           max_pos,
-                           strand
-                    FROM $tmp_t
-                    WHERE (chromosome = '$chrom') AND
-                          ((min_pos <= $min_start AND max_pos >= $max_end) OR
-                          (min_pos >= $min_start AND max_pos <= $max_end) OR
-                          (min_pos >= $min_start AND min_pos <= $max_end) OR
-                          (max_pos >= $min_start AND max_pos <= $max_end))
-                     GROUP BY gene_ID;"""
-        ).substitute({"tmp_t": tmp_t, "chrom": chromosome, "min_start": min_start, "max_end": max_end})
-    cursor.execute(query)
-    matches = cursor.fetchall()
+        # Use one transcript per overlapping gene (the first one on record),
+        # ordered by gene ID
+        gene_matches = {}
+        for match in transcript_index.overlapping(chromosome, min_start, max_end):
+            if match["gene_ID"] not in gene_matches:
+                gene_matches[match["gene_ID"]] = match
+        matches = [gene_matches[gene_ID] for gene_ID in sorted(gene_matches)]
 
     # restrict to just the genes we care about
     if gene_IDs:
@@ -948,8 +1394,8 @@ def process_ISM(
     locations,
     run_info,
     cursor,
-    tmp_gene,
-    tmp_t,
+    gene_index,
+    transcript_index,
 ):
     """Given a transcript, try to find an ISM match for it. If the
     best match is an ISM with known ends, that will be promoted to NIC."""
@@ -972,7 +1418,7 @@ def process_ISM(
     # tie break based on distance to 5' / 3' ends
     if len(gene_matches) > 1:
         gene_ID, _ = search_for_overlap_with_gene(
-            chrom, positions[0], positions[-1], strand, cursor, run_info, tmp_gene, tmp_t, gene_IDs=gene_matches
+            chrom, positions[0], positions[-1], strand, run_info, transcript_index, gene_IDs=gene_matches
         )
         all_matches = [m for m in all_matches if m["gene_ID"] == gene_ID]
     else:
@@ -1028,31 +1474,33 @@ def process_ISM(
                 novelty = []
                 return gene_ID, transcript_ID, novelty, start_end_info
 
-            match_path = match["jn_path"]
+            # Compare whole edge IDs rather than substrings of the path
+            match_path = match["jn_path"].split(",")
             exon = str(edge_IDs[0])
             # Look for prefix
-            if match_path.startswith(exon):
+            if match_path[0] == exon:
                 prefix.append(str(match["transcript_ID"]))
             # Look for suffix
-            if match_path.endswith(exon):
+            if match_path[-1] == exon:
                 suffix.append(str(match["transcript_ID"]))
                 gene_ID = match["gene_ID"]
             continue
 
         # Multi-exon case
-        edge_str = ",".join([str(x) for x in edge_IDs[1:-1]])
+        match_path = match["jn_path"].split(",")
+        edges = [str(x) for x in edge_IDs[1:-1]]
 
         # Look for prefix
-        if match["jn_path"].startswith(edge_str):
+        if match_path[: len(edges)] == edges:
             prefix.append(str(match["transcript_ID"]))
 
         # Look for suffix
-        if match["jn_path"].endswith(edge_str):
+        if match_path[len(match_path) - len(edges) :] == edges:
             gene_ID = match["gene_ID"]
             suffix.append(str(match["transcript_ID"]))
 
     novel_transcript = create_transcript(
-        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, cursor
+        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
     )
 
     transcript_ID = novel_transcript["transcript_ID"]
@@ -1073,7 +1521,7 @@ def process_ISM(
 
 
 def assign_gene(
-    vertex_IDs, strand, vertex_2_gene, chrom, start, end, cursor, run_info, tmp_gene, tmp_t):
+    vertex_IDs, strand, vertex_2_gene, chrom, start, end, cursor, run_info, gene_index, transcript_index):
     """
     Assign a gene to a transcript. First do this on the basis of splice site
     matching. If this yields more than one gene, then choose the gene with the
@@ -1093,7 +1541,7 @@ def assign_gene(
     # only if it wasn't previously labeled as fusion
     if type(gene_ID) == list and fusion == False:
         gene_ID, match_strand = search_for_overlap_with_gene(
-            chrom, start, end, strand, cursor, run_info, tmp_gene, tmp_t, gene_IDs=gene_ID
+            chrom, start, end, strand, run_info, transcript_index, gene_IDs=gene_ID
         )
     return gene_ID, fusion
 
@@ -1112,8 +1560,8 @@ def process_NIC(
     vertex_2_gene,
     run_info,
     cursor,
-    tmp_gene,
-    tmp_t,
+    gene_index,
+    transcript_index,
 ):
     """For a transcript that has been determined to be novel in catalog, find
     the proper gene match (documenting fusion event if applicable). To do
@@ -1130,8 +1578,8 @@ def process_NIC(
         positions[-1],
         cursor,
         run_info,
-        tmp_gene,
-        tmp_t
+        gene_index,
+        transcript_index
     )
 
     # gene_ID, fusion = find_gene_match_on_vertex_basis(vertex_IDs,
@@ -1142,7 +1590,7 @@ def process_NIC(
     # if gene_ID == None and fusion == False:
     #   gene_ID, match_strand = search_for_overlap_with_gene(chrom, positions[0],
     #                                                        positions[-1], strand,
-    #                                                        cursor, run_info, tmp_gene,
+    #                                                        cursor, run_info, gene_index,
     #                                                        gene_starts, gene_ends)
     #   print('geneid from search for overlap with gene  9NIC)')
     #   print(gene_ID)
@@ -1173,7 +1621,7 @@ def process_NIC(
 
     # Create a new transcript of that gene
     novel_transcript = create_transcript(
-        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, cursor
+        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
     )
     transcript_ID = novel_transcript["transcript_ID"]
     novelty = [(transcript_ID, run_info.idprefix, "TALON", "NIC_transcript", "TRUE")]
@@ -1314,8 +1762,8 @@ def process_NNC(
     vertex_2_gene,
     run_info,
     cursor,
-    tmp_gene,
-    tmp_t,
+    gene_index,
+    transcript_index,
 ):
     """Novel not in catalog case"""
 
@@ -1330,7 +1778,7 @@ def process_NNC(
     # if gene_ID == None and fusion == False:
     #     gene_ID, match_strand = search_for_overlap_with_gene(chrom, positions[0],
     #                                                          positions[-1], strand,
-    #                                                          cursor, run_info, tmp_gene,
+    #                                                          cursor, run_info, gene_index,
     #                                                          gene_starts, gene_ends)
     #     print('geneid from search for overlap with gene')
     #     print(gene_ID)
@@ -1343,8 +1791,8 @@ def process_NNC(
         positions[-1],
         cursor,
         run_info,
-        tmp_gene,
-        tmp_t
+        gene_index,
+        transcript_index
     )
     # print("gene id process_nnc")
     # print(gene_ID)
@@ -1377,7 +1825,7 @@ def process_NNC(
     start_end_info["vertex_IDs"] = vertex_IDs
 
     transcript_ID = create_transcript(
-        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, cursor
+        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
     )["transcript_ID"]
 
     novelty.append((transcript_ID, run_info.idprefix, "TALON", "NNC_transcript", "TRUE"))
@@ -1400,8 +1848,8 @@ def process_spliced_antisense(
     vertex_2_gene,
     run_info,
     cursor,
-    tmp_gene,
-    tmp_t,
+    gene_index,
+    transcript_index,
 ):
     """Annotate a transcript as antisense with splice junctions"""
 
@@ -1416,7 +1864,7 @@ def process_spliced_antisense(
     anti_gene_ID, fusion = find_gene_match_on_vertex_basis(vertex_IDs, anti_strand, vertex_2_gene)
     if type(anti_gene_ID) == list and fusion == False:
         anti_gene_ID, match_strand = search_for_overlap_with_gene(
-            chrom, positions[0], positions[-1], strand, cursor, run_info, tmp_gene, tmp_t, gene_IDs=anti_gene_ID
+            chrom, positions[0], positions[-1], strand, run_info, transcript_index, gene_IDs=anti_gene_ID
         )
     if anti_gene_ID == None:
         return None, None, gene_novelty, transcript_novelty, start_end_info
@@ -1442,9 +1890,9 @@ def process_spliced_antisense(
     start_end_info["edge_IDs"] = edge_IDs
     start_end_info["vertex_IDs"] = vertex_IDs
 
-    gene_ID = create_gene(chrom, positions[0], positions[-1], strand, cursor, tmp_gene)
+    gene_ID = create_gene(chrom, positions[0], positions[-1], strand, gene_index)
     transcript_ID = create_transcript(
-        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, cursor
+        strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
     )["transcript_ID"]
 
     # Handle gene annotations
@@ -1471,8 +1919,8 @@ def process_remaining_mult_cases(
     vertex_2_gene,
     run_info,
     cursor,
-    tmp_gene,
-    tmp_t,
+    gene_index,
+    transcript_index,
     fusion,
 ):
     """This function is a catch-all for multiexonic transcripts that were not
@@ -1483,7 +1931,7 @@ def process_remaining_mult_cases(
     start_end_info = {}
     if not run_info.create_novel_spliced_genes or not fusion:
         gene_ID, match_strand = search_for_overlap_with_gene(
-            chrom, positions[0], positions[-1], strand, cursor, run_info, tmp_gene, tmp_t
+            chrom, positions[0], positions[-1], strand, run_info, transcript_index
         )
     else:
         gene_ID = None
@@ -1521,20 +1969,20 @@ def process_remaining_mult_cases(
             t_nov = "intergenic_transcript"
             g_nov = "intergenic_novel"
 
-        gene_ID = create_gene(chrom, positions[0], positions[-1], strand, cursor, tmp_gene)
+        gene_ID = create_gene(chrom, positions[0], positions[-1], strand, gene_index)
 
         gene_novelty.append((gene_ID, run_info.idprefix, "TALON", g_nov, "TRUE"))
 
         transcript_ID = create_transcript(
-            strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, cursor
+            strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
         )["transcript_ID"]
         transcript_novelty.append((transcript_ID, run_info.idprefix, "TALON", t_nov, "TRUE"))
 
     elif match_strand != strand:
         anti_gene_ID = gene_ID
-        gene_ID = create_gene(chrom, positions[0], positions[-1], strand, cursor, tmp_gene)
+        gene_ID = create_gene(chrom, positions[0], positions[-1], strand, gene_index)
         transcript_ID = create_transcript(
-            strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, cursor
+            strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
         )["transcript_ID"]
 
         gene_novelty.append((gene_ID, run_info.idprefix, "TALON", "antisense_gene", "TRUE"))
@@ -1542,7 +1990,7 @@ def process_remaining_mult_cases(
         transcript_novelty.append((transcript_ID, run_info.idprefix, "TALON", "antisense_transcript", "TRUE"))
     else:
         transcript_ID = create_transcript(
-            strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, tmp_t, cursor
+            strand, chrom, positions[0], positions[-1], gene_ID, edge_IDs, vertex_IDs, transcript_dict, transcript_index
         )["transcript_ID"]
         transcript_novelty.append((transcript_ID, run_info.idprefix, "TALON", "genomic_transcript", "TRUE"))
 
@@ -1574,8 +2022,10 @@ def identify_transcript(
     gene_starts,
     gene_ends,
     run_info,
-    tmp_gene,
-    tmp_t,
+    gene_index,
+    transcript_index,
+    read_cache=None,
+    known_chains=None,
 ):
     """Inputs:
      - Information about the query transcript
@@ -1590,6 +2040,8 @@ def identify_transcript(
        - gene_starts (maps gene IDs to known start vertices)
        - gene_ends (maps gene IDs to known end vertices)
        - run_info
+       - read_cache (optional; remembers FSM matches by splice sites)
+       - known_chains (optional; known transcripts by splice sites)
 
     Outputs:
        - Assigned gene ID
@@ -1603,14 +2055,30 @@ def identify_transcript(
     n_exons = int(len(positions) / 2.0)
     gene_ID = None
 
+    # Reads whose splice chain exactly matches a known transcript, or that
+    # already produced a clean FSM match, can skip straight to end matching
+    # against the same transcript
+    cache_key = (chrom, strand, tuple(positions[1:-1]))
+    cached = known_chains.lookup(cache_key) if known_chains is not None else None
+    if cached is None and read_cache is not None:
+        cached = read_cache.lookup(cache_key)
+
     # Get vertex matches for the transcript positions
-    vertex_IDs, v_novelty = match_splice_vertices(chrom, positions, strand, location_dict, run_info)
+    if cached is None:
+        vertex_IDs, v_novelty = match_splice_vertices(chrom, positions, strand, location_dict, run_info)
+    else:
+        vertex_IDs = list(cached[0])
+        v_novelty = [0] * len(vertex_IDs)
     logging.debug(f'Vertex IDs: {vertex_IDs}')
     logging.debug(f'Vertex novelties: {v_novelty}')
 
 
     # Get edge matches for transcript exons and introns based on the vertices
-    edge_IDs, e_novelty = match_all_splice_edges(vertex_IDs, strand, edge_dict, run_info)
+    if cached is None:
+        edge_IDs, e_novelty = match_all_splice_edges(vertex_IDs, strand, edge_dict, run_info)
+    else:
+        edge_IDs = list(cached[1])
+        e_novelty = [0] * len(edge_IDs)
     logging.debug(f'Edge IDs: {edge_IDs}')
     logging.debug(f'Exon novelty: {e_novelty}')
 
@@ -1628,7 +2096,10 @@ def identify_transcript(
     # Look for FSM or ISM.
     if all_SJs_known:
         # Get all FSM/ISM matches
-        all_matches = search_for_ISM(edge_IDs, transcript_dict)
+        if cached is None:
+            all_matches = search_for_ISM(edge_IDs, transcript_dict)
+        else:
+            all_matches = [cached[2]]
         if all_matches != None:
             # Look for FSM first
             # print("looking for fsm")
@@ -1646,6 +2117,10 @@ def identify_transcript(
                 location_dict,
                 run_info,
             )
+            if gene_ID != None and cached is None and read_cache is not None:
+                if sum(v_novelty) == 0 and sum(e_novelty) == 0:
+                    FSM_match = [x for x in all_matches if x["transcript_ID"] == transcript_ID][0]
+                    read_cache[cache_key] = (tuple(vertex_IDs), tuple(edge_IDs), FSM_match)
             if gene_ID == None:
                 # Now look for ISM
                 # print("looking for ism")
@@ -1664,8 +2139,8 @@ def identify_transcript(
                     location_dict,
                     run_info,
                     cursor,
-                    tmp_gene,
-                    tmp_t,
+                    gene_index,
+                    transcript_index,
                 )
 
         # Look for NIC
@@ -1686,8 +2161,8 @@ def identify_transcript(
                 vertex_2_gene,
                 run_info,
                 cursor,
-                tmp_gene,
-                tmp_t,
+                gene_index,
+                transcript_index,
             )
 
     # Novel in catalog transcripts have known splice donors and acceptors,
@@ -1709,8 +2184,8 @@ def identify_transcript(
             vertex_2_gene,
             run_info,
             cursor,
-            tmp_gene,
-            tmp_t,
+            gene_index,
+            transcript_index,
         )
 
     # Antisense transcript with splice junctions matching known gene
@@ -1731,8 +2206,8 @@ def identify_transcript(
             vertex_2_gene,
             run_info,
             cursor,
-            tmp_gene,
-            tmp_t,
+            gene_index,
+            transcript_index,
         )
 
     # Novel not in catalog transcripts contain new splice donors/acceptors
@@ -1755,8 +2230,8 @@ def identify_transcript(
             vertex_2_gene,
             run_info,
             cursor,
-            tmp_gene,
-            tmp_t,
+            gene_index,
+            transcript_index,
         )
         # print(f"geneID from process_nnc: {gene_ID}")
     # Transcripts that don't match the previous categories end up here
@@ -1777,8 +2252,8 @@ def identify_transcript(
             vertex_2_gene,
             run_info,
             cursor,
-            tmp_gene,
-            tmp_t,
+            gene_index,
+            transcript_index,
             fusion,
         )
 
@@ -2041,6 +2516,7 @@ def init_run_info(
     use_cb_tag=False,
     create_novel_spliced_genes=False,
     tmp_dir="talon_tmp/",
+    use_read_cache=True,
 ):
     """Initializes a dictionary that keeps track of important run information
     such as the desired genome build, the prefix for novel identifiers,
@@ -2057,6 +2533,9 @@ def init_run_info(
         run_info.use_cb_tag = use_cb_tag
         run_info.create_novel_spliced_genes = create_novel_spliced_genes
         run_info.tmp_dir = tmp_dir
+        run_info.use_read_cache = use_read_cache
+        run_info.shard_schema = None
+        run_info.read_labels = None
         os.system("mkdir -p %s " % (tmp_dir))
 
         # Fetch information from run_info table
@@ -2077,8 +2556,8 @@ def init_run_info(
 
 
 def init_outfiles(outprefix, tmp_dir="talon_tmp/"):
-    """Initialize output files for the run that all processes will be able to
-    write to via the queue."""
+    """Initialize output files for the run. Each job writes its own shards,
+    which are merged into these files once all jobs are done."""
 
     # If there is a tmp dir there already, remove it
     if os.path.exists(tmp_dir):
@@ -2116,37 +2595,40 @@ def init_outfiles(outprefix, tmp_dir="talon_tmp/"):
     return outfiles
 
 
-def prepare_data_structures(cursor, run_info, chrom=None, start=None, end=None, tmp_id="1"):
+def prepare_data_structures(cursor, run_info, chrom=None, start=None, end=None):
     """Initializes data structures needed for the run and organizes them
-    in a dictionary for more ease of use when passing them between functions
+    in a dictionary for more ease of use when passing them between functions.
+    If the run has shared reference tables (run_info.reference_dir), the
+    known entries for the region are read from those rather than the
+    database. Anything created while annotating goes into these per-region
+    structures only.
     """
     build = run_info.build
     min_coverage = run_info.min_coverage
     min_identity = run_info.min_identity
     struct_collection = dstruct.Struct()
 
-    struct_collection.tmp_gene = init_refs.make_temp_novel_gene_table(
-        cursor, build, chrom=chrom, start=start, end=end, tmp_tab="temp_gene_" + tmp_id
-    )
+    reference = None
+    if run_info.get("reference_dir") is not None:
+        reference = init_refs.load_reference_tables(run_info.reference_dir)
+    region = dict(chrom=chrom, start=start, end=end, reference=reference)
 
-    struct_collection.tmp_monoexon = init_refs.make_temp_monoexonic_transcript_table(
-        cursor, build, chrom=chrom, start=start, end=end, tmp_tab="temp_monoexon_" + tmp_id
-    )
+    struct_collection.gene_index = init_refs.make_gene_interval_index(cursor, build, **region)
 
-    struct_collection.tmp_t = init_refs.make_temp_transcript_table(
-        cursor, build, chrom=chrom, start=start, end=end, tmp_tab="temp_t_" + tmp_id
-    )
+    struct_collection.monoexon_index = init_refs.make_monoexon_interval_index(cursor, build, **region)
+
+    struct_collection.transcript_index = init_refs.make_transcript_interval_index(cursor, build, **region)
 
-    location_dict = init_refs.make_location_dict(build, cursor, chrom=chrom, start=start, end=end)
+    location_dict = init_refs.make_location_dict(build, cursor, **region)
 
-    edge_dict = init_refs.make_edge_dict(cursor, build=build, chrom=chrom, start=start, end=end)
+    edge_dict = init_refs.make_edge_dict(cursor, build=build, **region)
 
-    transcript_dict = init_refs.make_transcript_dict(cursor, build, chrom=chrom, start=start, end=end)
+    transcript_dict = init_refs.make_transcript_dict(cursor, build, **region)
 
-    vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor, build=build, chrom=chrom, start=start, end=end)
+    vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor, build=build, **region)
 
-    gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start", chrom=chrom, start=start, end=end)
-    gene_ends = init_refs.make_gene_start_or_end_dict(cursor, build, "end", chrom=chrom, start=start, end=end)
+    gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start", **region)
+    gene_ends = init_refs.make_gene_start_or_end_dict(cursor, build, "end", **region)
 
     struct_collection.location_dict = location_dict
     struct_collection.edge_dict = edge_dict
@@ -2155,6 +2637,13 @@ def prepare_data_structures(cursor, run_info, chrom=None, start=None, end=None,
     struct_collection.gene_starts = gene_starts
     struct_collection.gene_ends = gene_ends
 
+    struct_collection.known_chains = init_refs.make_known_splice_chains(transcript_dict, edge_dict, location_dict)
+
+    if run_info.use_read_cache:
+        struct_collection.read_cache = dstruct.ReadStructureCache(transcript_dict)
+    else:
+        struct_collection.read_cache = None
+
     return struct_collection
 
 
@@ -2192,9 +2681,9 @@ def identify_monoexon_transcript(
     gene_starts,
     gene_ends,
     run_info,
-    tmp_gene,
-    tmp_t,
-    tmp_monoexon,
+    gene_index,
+    transcript_index,
+    monoexon_index,
 ):
     gene_novelty = []
     transcript_novelty = []
@@ -2207,28 +2696,7 @@ def identify_monoexon_transcript(
     end = positions[-1]
     # First, look for a monoexonic transcript match that overlaps the current
     # transcript
-    query = Template(
-        """ SELECT *
-                    FROM $tmp_monoexon AS tm
-                    WHERE tm.chromosome = '$chrom'
-                    AND tm.strand = '$strand'
-                    AND ((min_pos <= $start AND max_pos >= $end)
-                      OR (min_pos >= $start AND max_pos <= $end)
-                      OR (min_pos >= $start AND min_pos <= $end)
-                      OR (max_pos >= $start AND max_pos <= $end))
-                    """
-    ).substitute(
-        {
-            "tmp_monoexon": tmp_monoexon,
-            "chrom": chrom,
-            "strand": strand,
-            "start": min(start, end),
-            "end": max(start, end),
-        }
-    )
-
-    cursor.execute(query)
-    matches = cursor.fetchall()
+    matches = monoexon_index.overlapping(chrom, start, end, strand)
 
     # If there is more than one match, apply a tiebreaker (pick the one with
     # the most overlap
@@ -2280,17 +2748,17 @@ def identify_monoexon_transcript(
                     location_dict,
                     run_info,
                     cursor,
-                    tmp_gene,
-                    tmp_t,
+                    gene_index,
+                    transcript_index,
                 )
         if gene_ID == None:
             # Find best gene match using overlap search if the ISM/NIC check didn't work
             gene_ID, match_strand = search_for_overlap_with_gene(
-                chrom, positions[0], positions[1], strand, cursor, run_info, tmp_gene, tmp_t
+                chrom, positions[0], positions[1], strand, run_info, transcript_index
             )
             # Intergenic case
             if gene_ID == None:
-                gene_ID = create_gene(chrom, positions[0], positions[-1], strand, cursor, tmp_gene)
+                gene_ID = create_gene(chrom, positions[0], positions[-1], strand, gene_index)
 
                 gene_novelty.append((gene_ID, run_info.idprefix, "TALON", "intergenic_novel", "TRUE"))
                 transcript_ID = create_transcript(
@@ -2302,14 +2770,13 @@ def identify_monoexon_transcript(
                     edge_IDs,
                     vertex_IDs,
                     transcript_dict,
-                    tmp_t,
-                    cursor,
+                    transcript_index
                 )["transcript_ID"]
                 transcript_novelty.append((transcript_ID, run_info.idprefix, "TALON", "intergenic_transcript", "TRUE"))
             # Antisense case
             elif match_strand != strand:
                 anti_gene_ID = gene_ID
-                gene_ID = create_gene(chrom, positions[0], positions[-1], strand, cursor, tmp_gene)
+                gene_ID = create_gene(chrom, positions[0], positions[-1], strand, gene_index)
                 transcript_ID = create_transcript(
                     strand,
                     chrom,
@@ -2319,8 +2786,7 @@ def identify_monoexon_transcript(
                     edge_IDs,
                     vertex_IDs,
                     transcript_dict,
-                    tmp_t,
-                    cursor,
+                    transcript_index
                 )["transcript_ID"]
 
                 gene_novelty.append((gene_ID, run_info.idprefix, "TALON", "antisense_gene", "TRUE"))
@@ -2338,8 +2804,7 @@ def identify_monoexon_transcript(
                     edge_IDs,
                     vertex_IDs,
                     transcript_dict,
-                    tmp_t,
-                    cursor,
+                    transcript_index
                 )["transcript_ID"]
                 transcript_novelty.append((transcript_ID, run_info.idprefix, "TALON", "genomic_transcript", "TRUE"))
 
@@ -2365,27 +2830,21 @@ def identify_monoexon_transcript(
         if e_novelty[0] == 1:
             exon_novelty.append((edge_IDs[0], run_info.idprefix, "TALON", "exon_status", "NOVEL"))
 
-        # Add the novel transcript to the temporary monoexon table
-        new_mono = (
-            gene_ID,
-            transcript_ID,
-            chrom,
-            start,
-            end,
-            strand,
-            vertex_IDs[0],
-            vertex_IDs[-1],
-            edge_IDs[0],
-            min(start, end),
-            max(start, end),
-        )
-        cols = (
-            '("gene_ID", "transcript_ID", "chromosome", "start", "end",'
-            + '"strand", "start_vertex", "end_vertex", "exon_ID", "min_pos",'
-            + '"max_pos")'
-        )
-        command = "INSERT INTO " + tmp_monoexon + " " + cols + " VALUES " + "(?,?,?,?,?,?,?,?,?,?,?)"
-        cursor.execute(command, new_mono)
+        # Add the novel transcript to the monoexon index
+        new_mono = {
+            "gene_ID": gene_ID,
+            "transcript_ID": transcript_ID,
+            "chromosome": chrom,
+            "start": start,
+            "end": end,
+            "strand": strand,
+            "start_vertex": vertex_IDs[0],
+            "end_vertex": vertex_IDs[-1],
+            "exon_ID": edge_IDs[0],
+            "min_pos": min(start, end),
+            "max_pos": max(start, end),
+        }
+        monoexon_index.add(chrom, strand, new_mono["min_pos"], new_mono["max_pos"], new_mono)
 
     # Package annotation information
     annotations = dstruct.Struct()
@@ -2404,32 +2863,177 @@ def identify_monoexon_transcript(
     return annotations
 
 
-def update_database(database, batch_size, outfiles, datasets):
-    """Adds new entries to the database."""
+def update_database(database, batch_size, outfiles, datasets, bulk_load=False, staged_db=None):
+    """Adds new entries to the database. All changes are made in a single
+    transaction that is only committed if the database passes the integrity
+    check. The new entries are read from the outfiles, or, if staged_db is
+    given, copied from that database (see merge_shard_databases). In bulk
+    load mode, SQLite is tuned for a large load and the secondary indexes
+    of tables that the load will at least double are dropped and rebuilt
+    after the inserts, inside the same transaction."""
 
     conn = sqlite3.connect(database)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
+    if staged_db is not None:
+        cursor.execute("ATTACH DATABASE ? AS staged", (staged_db,))
+
+    if bulk_load:
+        for pragma in BULK_LOAD_PRAGMAS:
+            cursor.execute(pragma)
+        # Open the transaction explicitly so that the index changes are
+        # part of it too
+        cursor.execute("BEGIN")
+        deferred_indexes = drop_deferred_indexes(cursor, outfiles, staged=staged_db is not None)
+
+        # The loaders create millions of short-lived row lists, and garbage
+        # collection passes over them only slow the load down
+        gc_enabled = gc.isenabled()
+        gc.disable()
+
+    try:
+        if staged_db is None:
+            load_staged_files(cursor, batch_size, outfiles, datasets)
+        else:
+            load_staged_database(cursor, batch_size, datasets)
+    finally:
+        if bulk_load and gc_enabled:
+            gc.enable()
+
+    if bulk_load:
+        for command in init_db.index_commands(names=deferred_indexes):
+            cursor.execute(command)
+
+    check_database_integrity(cursor)
+    conn.commit()
+    conn.close()
+
+    return
+
+
+def load_staged_files(cursor, batch_size, outfiles, datasets):
+    """Add the new entries in the outfiles to the database"""
 
     batch_add_genes(cursor, outfiles.genes, batch_size)
     batch_add_transcripts(cursor, outfiles.transcripts, batch_size)
     batch_add_edges(cursor, outfiles.edges, batch_size)
     batch_add_locations(cursor, outfiles.location, batch_size)
     batch_add_vertex2gene(cursor, outfiles.v2g, batch_size)
+    batch_update_extents(cursor, outfiles.transcripts, outfiles.v2g, batch_size)
     add_datasets(cursor, datasets)
     batch_add_observed(cursor, outfiles.observed, batch_size)
     update_counter(cursor)
     batch_add_annotations(cursor, outfiles.gene_annot, "gene", batch_size)
     batch_add_annotations(cursor, outfiles.transcript_annot, "transcript", batch_size)
     batch_add_annotations(cursor, outfiles.exon_annot, "exon", batch_size)
+    return
 
-    check_database_integrity(cursor)
-    conn.commit()
-    conn.close()
 
+def load_staged_database(cursor, batch_size, datasets):
+    """Copy the new entries in the attached staging database to the main
+    database, table by table and in the order that they were staged"""
+
+    def copy_table(name):
+        table, insert = STAGED_TABLES[name]
+        try:
+            cursor.execute("%s INTO main.%s SELECT * FROM staged.%s ORDER BY rowid" % (insert, table, table))
+        except Exception as e:
+            logging.error(e)
+            sys.exit(1)
+
+    for name in ["genes", "transcripts", "edges", "location", "v2g"]:
+        copy_table(name)
+
+    cursor.execute("SELECT transcript_ID FROM staged.transcripts ORDER BY rowid")
+    transcript_IDs = [x[0] for x in cursor.fetchall()]
+    cursor.execute("SELECT DISTINCT gene_ID FROM staged.vertex ORDER BY gene_ID")
+    gene_IDs = [x[0] for x in cursor.fetchall()]
+    update_extents(cursor, transcript_IDs, gene_IDs, batch_size)
+
+    add_datasets(cursor, datasets)
+    copy_table("observed")
+    add_staged_abundance(cursor)
+    update_counter(cursor)
+    for name in ["gene_annot", "transcript_annot", "exon_annot"]:
+        copy_table(name)
     return
 
 
+# Rows per executemany call in bulk load mode
+BULK_LOAD_BATCH_SIZE = 50000
+
+# Connection settings for the bulk load window: a 256 MB page cache and
+# in-memory temporary storage for index builds
+BULK_LOAD_PRAGMAS = ["PRAGMA cache_size = -262144", "PRAGMA temp_store = MEMORY"]
+
+# Tables whose secondary indexes may be rebuilt after a bulk load, and the
+# staged outfile that their new rows come from
+DEFERRED_INDEX_SOURCES = {
+    "observed": "observed",
+    "abundance": "observed",
+    "gene_annotations": "gene_annot",
+    "transcript_annotations": "transcript_annot",
+}
+
+
+def drop_deferred_indexes(cursor, outfiles, staged=False):
+    """Drop the secondary indexes on each table in DEFERRED_INDEX_SOURCES
+    that will receive at least as many new rows as it has now. Rebuilding
+    those indexes once after the load is cheaper than updating them row by
+    row. Returns the names of the dropped indexes."""
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing = set([x[0] for x in cursor.fetchall()])
+
+    n_new = {}
+    dropped = []
+    for table, source in DEFERRED_INDEX_SOURCES.items():
+        if source not in n_new:
+            n_new[source] = count_new_rows(cursor, outfiles, source, staged)
+        cursor.execute("SELECT MAX(rowid) FROM " + table)
+        n_old = cursor.fetchone()[0] or 0
+        if n_new[source] < n_old:
+            continue
+
+        for name, index_table, columns in init_db.INDEXES:
+            if index_table == table and name in existing:
+                cursor.execute("DROP INDEX " + name)
+                dropped.append(name)
+
+    return dropped
+
+
+def count_new_rows(cursor, outfiles, name, staged=False):
+    """Number of new rows for the named outfile, read either from the
+    outfile itself or from the attached staging database"""
+
+    if staged:
+        cursor.execute("SELECT COUNT(*) FROM staged." + STAGED_TABLES[name][0])
+        return cursor.fetchone()[0]
+    with open(getattr(outfiles, name), "r") as f:
+        return sum(1 for line in f)
+
+
+def read_staged_rows(staged_file, batch_size):
+    """Yields the rows of a staged outfile in batches of field lists"""
+
+    with open(staged_file, "r") as f:
+        while True:
+            batch = [line.strip().split("\t") for line in islice(f, batch_size)]
+
+            if batch == []:
+                break
+            yield batch
+
+
+def placeholders(n_columns, optional=()):
+    """Returns the VALUES placeholders for an insert of staged rows.
+    Columns listed in optional may hold 'None', which becomes NULL. All
+    other values are converted to the column type by SQLite itself."""
+    values = ["NULLIF(?, 'None')" if i in optional else "?" for i in range(n_columns)]
+    return "(" + ",".join(values) + ")"
+
+
 def update_counter(cursor):  # , n_datasets):
     """Update the database counter using the global counter variables"""
 
@@ -2458,139 +3062,129 @@ def update_counter(cursor):  # , n_datasets):
 def batch_add_vertex2gene(cursor, v2g_file, batch_size):
     """Add new vertex-gene relationships to the vertex table"""
 
-    with open(v2g_file, "r") as f:
-        while True:
-            batch = [tuple(x.strip().split("\t")) for x in islice(f, batch_size)]
+    cols = " (" + ", ".join([str_wrap_double(x) for x in ["vertex_ID", "gene_ID"]]) + ") "
+    command = 'INSERT OR IGNORE INTO "vertex"' + cols + "VALUES " + "(?,?)"
+    try:
+        for batch in read_staged_rows(v2g_file, batch_size):
+            cursor.executemany(command, batch)
 
-            if batch == []:
-                break
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
+    return
 
-            try:
-                cols = " (" + ", ".join([str_wrap_double(x) for x in ["vertex_ID", "gene_ID"]]) + ") "
-                command = 'INSERT OR IGNORE INTO "vertex"' + cols + "VALUES " + "(?,?)"
-                cursor.executemany(command, batch)
 
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+def batch_update_extents(cursor, transcript_file, v2g_file, batch_size):
+    """Add the extents of the new transcripts in the transcript file to the
+    database, and recompute the extents of every gene in the v2g file"""
+
+    with open(transcript_file, "r") as f:
+        transcript_IDs = [x.split("\t", 1)[0] for x in f]
+    with open(v2g_file, "r") as f:
+        gene_IDs = set(x.strip().split("\t")[1] for x in f)
+    update_extents(cursor, transcript_IDs, sorted(gene_IDs, key=int), batch_size)
     return
 
 
-def batch_add_locations(cursor, location_file, batch_size):
-    """Add new locations to database"""
+def update_extents(cursor, transcript_IDs, gene_IDs, batch_size):
+    """Add the extents of new transcripts to the database, and recompute
+    the extents of every gene that gained vertices"""
 
-    with open(location_file, "r") as f:
-        while True:
-            batch = [tuple(x.strip().split("\t")) for x in islice(f, batch_size)]
+    for i in range(0, len(transcript_IDs), batch_size):
+        try:
+            init_db.add_transcript_extents(cursor, transcript_IDs[i : i + batch_size])
 
-            if batch == []:
-                break
+        except Exception as e:
+            logging.error(e)
+            sys.exit(1)
 
-            try:
-                cols = (
-                    " ("
-                    + ", ".join([str_wrap_double(x) for x in ["location_ID", "genome_build", "chromosome", "position"]])
-                    + ") "
-                )
-                command = 'INSERT INTO "location"' + cols + "VALUES " + "(?,?,?,?)"
-                cursor.executemany(command, batch)
+    for i in range(0, len(gene_IDs), batch_size):
+        try:
+            init_db.update_gene_extents(cursor, gene_IDs[i : i + batch_size])
 
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+        except Exception as e:
+            logging.error(e)
+            sys.exit(1)
     return
 
 
-def batch_add_edges(cursor, edge_file, batch_size):
-    """Add new edges to database"""
+def batch_add_locations(cursor, location_file, batch_size):
+    """Add new locations to database"""
 
-    with open(edge_file, "r") as f:
-        while True:
-            batch = [tuple(x.strip().split("\t")) for x in islice(f, batch_size)]
+    cols = (
+        " (" + ", ".join([str_wrap_double(x) for x in ["location_ID", "genome_build", "chromosome", "position"]]) + ") "
+    )
+    command = 'INSERT INTO "location"' + cols + "VALUES " + "(?,?,?,?)"
+    try:
+        for batch in read_staged_rows(location_file, batch_size):
+            cursor.executemany(command, batch)
 
-            if batch == []:
-                break
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
+    return
 
-            try:
-                cols = (
-                    " ("
-                    + ", ".join([str_wrap_double(x) for x in ["edge_ID", "v1", "v2", "edge_type", "strand"]])
-                    + ") "
-                )
-                command = 'INSERT INTO "edge"' + cols + "VALUES " + "(?,?,?,?,?)"
-                cursor.executemany(command, batch)
 
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+def batch_add_edges(cursor, edge_file, batch_size):
+    """Add new edges to database"""
+
+    cols = " (" + ", ".join([str_wrap_double(x) for x in ["edge_ID", "v1", "v2", "edge_type", "strand"]]) + ") "
+    command = 'INSERT INTO "edge"' + cols + "VALUES " + "(?,?,?,?,?)"
+    try:
+        for batch in read_staged_rows(edge_file, batch_size):
+            cursor.executemany(command, batch)
 
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
     return
 
 
 def batch_add_transcripts(cursor, transcript_file, batch_size):
     """Add new transcripts to database"""
 
-    with open(transcript_file, "r") as f:
-        while True:
-            batch_lines = islice(f, batch_size)
-            batch = []
-            for line in batch_lines:
-                transcript = line.strip().split("\t")
-                if transcript[3] == "None":
-                    transcript[3] = None
-                batch.append(transcript)
-
-            if batch == []:
-                break
-
-            try:
-                cols = (
-                    " ("
-                    + ", ".join(
-                        [
-                            str_wrap_double(x)
-                            for x in [
-                                "transcript_id",
-                                "gene_id",
-                                "start_exon",
-                                "jn_path",
-                                "end_exon",
-                                "start_vertex",
-                                "end_vertex",
-                                "n_exons",
-                            ]
-                        ]
-                    )
-                    + ") "
-                )
-                command = 'INSERT INTO "transcripts"' + cols + "VALUES " + "(?,?,?,?,?,?,?,?)"
-                cursor.executemany(command, batch)
-
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+    cols = (
+        " ("
+        + ", ".join(
+            [
+                str_wrap_double(x)
+                for x in [
+                    "transcript_id",
+                    "gene_id",
+                    "start_exon",
+                    "jn_path",
+                    "end_exon",
+                    "start_vertex",
+                    "end_vertex",
+                    "n_exons",
+                ]
+            ]
+        )
+        + ") "
+    )
+    command = 'INSERT INTO "transcripts"' + cols + "VALUES " + placeholders(8, optional=[3])
+    try:
+        for batch in read_staged_rows(transcript_file, batch_size):
+            cursor.executemany(command, batch)
 
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
     return
 
 
 def batch_add_genes(cursor, gene_file, batch_size):
     """Add genes to the database gene table"""
 
-    with open(gene_file, "r") as f:
-        while True:
-            batch = [tuple(x.strip().split("\t")) for x in islice(f, batch_size)]
-
-            if batch == []:
-                break
-
-            try:
-                cols = " (" + ", ".join([str_wrap_double(x) for x in ["gene_ID", "strand"]]) + ") "
-                command = "INSERT OR IGNORE INTO genes" + cols + "VALUES " + "(?,?)"
-                cursor.executemany(command, batch)
+    cols = " (" + ", ".join([str_wrap_double(x) for x in ["gene_ID", "strand"]]) + ") "
+    command = "INSERT OR IGNORE INTO genes" + cols + "VALUES " + "(?,?)"
+    try:
+        for batch in read_staged_rows(gene_file, batch_size):
+            cursor.executemany(command, batch)
 
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
     return
 
 
@@ -2612,31 +3206,20 @@ def add_datasets(cursor, datasets):
 
 def batch_add_annotations(cursor, annot_file, annot_type, batch_size):
     """Add gene/transcript/exon annotations to the appropriate annotation table"""
-    batch_size = 1
     if annot_type not in ["gene", "transcript", "exon"]:
         msg = "When running batch annot update, must specify " + "annot_type as 'gene', 'exon', or 'transcript'."
         logging.error(msg)
         raise ValueError(msg)
 
-    with open(annot_file, "r") as f:
-        while True:
-            batch = [tuple(x.strip().split("\t")) for x in islice(f, batch_size)]
-
-            if batch == []:
-                break
-
-            try:
-                cols = (
-                    " ("
-                    + ", ".join([str_wrap_double(x) for x in ["ID", "annot_name", "source", "attribute", "value"]])
-                    + ") "
-                )
-                command = 'INSERT OR IGNORE INTO "' + annot_type + '_annotations" ' + cols + "VALUES " + "(?,?,?,?,?)"
-                cursor.executemany(command, batch)
+    cols = " (" + ", ".join([str_wrap_double(x) for x in ["ID", "annot_name", "source", "attribute", "value"]]) + ") "
+    command = 'INSERT OR IGNORE INTO "' + annot_type + '_annotations" ' + cols + "VALUES " + "(?,?,?,?,?)"
+    try:
+        for batch in read_staged_rows(annot_file, batch_size):
+            cursor.executemany(command, batch)
 
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
     return
 
 
@@ -2645,93 +3228,79 @@ def batch_add_observed(cursor, observed_file, batch_size):
     dataset, start_vertex_ID, end_vertex_ID, start_exon, end_exon,
     start_delta, end_delta, read_length) to observed table of database."""
 
-    abundance = {}
-    with open(observed_file, "r") as f:
-        while True:
-            batch = []
-            for observed in islice(f, batch_size):
-                observed = observed.strip().split("\t")
-
-                # Start/end delta and frac_A values may be None
-                if observed[9] == "None":
-                    observed[9] = None
-                if observed[10] == "None":
-                    observed[10] = None
-                if observed[12] == "None":
-                    observed[12] = None
-                if observed[13] == "None":
-                    observed[13] = None
-                if observed[14] == "None":
-                    observed[14] = None
-                if observed[15] == "None":
-                    observed[15] = None
-                if observed[16] == "None":
-                    observed[16] = None
-
-                batch.append(tuple(observed))
-
-                # Add record to abundance dict
-                dataset = observed[4]
-                transcript_ID = observed[2]
-
-                if dataset not in abundance:
-                    abundance[dataset] = {}
-
-                try:
-                    abundance[dataset][transcript_ID] += 1
-                except:
-                    abundance[dataset][transcript_ID] = 1
-
-            if batch == []:
-                break
+    cols = (
+        " ("
+        + ", ".join(
+            [
+                str_wrap_double(x)
+                for x in [
+                    "obs_ID",
+                    "gene_ID",
+                    "transcript_ID",
+                    "read_name",
+                    "dataset",
+                    "start_vertex",
+                    "end_vertex",
+                    "start_exon",
+                    "end_exon",
+                    "start_delta",
+                    "end_delta",
+                    "read_length",
+                    "fraction_As",
+                    "custom_label",
+                    "allelic_label",
+                    "start_support",
+                    "end_support",
+                ]
+            ]
+        )
+        + ") "
+    )
+    command = 'INSERT INTO "observed"' + cols + "VALUES " + placeholders(17, optional=[9, 10, 12, 13, 14, 15, 16])
 
-            # Add to database
-            try:
-                cols = (
-                    " ("
-                    + ", ".join(
-                        [
-                            str_wrap_double(x)
-                            for x in [
-                                "obs_ID",
-                                "gene_ID",
-                                "transcript_ID",
-                                "read_name",
-                                "dataset",
-                                "start_vertex",
-                                "end_vertex",
-                                "start_exon",
-                                "end_exon",
-                                "start_delta",
-                                "end_delta",
-                                "read_length",
-                                "fraction_As",
-                                "custom_label",
-                                "allelic_label",
-                                "start_support",
-                                "end_support",
-                            ]
-                        ]
-                    )
-                    + ") "
-                )
-                command = 'INSERT INTO "observed"' + cols + "VALUES " + "(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
-                cursor.executemany(command, batch)
+    # Count reads per (dataset, transcript_ID) for the abundance table
+    counts = collections.Counter()
+    try:
+        for batch in read_staged_rows(observed_file, batch_size):
+            cursor.executemany(command, batch)
+            counts.update(map(operator.itemgetter(4, 2), batch))
 
-            except Exception as e:
-                logging.error(e)
-                sys.exit(1)
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
 
-    # Now create abundance tuples and add to DB
-    abundance_tuples = []
-    for dataset in abundance.keys():
-        for transcript, count in abundance[dataset].items():
-            abundance_tuples.append((transcript, dataset, count))
+    # Now create abundance tuples, grouped by dataset, and add to DB
+    abundance = {}
+    for (dataset, transcript), count in counts.items():
+        abundance.setdefault(dataset, []).append((transcript, dataset, count))
+    abundance_tuples = [x for entries in abundance.values() for x in entries]
 
     batch_add_abundance(cursor, abundance_tuples, batch_size)
     return
 
 
+def add_staged_abundance(cursor):
+    """Count the reads per (transcript_ID, dataset) in the attached staging
+    database and add them to the abundance table. Rows are added in the
+    same order as batch_add_observed adds them: grouped by dataset, and in
+    order of first appearance."""
+
+    try:
+        cursor.execute(
+            """INSERT INTO main.abundance (transcript_ID, dataset, count)
+               SELECT transcript_ID, dataset, n_reads FROM (
+                   SELECT transcript_ID, dataset, COUNT(*) AS n_reads, MIN(rowid) AS first_read,
+                          MIN(MIN(rowid)) OVER (PARTITION BY dataset) AS first_dataset_read
+                   FROM staged.observed
+                   GROUP BY dataset, transcript_ID)
+               ORDER BY first_dataset_read, first_read"""
+        )
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
+    return
+
+
 def batch_add_abundance(cursor, entries, batch_size):
     """Reads abundance tuples (transcript_ID, dataset, count) and
     adds to the abundance table of the database"""
@@ -2797,13 +3366,28 @@ def check_database_integrity(cursor):
     return
 
 
-def parallel_talon(read_file, interval, database, run_info, queue):
+def label_reads_in_interval(reads, chrom, read_labels, tss_sites=None, pas_sites=None):
+    """Label the reads from one interval on chrom as they are streamed, the
+    way talon_label_reads would: secondary and unmapped alignments are
+    dropped, and the others get the fA tag along with the tS and tE tags
+    for whichever site catalogs are given."""
+    genome = pyfaidx.Fasta(read_labels.genome_file, sequence_always_upper=True, one_based_attributes=False)
+    counts = tlr.load_fracA_index(genome, chrom, read_labels.fracA_range_size, read_labels.index_dir)
+    reads = (record for record in reads if not (record.is_secondary or record.is_unmapped))
+    for record, frac_As in tlr.label_records(reads, chrom, counts, read_labels, tss_sites, pas_sites):
+        yield record
+
+
+def parallel_talon(read_file, interval, database, run_info, tss_sites=None, pas_sites=None):
     """Manage TALON processing of a single chunk of the input. Initialize
     reference data structures covering only the provided interval region,
-    then send the read file to the annotation step. Once annotation is
-    complete, return the data tuples generated so that they can be
-    added to the database, OR alternately, pickle them and write to file
-    where they can be accessed later."""
+    then stream the reads in that region from the indexed read file to the
+    annotation step. Output tuples are buffered and written in batches to
+    shard files named after the interval, which are merged once every job
+    has finished. If run_info has a shard schema, the rows for the database
+    tables go to an SQLite shard instead of text files. If run_info has
+    read label settings, the reads are labeled on their way to annotation,
+    using the chromosome's part of the start and end site catalogs."""
 
     # ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
     # print("[ %s ] Annotating reads in interval %s:%d-%d..." %
@@ -2814,96 +3398,109 @@ def parallel_talon(read_file, interval, database, run_info, queue):
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
-        tmp_id = str(os.getpid())
         struct_collection = prepare_data_structures(
-            cursor, run_info, chrom=interval[0], start=interval[1], end=interval[2], tmp_id=tmp_id
+            cursor, run_info, chrom=interval[0], start=interval[1], end=interval[2]
         )
 
         interval_id = "%s_%d_%d" % interval
+        n_annotated = 0
 
-        with pysam.AlignmentFile(read_file, "rb") as sam:
-            for record in sam:  # type: pysam.AlignedSegment
+        # Take IDs from blocks so that new entries don't need the shared lock
+        for counter in block_counters().values():
+            counter.start_blocks()
+
+        if run_info.shard_schema is None:
+            shard = OutputShard(run_info.shard_dir, interval_id)
+        else:
+            shard = DatabaseShard(run_info.shard_dir, interval_id, run_info.shard_schema)
+        with pysam.AlignmentFile(read_file, "rb") as sam, shard:
+            reads = procsams.get_reads_in_interval(sam, interval)
+            if run_info.read_labels is not None:
+                reads = label_reads_in_interval(reads, interval[0], run_info.read_labels, tss_sites, pas_sites)
+            for record in reads:  # type: pysam.AlignedSegment
                 # Check whether we should try annotating this read or not
                 qc_metrics = tutils.check_read_quality(record, run_info)
 
                 passed_qc = qc_metrics[2]
-                qc_msg = (run_info.outfiles.qc, "\t".join([str(x) for x in qc_metrics]))
-                queue.put(qc_msg)
+                shard.write_row("qc", qc_metrics)
 
                 if passed_qc:
+                    n_annotated += 1
                     annotation_info = annotate_read(record, cursor, run_info, struct_collection)
-                    unpack_observed(annotation_info, queue, run_info.outfiles.observed)
+                    unpack_observed(annotation_info, shard)
 
                     # Update annotation records
                     # TODO: there is no need for entry to be a list/tuple
                     for entry in annotation_info.gene_novelty:
-                        msg = (run_info.outfiles.gene_annot, "\t".join([str(x) for x in entry]))
-                        queue.put(msg)
+                        shard.write_row("gene_annot", entry)
                     for entry in annotation_info.transcript_novelty:
-                        msg = (run_info.outfiles.transcript_annot, "\t".join([str(x) for x in entry]))
-                        queue.put(msg)
+                        shard.write_row("transcript_annot", entry)
                     for entry in annotation_info.exon_novelty:
-                        msg = (run_info.outfiles.exon_annot, "\t".join([str(x) for x in entry]))
-                        queue.put(msg)
+                        shard.write_row("exon_annot", entry)
 
-        # Write the temp_gene table to file
-        cursor.execute("SELECT gene_ID, strand FROM " + struct_collection.tmp_gene)
-        for row in cursor.fetchall():
-            msg = (run_info.outfiles.genes, str(row["gene_ID"]) + "\t" + row["strand"])
-            queue.put(msg)
+    interval_str = f"{interval[0]}:{interval[1]}-{interval[2]}"
+    fast_path_hits = struct_collection.known_chains.hits
+    logging.info(
+        f"Known-structure fast path for interval {interval_str}: "
+        f"{fast_path_hits} of {n_annotated} reads ({100 * fast_path_hits / max(n_annotated, 1):.1f}%)"
+    )
+    read_cache = struct_collection.read_cache
+    if read_cache is not None:
+        logging.info(
+            f"Read structure cache for interval {interval_str}: "
+            f"{read_cache.hits} hits, {read_cache.misses} misses"
+        )
 
-    # Pass messages to output files
+    # Write new reference entries to the shard
     # ========================================================================
+    # Write new genes to file
+    for gene in struct_collection.gene_index:
+        if type(gene) is dict:
+            shard.write_row("genes", (gene["gene_ID"], gene["strand"]))
+
     # Write new transcripts to file
     transcripts = struct_collection.transcript_dict
     for transcript in list(transcripts.values()):
         # Only write novel transcripts to file
         if type(transcript) is dict:
-            entry = "\t".join(
-                [
-                    str(x)
-                    for x in (
-                        transcript["transcript_ID"],
-                        transcript["gene_ID"],
-                        transcript["start_exon"],
-                        transcript["jn_path"],
-                        transcript["end_exon"],
-                        transcript["start_vertex"],
-                        transcript["end_vertex"],
-                        transcript["n_exons"],
-                    )
-                ]
+            entry = (
+                transcript["transcript_ID"],
+                transcript["gene_ID"],
+                transcript["start_exon"],
+                transcript["jn_path"],
+                transcript["end_exon"],
+                transcript["start_vertex"],
+                transcript["end_vertex"],
+                transcript["n_exons"],
             )
-            queue.put((run_info.outfiles.transcripts, entry))
+            shard.write_row("transcripts", entry)
 
     # Write new edges to file
     edges = struct_collection.edge_dict
     for edge in list(edges.values()):
         if type(edge) is dict:
-            entry = "\t".join(
-                [str(x) for x in [edge["edge_ID"], edge["v1"], edge["v2"], edge["edge_type"], edge["strand"]]]
-            )
-            queue.put((run_info.outfiles.edges, entry))
+            entry = (edge["edge_ID"], edge["v1"], edge["v2"], edge["edge_type"], edge["strand"])
+            shard.write_row("edges", entry)
 
     # Write locations to file
     location_dict = struct_collection.location_dict
     for chrom_dict in location_dict.values():
         for loc in list(chrom_dict.values()):
             if type(loc) is dict:
-                msg = (
-                    run_info.outfiles.location,
-                    "\t".join(
-                        [str(x) for x in (loc["location_ID"], loc["genome_build"], loc["chromosome"], loc["position"])]
-                    ),
-                )
-                queue.put(msg)
+                entry = (loc["location_ID"], loc["genome_build"], loc["chromosome"], loc["position"])
+                shard.write_row("location", entry)
 
     # Write new vertex-gene combos to file
     for vertex_ID, gene_set in struct_collection.vertex_2_gene.items():
         for gene in gene_set:
-            msg = (run_info.outfiles.v2g, "\t".join([str(x) for x in (vertex_ID, gene[0])]))
-            queue.put(msg)
+            shard.write_row("v2g", (vertex_ID, gene[0]))
 
+    # Record the ID blocks used so that the IDs can be renumbered at merge
+    for name, counter in block_counters().items():
+        for first, n_used in counter.stop_blocks():
+            shard.write_row("id_blocks", (name, first, n_used))
+
+    shard.flush()
     struct_collection = None
 
     return
@@ -2979,16 +3576,11 @@ def annotate_read(sam_record: pysam.AlignedSegment, cursor, run_info, struct_col
     sam_start = sam_record.reference_start + mode
     sam_end = sam_record.reference_end
     read_length = sam_record.query_alignment_length
-    cigar = sam_record.cigarstring
 
     # Parse custom TALON tags
     fraction_As, custom_label, allelic_label, start_support, end_support = parse_custom_SAM_tags(sam_record)
 
-    intron_list = tutils.get_introns(sam_record, sam_start, cigar)
-
-    # Adjust intron positions by 1 to get splice sites in exon terms
-    splice_sites = [x + 1 if i % 2 == 1 else x - 1 for i, x in enumerate(intron_list)]
-    positions = [sam_start] + splice_sites + [sam_end]
+    positions = [sam_start] + tutils.get_splice_sites(sam_record, sam_start) + [sam_end]
 
     # Flip the positions' order if the read is on the minus strand
     if strand == "-":
@@ -3016,8 +3608,10 @@ def annotate_read(sam_record: pysam.AlignedSegment, cursor, run_info, struct_col
             gene_starts,
             gene_ends,
             run_info,
-            struct_collection.tmp_gene,
-            struct_collection.tmp_t,
+            struct_collection.gene_index,
+            struct_collection.transcript_index,
+            read_cache=struct_collection.read_cache,
+            known_chains=struct_collection.known_chains,
         )
     else:
         annotation_info = identify_monoexon_transcript(
@@ -3032,9 +3626,9 @@ def annotate_read(sam_record: pysam.AlignedSegment, cursor, run_info, struct_col
             gene_starts,
             gene_ends,
             run_info,
-            struct_collection.tmp_gene,
-            struct_collection.tmp_t,
-            struct_collection.tmp_monoexon,
+            struct_collection.gene_index,
+            struct_collection.transcript_index,
+            struct_collection.monoexon_index,
         )
 
     annotation_info.read_ID = read_ID
@@ -3052,10 +3646,10 @@ def annotate_read(sam_record: pysam.AlignedSegment, cursor, run_info, struct_col
     return annotation_info
 
 
-def unpack_observed(annotation_info, queue, obs_file):
+def unpack_observed(annotation_info, shard):
     """Now that transcript has been annotated, unpack values and
-    create an observed entry. Send the observed entry to the queue
-    for output to obs_file."""
+    create an observed entry. Add the observed entry to the job's
+    output shard."""
 
     obs_ID = observed_counter.increment()
     observed = (
@@ -3077,45 +3671,11 @@ def unpack_observed(annotation_info, queue, obs_file):
         annotation_info.start_support,
         annotation_info.end_support,
     )
-    msg = (obs_file, "\t".join([str(x) for x in observed]))
-    queue.put(msg)
+    shard.write_row("observed", observed)
 
     return
 
 
-def listener(queue, outfiles, QC_header, timeout=72):
-    """During the run, this function listens for messages on the provided
-    queue. When a message is received (consisting of a filename and a
-    string), it writes the string to that file. Timeout unit is in hours"""
-
-    # Open all of the outfiles
-    open_files = {}
-    for fpath in outfiles.values():
-        open_files[fpath] = open(fpath, "w")
-
-    # Add a header to the QC file
-    QC_file = open_files[outfiles.qc]
-    QC_file.write(QC_header + "\n")
-
-    # Set a timeout
-    wait_until = datetime.now() + timedelta(hours=timeout)
-
-    while True:
-        msg = queue.get()
-        msg_fname = msg[0]
-        msg_value = msg[1]
-        if datetime.now() > wait_until or msg_value == "complete":
-            # ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-            # print("[ %s ] Shutting down message queue..." % (ts))
-            logging.info("Shutting down message queue...")
-            for f in open_files.values():
-                f.close()
-            break
-
-        open_files[msg_fname].write(msg_value + "\n")
-        open_files[msg_fname].flush()
-
-
 def make_QC_header(coverage, identity, length):
     """Create a header for the read QC file"""
 
@@ -3146,6 +3706,10 @@ def main():
     logging.info("Started TALON run")
 
     sam_files, dset_metadata = check_inputs(options)
+    if options.label_reads and options.genome_file is None:
+        msg = "Please provide the reference genome (--genome) to label the reads with."
+        logging.error(msg)
+        raise ValueError(msg)
     # print(sam_files)
     # print(dset_metadata[:5])
     # return
@@ -3163,6 +3727,7 @@ def main():
     outprefix = options.outprefix
     tmp_dir = options.tmp_dir
     create_novel_spliced_genes = bool(options.create_novel_spliced_genes)
+    use_read_cache = bool(options.use_read_cache)
 
     # format tmp_dir if missing fwd slash
     if not tmp_dir.endswith("/"):
@@ -3174,9 +3739,21 @@ def main():
     # Initialize worker pool
     with mp.Pool(processes=threads) as pool:
         run_info = init_run_info(
-            database, build, min_coverage, min_identity, use_cb_tag, create_novel_spliced_genes, tmp_dir=tmp_dir
+            database,
+            build,
+            min_coverage,
+            min_identity,
+            use_cb_tag,
+            create_novel_spliced_genes,
+            tmp_dir=tmp_dir,
+            use_read_cache=use_read_cache,
         )
         run_info.outfiles = init_outfiles(options.outprefix, tmp_dir=tmp_dir)
+        run_info.shard_dir = tmp_dir + "shards/"
+        os.makedirs(run_info.shard_dir)
+        if options.sqlite_shards:
+            with sqlite3.connect(database) as conn:
+                run_info.shard_schema = get_shard_schema(conn.cursor())
 
         # Create annotation entry for each dataset
         datasets = []
@@ -3186,48 +3763,105 @@ def main():
             datasets.append(d_name)
             dataset_db_entries.append((d_id, d_name, description, platform))
 
-        # Partition the reads
-        read_groups, intervals, header_file = procsams.partition_reads(
-            sam_files, datasets, use_cb_tag, tmp_dir=tmp_dir, n_threads=threads
+        # Databases made by older versions may lack the gene and transcript
+        # extent tables; add them before anything reads from them.
+        init_db.add_extent_tables(database)
+
+        # The known reference is loaded once (or rebuilt if the database has
+        # changed since the last run) for all of the workers to share.
+        with sqlite3.connect(database) as conn:
+            conn.row_factory = sqlite3.Row
+            reference, run_info.reference_dir = init_refs.load_reference_snapshot(conn.cursor(), build, database)
+
+        # Partition the reads into independent loci. Anything closer than
+        # the permissive end matching distance has to stay together.
+        gene_extents = [(gene["chromosome"], gene["start"], gene["end"]) for gene in reference.genes.rows()]
+        intervals, merged_bam = procsams.partition_reads(
+            sam_files,
+            datasets,
+            use_cb_tag,
+            tmp_dir=tmp_dir,
+            n_threads=threads,
+            gene_extents=gene_extents,
+            slack=max(run_info.cutoff_5p, run_info.cutoff_3p),
+            target_size=options.partition_size,
         )
 
-        read_files = procsams.write_reads_to_file(read_groups, intervals, header_file, tmp_dir=tmp_dir)
         # ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-        logging.info(f"Split reads into {len(read_groups)} intervals")
-
-        # Set up a queue specifically for writing to outfiles
-        manager = mp.Manager()
-        queue = manager.Queue()
+        logging.info(f"Split reads into {len(intervals)} intervals")
+
+        # Note where new IDs start, for renumbering the block IDs later
+        first_IDs = {name: counter.value() + 1 for name, counter in block_counters().items()}
+
+        # Labeling the reads in the workers needs the A/T count index of
+        # each chromosome, built once up front, and the site catalogs
+        tss_catalog = pas_catalog = None
+        if options.label_reads:
+            run_info.read_labels = dstruct.Struct(
+                genome_file=options.genome_file,
+                fracA_range_size=options.fracA_range_size,
+                site_window=options.site_window,
+                index_dir=tmp_dir + "fracA_index",
+            )
+            chroms = list(dict.fromkeys(interval[0] for interval in intervals))
+            logging.info("Building fraction A indexes for read labeling")
+            pool.starmap(
+                tlr.prepare_fracA_index,
+                [
+                    (options.genome_file, chrom, options.fracA_range_size, run_info.read_labels.index_dir)
+                    for chrom in chroms
+                ],
+                chunksize=1,
+            )
+            if options.tss_file is not None:
+                tss_catalog = tlr.read_site_catalog(options.tss_file)
+            if options.pas_file is not None:
+                pas_catalog = tlr.read_site_catalog(options.pas_file)
 
         # Create job tuples to submit
         jobs = []
-        for read_file, interval in zip(read_files, intervals):
-            jobs.append((read_file, interval, database, run_info, queue))
+        for interval in intervals:
+            chrom = interval[0]
+            tss_sites = tlr.select_sites(tss_catalog, chrom)
+            pas_sites = tlr.select_sites(pas_catalog, chrom)
+            jobs.append((merged_bam, interval, database, run_info, tss_sites, pas_sites))
 
         # ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
         # print("[ %s ] Launching parallel annotation jobs" % (ts))
         logging.info("Launching parallel annotation jobs")
 
-        # Start running listener, which will monitor queue for messages
-        QC_header = make_QC_header(run_info.min_coverage, run_info.min_identity, run_info.min_length)
-        pool.apply_async(listener, (queue, run_info.outfiles, QC_header))
-
         # Now launch the parallel TALON jobs
-        pool.starmap(parallel_talon, jobs)
-
-        # Now we are done, kill the listener
-        msg_done = (None, "complete")
-        queue.put(msg_done)
+        pool.starmap(parallel_talon, jobs, chunksize=1)
         pool.close()
         pool.join()
 
+    # Gather the output of each job into the outfiles
+    shard_ids = ["%s_%d_%d" % interval for interval in intervals]
+    id_map = make_id_map(run_info.shard_dir, shard_ids, first_IDs, run_info.idprefix, run_info.n_places)
+    QC_header = make_QC_header(run_info.min_coverage, run_info.min_identity, run_info.min_length)
+    merge_output_shards(run_info.outfiles, run_info.shard_dir, shard_ids, QC_header, id_map=id_map)
+    staged_db = None
+    if options.sqlite_shards:
+        staged_db = tmp_dir + "staged.db"
+        merge_shard_databases(staged_db, run_info.shard_dir, shard_ids, run_info.shard_schema, id_map)
+
     # ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
     # print("[ %s ] All jobs complete. Starting database update." % (ts))
     logging.info("All jobs complete. Starting database update")
 
     # Update the database
-    batch_size = 10000
-    update_database(database, batch_size, run_info.outfiles, dataset_db_entries)
+    if options.bulk_load:
+        batch_size = BULK_LOAD_BATCH_SIZE
+    else:
+        batch_size = 10000
+    update_database(
+        database,
+        batch_size,
+        run_info.outfiles,
+        dataset_db_entries,
+        bulk_load=options.bulk_load,
+        staged_db=staged_db,
+    )
     # ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
     # print("[ %s ] Database update complete." % (ts))
     logging.info("Database update complete.")
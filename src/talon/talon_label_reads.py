@@ -6,16 +6,32 @@
 # alignment. This can help indicate the likelihood of an internal priming
 # artifact.
 
-import glob
+import itertools
 import multiprocessing as mp
 import os
+import shutil
+import struct
 import time
 from datetime import datetime, timedelta
 from optparse import OptionParser
 
+import numpy as np
 import pyfaidx
 import pysam
 
+# Bases of a chromosome read at a time when building its A/T count index
+FRACA_INDEX_BLOCK_SIZE = 2**24
+
+# Reads labeled together in one vectorized fraction A lookup
+LABEL_BATCH_SIZE = 10000
+
+# Width of the windows in the linear index of a BAI file
+BAI_WINDOW_SIZE = 2**14
+
+# Chunks of reads to aim for per thread, so that threads that finish early
+# can pick up more work
+LABEL_CHUNKS_PER_THREAD = 4
+
 
 def get_options():
     """Read input args"""
@@ -57,6 +73,41 @@ def get_options():
         ),
     )
     parser.add_option("--o", dest="outprefix", default="talon_prelabels", help="Prefix for outfiles")
+    parser.add_option(
+        "--tss",
+        dest="tss_file",
+        help=(
+            "BED file of transcription start sites (i.e. CAGE peaks). "
+            "Reads that start within --siteWindow bp of a site on the same "
+            "strand are labeled tS:Z:yes, and the rest tS:Z:no"
+        ),
+        default=None,
+    )
+    parser.add_option(
+        "--pas",
+        dest="pas_file",
+        help=(
+            "BED file of polyA sites. Reads that end within --siteWindow bp "
+            "of a site on the same strand are labeled tE:Z:yes, and the "
+            "rest tE:Z:no"
+        ),
+        default=None,
+    )
+    parser.add_option(
+        "--siteWindow",
+        dest="site_window",
+        type=int,
+        help=("Maximum distance in bp between a read end and a supporting " "TSS or polyA site. Default = 50"),
+        default=50,
+    )
+    parser.add_option(
+        "--outputFormat",
+        dest="output_format",
+        type="choice",
+        choices=["bam", "sam"],
+        default="bam",
+        help=("Format of the labeled reads file (bam or sam). " "Default = bam"),
+    )
 
     (opts, args) = parser.parse_args()
     return opts
@@ -146,9 +197,161 @@ def compute_frac_as_after_transcript(
     return compute_frac_As(range_seq)
 
 
+def fracA_index_dtype(range_size: int):
+    """Smallest unsigned integer type that can hold the number of As in a
+    window of range_size bases"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if range_size <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def build_fracA_index(genome: pyfaidx.Fasta, chrom: str, range_size: int, fname: str):
+    """Write the cumulative counts of As (row 0) and Ts (row 1) along a
+    chromosome to a .npy file (which only appears once it is complete), so that the number of As in any window on
+    either strand is the difference of two entries. The chromosome is read
+    in blocks, so it is never held in memory as a whole. Counts are stored
+    in the smallest type that fits a window of range_size bases and are
+    allowed to wrap around, since differences over such windows are still
+    exact in modular arithmetic. Returns the counts as a memory-mapped
+    array."""
+
+    record = genome[chrom]
+    length = len(record)
+    dtype = fracA_index_dtype(range_size)
+    tmp_fname = fname + ".tmp"
+    counts = np.lib.format.open_memmap(tmp_fname, mode="w+", dtype=dtype, shape=(2, length + 1))
+    counts[:, 0] = 0
+    for start in range(0, length, FRACA_INDEX_BLOCK_SIZE):
+        block = np.frombuffer(str(record[start : start + FRACA_INDEX_BLOCK_SIZE]).encode(), dtype=np.uint8)
+        for row, base in enumerate(b"AT"):
+            block_counts = np.cumsum(block == base, dtype=dtype)
+            block_counts += counts[row, start]
+            counts[row, start + 1 : start + 1 + len(block)] = block_counts
+    counts.flush()
+    del counts
+    os.replace(tmp_fname, fname)
+    return np.load(fname, mmap_mode="r")
+
+
+def load_fracA_index(genome: pyfaidx.Fasta, chrom: str, range_size: int, index_dir: str):
+    """Memory-map the A/T count index of a chromosome from index_dir,
+    building it first if it does not exist yet"""
+
+    fname = index_dir + "/" + chrom + ".npy"
+    if os.path.isfile(fname):
+        counts = np.load(fname, mmap_mode="r")
+        if counts.dtype == fracA_index_dtype(range_size):
+            return counts
+    os.makedirs(index_dir, exist_ok=True)
+    return build_fracA_index(genome, chrom, range_size, fname)
+
+
+def prepare_fracA_index(genome_file: str, chrom: str, range_size: int, index_dir: str):
+    """Build the A/T count index of a chromosome in index_dir unless it
+    exists already"""
+
+    genome = pyfaidx.Fasta(genome_file, sequence_always_upper=True, one_based_attributes=False)
+    load_fracA_index(genome, chrom, range_size, index_dir)
+
+
+def compute_frac_As_in_windows(counts, transcript_ends, is_reverse, range_size: int):
+    """Vectorized version of compute_frac_as_after_transcript. Given a
+    chromosome's A/T count index, the 1-based transcript ends of a batch of
+    reads (as computed by compute_transcript_end) and their strands, return
+    a list with the fraction of As in the range_size bases after each read.
+    Windows are clipped at the ends of the chromosome the same way as the
+    sequence slices in fetch_seq."""
+
+    length = counts.shape[1] - 1
+    transcript_ends = np.asarray(transcript_ends, dtype=np.int64)
+    is_reverse = np.asarray(is_reverse, dtype=bool)
+
+    # 0-based, half-open windows. On the minus strand, the As of the reverse
+    # complement are the Ts of the forward strand.
+    starts = np.where(is_reverse, transcript_ends - range_size - 1, transcript_ends)
+    stops = np.where(is_reverse, transcript_ends - 1, transcript_ends + range_size)
+    starts = np.where(starts < 0, starts + length, starts)
+    starts = np.clip(starts, 0, length)
+    stops = np.clip(stops, starts, length)
+    rows = is_reverse.astype(np.intp)
+
+    n = stops - starts
+    n_As = (counts[rows, stops] - counts[rows, starts]).astype(np.int64)
+    frac_As = np.divide(n_As, n, out=np.zeros(len(n)), where=n > 0)
+
+    # Empty windows are reported as 0, like in compute_frac_As
+    return [frac if size > 0 else 0 for frac, size in zip(frac_As.tolist(), n.tolist())]
+
+
+def read_site_catalog(bed_file: str):
+    """Read a BED file of sites, such as CAGE peaks or polyA sites, into
+    sorted arrays of non-overlapping intervals for each chromosome and
+    strand. Overlapping sites are merged, and sites without a strand are
+    added to both strands. Returns a dict mapping (chromosome, strand) to a
+    (starts, ends) tuple of arrays (0-based, half-open)."""
+
+    sites = {}
+    with open(bed_file, "r") as f:
+        for line in f:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            chrom, start, end = fields[0], int(fields[1]), int(fields[2])
+            strand = fields[5] if len(fields) > 5 else "."
+            for site_strand in [strand] if strand in ("+", "-") else ["+", "-"]:
+                sites.setdefault((chrom, site_strand), []).append((start, end))
+
+    catalog = {}
+    for key, intervals in sites.items():
+        starts = []
+        ends = []
+        for start, end in sorted(intervals):
+            if starts and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        catalog[key] = (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64))
+
+    return catalog
+
+
+def find_site_support(catalog, chrom: str, positions, is_reverse, window: int):
+    """Given a site catalog from read_site_catalog and the 0-based positions
+    of a batch of read ends on chrom, with their strands, return a list
+    with "yes" for each position that lies within window bp of a site on
+    the same strand, and "no" otherwise. Sites are found by binary search:
+    the last site starting at most window bp after the position is the
+    only one that can be close enough, since the sites do not overlap."""
+
+    positions = np.asarray(positions, dtype=np.int64)
+    is_reverse = np.asarray(is_reverse, dtype=bool)
+    supported = np.zeros(len(positions), dtype=bool)
+    for strand, on_strand in (("+", ~is_reverse), ("-", is_reverse)):
+        if (chrom, strand) not in catalog:
+            continue
+        starts, ends = catalog[(chrom, strand)]
+        closest = np.searchsorted(starts, positions + window, side="right") - 1
+        near = (closest >= 0) & (ends[np.maximum(closest, 0)] + window > positions)
+        supported |= on_strand & near
+
+    return ["yes" if x else "no" for x in supported.tolist()]
+
+
+def select_sites(catalog, chrom: str):
+    """Part of a site catalog on one chromosome (None without a catalog)"""
+    if catalog is None:
+        return None
+    return {key: sites for key, sites in catalog.items() if key[0] == chrom}
+
+
 def split_reads_by_chrom(sam_file, tmp_dir="tmp_label_reads", n_threads=1):
-    """Reads a SAM/BAM file and splits the reads into one file per chromosome.
-    Returns a list of the resulting filenames."""
+    """Reads a SAM/BAM file and splits the reads by chromosome. The reads
+    are not copied: they are sorted and indexed if necessary, and each
+    chromosome's reads are fetched from the indexed BAM file when they are
+    labeled. Returns a list of (BAM file, chromosome) pairs, in the order of
+    the chromosomes in the header. Chromosomes without reads are left out."""
 
     ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
     print("[ %s ] Splitting SAM by chromosome..." % (ts))
@@ -156,117 +359,207 @@ def split_reads_by_chrom(sam_file, tmp_dir="tmp_label_reads", n_threads=1):
     tmp_dir = tmp_dir + "/raw"
     os.system("mkdir -p %s" % (tmp_dir))
 
-    if sam_file.endswith(".sam"):
-        # Convert to bam
-        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-        print("[ %s ] -----Converting to bam...." % (ts))
-        bam_file = tmp_dir + "/all_reads.bam"
-        pysam.view("-b", "-S", "-@", str(n_threads), "-o", bam_file, sam_file, catch_stdout=False)
-    elif sam_file.endswith(".bam"):
-        bam_file = sam_file
-    else:
+    if not sam_file.endswith((".sam", ".bam")):
         raise ValueError("Please provide a .sam or .bam file")
 
-    # Index the file if no index exists
-    if not os.path.isfile(bam_file + ".bai"):
+    # Sort and index the file unless it is an indexed BAM file already. SAM
+    # files are sorted straight into BAM format.
+    bam_file = sam_file
+    if sam_file.endswith(".sam") or not os.path.isfile(bam_file + ".bai"):
         ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
         print("[ %s ] -----Sorting and indexing..." % (ts))
-        sorted_bam = tmp_dir + "/all_reads.sorted.bam"
-        pysam.sort("-@", str(n_threads), "-o", sorted_bam, bam_file)
-        bam_file = sorted_bam
+        bam_file = tmp_dir + "/all_reads.sorted.bam"
+        pysam.sort("-@", str(n_threads), "-o", bam_file, sam_file)
         pysam.index(bam_file)
 
-    # Open bam file
-    tmp_dir += "/chroms"
-    os.system("mkdir -p %s" % (tmp_dir))
-    read_files = []
-    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-    print("[ %s ] -----Writing chrom files..." % (ts))
     with pysam.AlignmentFile(bam_file, "rb") as bam:
-        # Iterate over chromosomes and write a reads file for each
         chromosomes = [x.contig for x in bam.get_index_statistics() if x.mapped > 0]
-        for chrom in chromosomes:
-            records = bam.fetch(chrom)
-            fname = tmp_dir + "/" + chrom + ".sam"
-            with pysam.AlignmentFile(fname, "w", template=bam) as o:
-                for record in records:
-                    o.write(record)
-            read_files.append(fname)
-
-    return read_files
-
 
-def run_chrom_thread(sam_file, options):
-    """ """
-    outname = sam_file.split("/")[-1].split(".sam")[0]
+    return [(bam_file, chrom) for chrom in chromosomes]
+
+
+def read_bai_linear_index(bai_file):
+    """Read the linear index of each reference in a BAI file: for each
+    16 kb window, the offset in the compressed BAM file of the first read
+    that overlaps it. Returns a list with an array of offsets for each
+    reference, in header order."""
+
+    with open(bai_file, "rb") as f:
+        data = f.read()
+    if data[:4] != b"BAI\1":
+        raise ValueError("%s is not a BAI file" % bai_file)
+
+    n_ref = struct.unpack_from("<i", data, 4)[0]
+    pos = 8
+    offsets = []
+    for ref in range(n_ref):
+        n_bin = struct.unpack_from("<i", data, pos)[0]
+        pos += 4
+        for i in range(n_bin):
+            n_chunk = struct.unpack_from("<i", data, pos + 4)[0]
+            pos += 8 + 16 * n_chunk
+        n_intv = struct.unpack_from("<i", data, pos)[0]
+        pos += 4
+        virtual_offsets = np.frombuffer(data, dtype="<u8", count=n_intv, offset=pos)
+        pos += 8 * n_intv
+        offsets.append((virtual_offsets >> 16).astype(np.int64))
+
+    return offsets
+
+
+def split_reads_into_chunks(read_files, n_chunks):
+    """Split the (BAM file, chromosome) pairs from split_reads_by_chrom
+    into about n_chunks regions holding similar amounts of reads, judged by
+    the size of the compressed data in each 16 kb window of the BAM index.
+    Chunk boundaries fall between windows, so a chromosome is only split
+    where it has plenty of reads. Returns (BAM file, chromosome, start,
+    end) tuples (0-based, half-open) in file order."""
+
+    linear_indexes = {}
+    weights = []
+    for bam_file, chrom in read_files:
+        if bam_file not in linear_indexes:
+            linear_indexes[bam_file] = read_bai_linear_index(bam_file + ".bai")
+        with pysam.AlignmentFile(bam_file, "rb") as bam:
+            tid = bam.get_tid(chrom)
+            length = bam.get_reference_length(chrom)
+        offsets = linear_indexes[bam_file][tid]
+        # Bytes of compressed reads starting in each window but the last
+        window_bytes = np.diff(np.maximum.accumulate(offsets)) if len(offsets) else offsets
+        weights.append((length, window_bytes))
+
+    total_bytes = sum(int(window_bytes.sum()) for length, window_bytes in weights)
+    chunk_bytes = total_bytes / max(n_chunks, 1)
+
+    chunks = []
+    for (bam_file, chrom), (length, window_bytes) in zip(read_files, weights):
+        chrom_bytes = int(window_bytes.sum())
+        n_chrom_chunks = max(1, int(round(chrom_bytes / chunk_bytes))) if chunk_bytes > 0 else 1
+        cum_bytes = np.cumsum(window_bytes)
+        targets = chrom_bytes * np.arange(1, n_chrom_chunks) / n_chrom_chunks
+        cuts = (np.searchsorted(cum_bytes, targets) + 1) * BAI_WINDOW_SIZE
+        bounds = [0] + sorted(set(int(cut) for cut in cuts if 0 < cut < length)) + [length]
+        chunks.extend((bam_file, chrom, start, end) for start, end in zip(bounds[:-1], bounds[1:]))
+
+    return chunks
+
+
+def label_records(records, chrom: str, counts, options, tss_sites=None, pas_sites=None):
+    """Add the fraction A tag (fA) to each of the records, which must all be
+    on chrom, and the start (tS) and end (tE) site support tags if site
+    catalogs are given. counts is the chromosome's A/T count index, and
+    options provide fracA_range_size and site_window. Records are labeled
+    in batches, with one vectorized lookup per label. Yields each labeled
+    record along with its fraction of As."""
+
+    while True:
+        batch = list(itertools.islice(records, LABEL_BATCH_SIZE))
+        if not batch:
+            break
+        transcript_ends = [compute_transcript_end(record) for record in batch]
+        is_reverse = [record.is_reverse for record in batch]
+        batch_frac_As = compute_frac_As_in_windows(counts, transcript_ends, is_reverse, options.fracA_range_size)
+
+        # Start and end site support, from the 0-based positions of the
+        # first and last aligned bases of each read
+        if tss_sites is not None or pas_sites is not None:
+            first_bases = np.array([record.reference_start for record in batch])
+            last_bases = np.array([record.reference_end for record in batch]) - 1
+        if tss_sites is not None:
+            read_starts = np.where(is_reverse, last_bases, first_bases)
+            start_support = find_site_support(tss_sites, chrom, read_starts, is_reverse, options.site_window)
+        if pas_sites is not None:
+            read_ends = np.where(is_reverse, first_bases, last_bases)
+            end_support = find_site_support(pas_sites, chrom, read_ends, is_reverse, options.site_window)
+
+        for i, (record, frac_As) in enumerate(zip(batch, batch_frac_As)):  # type: pysam.AlignedSegment
+            # Add custom fraction A tag to the read
+            record.set_tag("fA", round(frac_As, 3))
+            if tss_sites is not None:
+                record.set_tag("tS", start_support[i])
+            if pas_sites is not None:
+                record.set_tag("tE", end_support[i])
+            yield record, frac_As
+
+
+def run_chrom_thread(sam_file, options, chromosome=None, start=None, end=None, tss_sites=None, pas_sites=None):
+    """Label the reads in a SAM/BAM file, or only those on chromosome in an
+    indexed BAM file, with the fraction of As after their alignment. Given
+    start and end (0-based, half-open), only the reads that start in that
+    region of the chromosome are labeled, so that neighbouring regions
+    never label the same read. If TSS or polyA site files were provided,
+    reads are also labeled with start (tS) and end (tE) site support, using
+    the given site catalogs or ones read from the files. Writes the labeled
+    reads to a BAM file and the labels to a TSV file, and returns both
+    filenames."""
+    if chromosome is None:
+        outname = os.path.splitext(os.path.basename(sam_file))[0]
+    elif start is None:
+        outname = chromosome
+    else:
+        outname = "%s_%d_%d" % (chromosome, start, end)
     genome = pyfaidx.Fasta(options.genome_file, sequence_always_upper=True, one_based_attributes=False)
+    if tss_sites is None and options.tss_file:
+        tss_sites = read_site_catalog(options.tss_file)
+    if pas_sites is None and options.pas_file:
+        pas_sites = read_site_catalog(options.pas_file)
 
     os.system("mkdir -p %s" % (options.tmp_dir + "/labeled"))
     out_log_fname = options.tmp_dir + "/labeled/" + outname + "_read_labels.tsv"
-    out_sam_fname = options.tmp_dir + "/labeled/" + outname + ".sam"
+    out_sam_fname = options.tmp_dir + "/labeled/" + outname + ".bam"
 
-    # Iterate over reads
+    # Iterate over reads in batches from one chromosome at a time
     out_log = open(out_log_fname, "w")
-    pos_seen_fracA = {}  # Store fraction As for previously seen positions
+    index_dir = options.tmp_dir + "/fracA_index"
     with pysam.AlignmentFile(sam_file) as sam:
-        out_sam = pysam.AlignmentFile(out_sam_fname, "w", template=sam)
-
-        for record in sam:  # type: pysam.AlignedSegment
-            if record.is_secondary == True or record.is_unmapped == True:
-                continue
-            read_id = record.query_name
-            chrom = record.reference_name
-            strand = "-" if record.is_reverse else "+"
-            transcript_end = compute_transcript_end(record)
-
-            # Add custom fraction A tag to the read
-            location_str = "_".join([chrom, str(transcript_end), strand])
-            if location_str in pos_seen_fracA:
-                frac_As = pos_seen_fracA[location_str]
-            else:
-                frac_As = compute_frac_as_after_transcript(
-                    chrom, transcript_end, strand, options.fracA_range_size, genome
-                )
-                pos_seen_fracA[location_str] = frac_As
-
-            record.tags += [("fA", round(frac_As, 3))]
-
-            # TODO: Add other labels to the read, i.e. CAGE, canonical polyA
-
-            # Write to output files
-            out_sam.write(record)
-            out_log.write("\t".join([read_id, str(frac_As)]) + "\n")
+        out_sam = pysam.AlignmentFile(out_sam_fname, "wb", template=sam)
+        records = sam if chromosome is None else sam.fetch(chromosome, start, end)
+        records = (record for record in records if not (record.is_secondary or record.is_unmapped))
+        if start is not None:
+            records = (record for record in records if record.reference_start >= start)
+
+        for chrom, chrom_records in itertools.groupby(records, key=lambda record: record.reference_name):
+            counts = load_fracA_index(genome, chrom, options.fracA_range_size, index_dir)
+            labeled = label_records(chrom_records, chrom, counts, options, tss_sites=tss_sites, pas_sites=pas_sites)
+            for record, frac_As in labeled:
+                # Write to output files
+                out_sam.write(record)
+                out_log.write("\t".join([record.query_name, str(frac_As)]) + "\n")
 
         out_sam.close()
     out_log.close()
-    return
+    return out_sam_fname, out_log_fname
 
 
-def pool_outputs(indir, outprefix):
-    """Given an input directory containing SAM files and log files,
-    concatenate them to form the final output."""
+def pool_outputs(bam_files, log_files, outprefix, output_format="bam", n_threads=1):
+    """Given the labeled BAM files and log files of each chunk of reads,
+    concatenate them to form the final output. The BAM files are joined by
+    copying their compressed blocks, so the reads are not decoded again
+    unless SAM output is requested. The chunk files are sorted and given
+    in file order, so a BAM output is sorted and gets indexed.
+    Returns the name of the reads file."""
 
-    sam_fname = outprefix + "_labeled.sam"
     log_fname = outprefix + "_read_labels.tsv"
+    if output_format == "sam":
+        out_fname = outprefix + "_labeled.sam"
+        bam_fname = out_fname + ".tmp.bam"
+    else:
+        out_fname = bam_fname = outprefix + "_labeled.bam"
 
-    # Get list of files to combine
-    sam_files = glob.glob(indir + "/*.sam")
-    log_files = glob.glob(indir + "/*_read_labels.tsv")
+    pysam.cat("-o", bam_fname, *bam_files)
+    if output_format == "sam":
+        pysam.view("-h", "-@", str(n_threads), "-o", out_fname, bam_fname, catch_stdout=False)
+        os.remove(bam_fname)
+    else:
+        pysam.index(bam_fname)
 
-    # Add headers
     with open(log_fname, "w") as f:
         f.write("\t".join(["read_name", "fraction_As"]) + "\n")
+        for logfile in log_files:
+            with open(logfile) as log:
+                shutil.copyfileobj(log, f)
 
-    os.system("cp %s %s" % (sam_files[0], sam_fname))
-
-    # Concatenate
-    for sam in sam_files[1:]:
-        os.system('grep -v "^@" %s >> %s' % (sam, sam_fname))
-
-    for logfile in log_files:
-        os.system("cat %s >> %s" % (logfile, log_fname))
-
-    return
+    return out_fname
 
 
 def main(options=None):
@@ -286,11 +579,35 @@ def main(options=None):
         # Partition reads by chromosome
         read_files = split_reads_by_chrom(options.sam_file, tmp_dir=options.tmp_dir, n_threads=options.threads)
 
+        chunks = split_reads_into_chunks(read_files, LABEL_CHUNKS_PER_THREAD * options.threads)
+
+        # Read the site catalogs once. Each job only gets the sites on its
+        # own chromosome.
+        tss_sites = read_site_catalog(options.tss_file) if options.tss_file else None
+        pas_sites = read_site_catalog(options.pas_file) if options.pas_file else None
+
+        # Build the fraction A index of each chromosome once, before its
+        # chunks are labeled in parallel
+        index_dir = options.tmp_dir + "/fracA_index"
+        jobs = [(options.genome_file, chrom, options.fracA_range_size, index_dir) for sam, chrom in read_files]
+        pool.starmap(prepare_fracA_index, jobs)
+
         # Now launch the parallel TALON read label jobs
         ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-        print("[ %s ] Launching parallel jobs..." % (ts))
-        jobs = [(sam, options) for sam in read_files]
-        pool.starmap(run_chrom_thread, jobs)
+        print("[ %s ] Launching %d parallel jobs..." % (ts, len(chunks)))
+        jobs = [
+            (
+                sam,
+                options,
+                chrom,
+                start,
+                end,
+                select_sites(tss_sites, chrom),
+                select_sites(pas_sites, chrom),
+            )
+            for sam, chrom, start, end in chunks
+        ]
+        outputs = pool.starmap(run_chrom_thread, jobs)
 
         pool.close()
         pool.join()
@@ -298,7 +615,11 @@ def main(options=None):
     # Pool together output files
     ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
     print("[ %s ] Pooling output files..." % (ts))
-    pool_outputs(options.tmp_dir + "/labeled", options.outprefix)
+    bam_files = [bam for bam, log in outputs]
+    log_files = [log for bam, log in outputs]
+    pool_outputs(
+        bam_files, log_files, options.outprefix, output_format=options.output_format, n_threads=options.threads
+    )
 
     # Delete tmp_dir if desired
     if options.delete_tmp:
@@ -10,11 +10,12 @@ import pysam
 
 
 def check_read_quality(sam_record: pysam.AlignedSegment, run_info):
-    """Process an individual sam read and return quality attributes."""
+    """Process an individual sam read and return quality attributes.
+    Coverage and identity are computed from the CIGAR operation counts and
+    the NM tag, so neither the CIGAR string nor the read sequence has to be
+    built. The MD tag is only parsed for reads without an NM tag."""
     read_ID = sam_record.query_name
     flag = sam_record.flag
-    cigar = sam_record.cigarstring
-    seq = sam_record.query
     read_length = sam_record.query_length
 
     if not run_info.use_cb_tag:
@@ -30,16 +31,19 @@ def check_read_quality(sam_record: pysam.AlignedSegment, run_info):
     if read_length < run_info.min_length:
         return [dataset, read_ID, 0, 1, read_length, "NA", "NA"]
 
-    # Locate the MD field of the sam transcript
-    try:
-        md_tag = sam_record.get_tag("MD")
-    except KeyError:
-        raise ValueError("SAM transcript %s lacks an MD tag" % read_ID)
-
     # Only use reads where alignment coverage and identity exceed
     # cutoffs
-    coverage = compute_alignment_coverage(cigar)
-    identity = compute_alignment_identity(md_tag, seq)
+    base_counts = sam_record.get_cigar_stats()[0]
+    coverage = compute_coverage_from_cigar_stats(base_counts)
+    try:
+        identity = compute_identity_from_cigar_stats(base_counts, sam_record.get_tag("NM"))
+    except KeyError:
+        # Locate the MD field of the sam transcript
+        try:
+            md_tag = sam_record.get_tag("MD")
+        except KeyError:
+            raise ValueError("SAM transcript %s lacks an MD tag" % read_ID)
+        identity = compute_identity_from_MD(md_tag, sam_record.query_alignment_length)
 
     if coverage < run_info.min_coverage or identity < run_info.min_identity:
         return [dataset, read_ID, 0, 1, read_length, coverage, identity]
@@ -65,11 +69,29 @@ def compute_alignment_coverage(CIGAR):
     return (total_bases - unaligned_bases) / total_bases
 
 
+def compute_coverage_from_cigar_stats(base_counts):
+    """Same as compute_alignment_coverage, but from the number of bases of
+    each CIGAR operation, as reported by get_cigar_stats. Its last entry
+    is the NM tag rather than an operation, so it is left out."""
+
+    total_bases = sum(base_counts[: pysam.CBACK + 1]) - base_counts[pysam.CREF_SKIP]
+    unaligned_bases = base_counts[pysam.CSOFT_CLIP] + base_counts[pysam.CHARD_CLIP]
+
+    return (total_bases - unaligned_bases) / total_bases
+
+
 def compute_alignment_identity(MD_tag, SEQ):
     """This function computes what fraction of the read matches the reference
     genome."""
 
-    total_bases = len(SEQ)
+    return compute_identity_from_MD(MD_tag, len(SEQ))
+
+
+def compute_identity_from_MD(MD_tag, aligned_length):
+    """Computes what fraction of the read matches the reference genome from
+    the MD tag and the length of the aligned part of the read"""
+
+    total_bases = aligned_length
     matches = 0.0
     ops, counts = splitMD(MD_tag)
     for op, ct in zip(ops, counts):
@@ -81,6 +103,20 @@ def compute_alignment_identity(MD_tag, SEQ):
     return matches / total_bases
 
 
+def compute_identity_from_cigar_stats(base_counts, NM):
+    """Same as compute_identity_from_MD, but from the number of bases of
+    each CIGAR operation and the edit distance in the NM tag. The NM tag
+    counts each mismatch, inserted base and deleted base once, so the
+    matches are the aligned bases less the mismatches."""
+
+    aligned_bases = base_counts[pysam.CMATCH] + base_counts[pysam.CEQUAL] + base_counts[pysam.CDIFF]
+    insertions = base_counts[pysam.CINS]
+    deletions = base_counts[pysam.CDEL]
+    mismatches = NM - insertions - deletions
+
+    return (aligned_bases - mismatches) / (aligned_bases + insertions + deletions)
+
+
 def splitMD(MD):
     """Takes MD tag and splits into two lists:
     one with capital letters (match operators), and one with
@@ -215,3 +251,54 @@ def get_introns(sam_record: pysam.AlignedSegment, start, cigar):
         return []
     else:
         return intron_list
+
+
+def compute_splice_sites(start, cigartuples):
+    """Computes the splice sites of a read in exon terms directly from the
+    CIGAR operations of a pysam AlignedSegment. Gives the same positions as
+    adjusting the introns in the output of compute_jI by one.
+
+    start: The start position of the transcript with respect to the
+           forward strand
+    cigartuples: (operation, length) pairs describing match operations to
+           the reference genome
+    Returns: exon ends and starts in a list (sorted order), which is empty
+           if the read has no introns
+    """
+
+    splice_sites = []
+    genomePos = start
+    for op, ct in cigartuples:
+        if op == pysam.CREF_SKIP:
+            # The exon ends before the intron and the next one starts after it
+            splice_sites.append(genomePos - 1)
+            splice_sites.append(genomePos + ct)
+
+        if op != pysam.CSOFT_CLIP and op != pysam.CINS:
+            genomePos += ct
+
+    return splice_sites
+
+
+def get_splice_sites(sam_record: pysam.AlignedSegment, start):
+    """Returns the splice sites of a read in exon terms, i.e. the end of
+    each exon followed by the start of the next one. They are taken from
+    the jI tag if the read has one, and are otherwise computed directly
+    from the read's CIGAR operations.
+    Args:
+        sam_record: a pysam AlignedSegment
+        start: The start position of the transcript with respect to the
+        forward strand
+    Returns:
+        splice_sites: exon ends and starts in a list (sorted order)
+    """
+    try:
+        intron_list = sam_record.get_tag("jI").tolist()
+    except KeyError:
+        return compute_splice_sites(start, sam_record.cigartuples)
+
+    if intron_list[0] == -1:
+        return []
+
+    # Adjust intron positions by 1 to get splice sites in exon terms
+    return [x + 1 if i % 2 == 1 else x - 1 for i, x in enumerate(intron_list)]
@@ -0,0 +1,83 @@
+# Compares the two ways that TALON workers have handed their output lines to
+# the run's outfiles: one message per line on a Manager queue, drained by a
+# listener process that writes and flushes every line, versus each worker
+# buffering its lines in an OutputShard and writing them in batches.
+#
+# Usage: python bench_output_writers.py [n_workers] [lines_per_worker]
+
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+from talon import dstruct, talon
+
+NAMES = ["qc", "observed", "transcript_annot"]
+LINE = "\t".join(["d1", "read_000001", "1", "1", "1500", "0.98", "0.95"])
+
+
+def queue_worker(queue, outfiles, n_lines):
+    for i in range(n_lines):
+        queue.put((outfiles[NAMES[i % len(NAMES)]], LINE))
+
+
+def queue_listener(queue, outfiles):
+    open_files = {fpath: open(fpath, "w") for fpath in outfiles.values()}
+    while True:
+        fpath, line = queue.get()
+        if line == "complete":
+            break
+        open_files[fpath].write(line + "\n")
+        open_files[fpath].flush()
+    for f in open_files.values():
+        f.close()
+
+
+def shard_worker(outfiles, shard_dir, shard_id, n_lines):
+    with talon.OutputShard(shard_dir, shard_id) as shard:
+        for i in range(n_lines):
+            shard.write(NAMES[i % len(NAMES)], LINE)
+
+
+def run_queue(outfiles, n_workers, n_lines):
+    with mp.Pool(processes=n_workers + 1) as pool:
+        queue = mp.Manager().Queue()
+        pool.apply_async(queue_listener, (queue, outfiles))
+        pool.starmap(queue_worker, [(queue, outfiles, n_lines)] * n_workers)
+        queue.put((None, "complete"))
+        pool.close()
+        pool.join()
+
+
+def run_shards(outfiles, shard_dir, n_workers, n_lines):
+    shard_ids = ["job%d" % i for i in range(n_workers)]
+    with mp.Pool(processes=n_workers) as pool:
+        pool.starmap(shard_worker, [(outfiles, shard_dir, s, n_lines) for s in shard_ids])
+    talon.merge_output_shards(outfiles, shard_dir, shard_ids, "# header")
+
+
+def main():
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    n_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        outfiles = dstruct.Struct(**{name: os.path.join(tmp_dir, name + ".tsv") for name in NAMES})
+
+        start = time.time()
+        run_queue(outfiles, n_workers, n_lines)
+        queue_time = time.time() - start
+
+        start = time.time()
+        run_shards(outfiles, tmp_dir, n_workers, n_lines)
+        shard_time = time.time() - start
+
+    total = n_workers * n_lines
+    print("workers: %d, lines: %d" % (n_workers, total))
+    print("queue + listener: %.0f lines/s" % (total / queue_time))
+    print("batched shards:   %.0f lines/s" % (total / shard_time))
+    print("speedup:          %.1fx" % (queue_time / shard_time))
+
+
+if __name__ == "__main__":
+    main()
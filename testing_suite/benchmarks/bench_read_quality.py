@@ -0,0 +1,107 @@
+# Compares the per-read cost of the read QC computed from the CIGAR string,
+# the read sequence and the MD tag against check_read_quality, which works
+# from the CIGAR operation counts and the NM tag (or the MD tag when a read
+# has no NM tag).
+#
+# Usage: python bench_read_quality.py [n_reads] [read_length]
+
+import random
+import sys
+import timeit
+
+import pysam
+
+from talon import dstruct
+from talon import transcript_utils as tutils
+
+
+def simulate_read(rng, read_length):
+    """Build a spliced long read with soft clips, mismatches and small
+    indels, along with consistent MD and NM tags"""
+
+    cigar = [(pysam.CSOFT_CLIP, rng.randint(0, 50))]
+    MD = []
+    n_matches = 0
+    NM = 0
+    aligned = 0
+    while aligned < read_length:
+        event = rng.random()
+        if event < 0.03:
+            MD.append("%d%s" % (n_matches, rng.choice("ACGT")))
+            n_matches = 0
+            NM += 1
+            cigar.append((pysam.CMATCH, 1))
+            aligned += 1
+        elif event < 0.04:
+            n = rng.randint(1, 3)
+            cigar.append((pysam.CINS, n))
+            NM += n
+            aligned += n
+        elif event < 0.05:
+            n = rng.randint(1, 3)
+            MD.append("%d^%s" % (n_matches, "".join(rng.choice("ACGT") for i in range(n))))
+            n_matches = 0
+            cigar.append((pysam.CDEL, n))
+            NM += n
+        elif event < 0.052:
+            cigar.append((pysam.CREF_SKIP, rng.randint(100, 5000)))
+        else:
+            n = rng.randint(1, 30)
+            n_matches += n
+            cigar.append((pysam.CMATCH, n))
+            aligned += n
+    MD.append(str(n_matches))
+    cigar.append((pysam.CSOFT_CLIP, rng.randint(0, 50)))
+
+    # Merge adjacent operations of the same type
+    merged = []
+    for op, n in cigar:
+        if merged and merged[-1][0] == op:
+            merged[-1] = (op, merged[-1][1] + n)
+        elif n > 0:
+            merged.append((op, n))
+
+    read = pysam.AlignedSegment()
+    read.query_name = "read_%d" % rng.randint(0, 10**9)
+    read.flag = 0
+    read.cigartuples = merged
+    read.query_sequence = "".join(rng.choice("ACGT") for i in range(read.infer_query_length()))
+    read.set_tags([("RG", "d1"), ("NM", NM), ("MD", "".join(MD))])
+    return read
+
+
+def string_based_quality(sam_record, run_info):
+    """Read QC as computed from the CIGAR string, the aligned part of the
+    read sequence and the MD tag"""
+    coverage = tutils.compute_alignment_coverage(sam_record.cigarstring)
+    identity = tutils.compute_alignment_identity(sam_record.get_tag("MD"), sam_record.query)
+    passed = int(coverage >= run_info.min_coverage and identity >= run_info.min_identity)
+    return [sam_record.get_tag("RG"), sam_record.query_name, passed, 1, sam_record.query_length, coverage, identity]
+
+
+def main():
+    n_reads = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    read_length = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    rng = random.Random(0)
+    reads = [simulate_read(rng, read_length) for i in range(n_reads)]
+    run_info = dstruct.Struct(use_cb_tag=False, min_length=0, min_coverage=0.9, min_identity=0.9)
+
+    for read in reads:
+        assert tutils.check_read_quality(read, run_info) == string_based_quality(read, run_info)
+
+    strings = timeit.timeit(lambda: [string_based_quality(r, run_info) for r in reads], number=1)
+    counts = timeit.timeit(lambda: [tutils.check_read_quality(r, run_info) for r in reads], number=1)
+    for read in reads:
+        read.set_tag("NM", None)
+    md_fallback = timeit.timeit(lambda: [tutils.check_read_quality(r, run_info) for r in reads], number=1)
+
+    print("reads: %d, aligned length: ~%d" % (n_reads, read_length))
+    print("CIGAR string + MD:      %.2f us/read" % (1e6 * strings / n_reads))
+    print("CIGAR counts + NM:      %.2f us/read" % (1e6 * counts / n_reads))
+    print("CIGAR counts + MD:      %.2f us/read" % (1e6 * md_fallback / n_reads))
+    print("speedup (NM):           %.1fx" % (strings / counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Compares search_for_ISM on a plain transcript dict (linear scan over every
+# path) against the edge-indexed PathDict built by init_refs.
+#
+# Usage: python bench_search_for_ISM.py [n_genes] [n_queries]
+
+import random
+import sys
+import timeit
+
+from talon import dstruct, talon
+
+
+def simulate_transcripts(n_genes, rng):
+    """Build a chromosome-sized set of transcript paths. Each gene has its
+    own pool of edges, and its transcripts are random exon subsets."""
+
+    paths = {}
+    edge_ID = 0
+    for gene in range(n_genes):
+        n_edges = rng.randint(5, 60)
+        gene_edges = list(range(edge_ID, edge_ID + n_edges))
+        edge_ID += n_edges
+        for t in range(rng.randint(1, 8)):
+            start = rng.randint(0, n_edges - 3)
+            end = rng.randint(start + 2, n_edges)
+            paths[frozenset(gene_edges[start:end])] = {"gene_ID": gene}
+    return paths
+
+
+def main():
+    n_genes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    rng = random.Random(0)
+    plain = simulate_transcripts(n_genes, rng)
+    indexed = dstruct.PathDict(plain)
+
+    # Queries are sub-paths of known transcripts (ISM/FSM candidates)
+    keys = list(plain)
+    queries = []
+    for i in range(n_queries):
+        path = sorted(rng.choice(keys))
+        start = rng.randint(0, len(path) - 1)
+        queries.append(path[start : start + rng.randint(1, 7)])
+
+    for query in queries:
+        assert talon.search_for_ISM(query, indexed) == talon.search_for_ISM(query, plain)
+
+    linear = timeit.timeit(lambda: [talon.search_for_ISM(q, plain) for q in queries], number=1)
+    index = timeit.timeit(lambda: [talon.search_for_ISM(q, indexed) for q in queries], number=1)
+
+    print("transcripts: %d, queries: %d" % (len(plain), n_queries))
+    print("linear scan: %.3f ms/query" % (1000 * linear / n_queries))
+    print("edge index:  %.3f ms/query" % (1000 * index / n_queries))
+    print("speedup:     %.1fx" % (linear / index))
+
+
+if __name__ == "__main__":
+    main()
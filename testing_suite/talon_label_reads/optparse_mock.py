@@ -2,7 +2,8 @@ class OptParseMock(object):
      """Class to mimic option parser for talon_label_reads.py"""
      def __init__(self, sam_file, genome_file, threads = 2, fracA_range_size = 10,
                   tmp_dir = "tmp_label_reads", delete_tmp = False,
-                  outprefix = "talon_prelabels"):
+                  outprefix = "talon_prelabels", output_format = "bam",
+                  tss_file = None, pas_file = None, site_window = 50):
          self.sam_file = sam_file
          self.genome_file = genome_file
          self.threads = threads
@@ -10,3 +11,7 @@ class OptParseMock(object):
          self.tmp_dir = tmp_dir
          self.delete_tmp = delete_tmp
          self.outprefix = outprefix
+         self.output_format = output_format
+         self.tss_file = tss_file
+         self.pas_file = pas_file
+         self.site_window = site_window
@@ -0,0 +1,56 @@
+from talon import talon_label_reads as tlr
+import numpy as np
+import pyfaidx
+import pytest
+import random
+
+def write_genome(fname):
+    """ Random genome with soft-masked and N bases, long enough for the
+        count of As and Ts to wrap around a uint8 """
+    rng = random.Random(1)
+    seq = "".join(rng.choice("ACGTACGTacgtN") for i in range(3000))
+    with open(fname, 'w') as f:
+        f.write(">chrRand\n")
+        for i in range(0, len(seq), 60):
+            f.write(seq[i:i+60] + "\n")
+    return pyfaidx.Fasta(fname, sequence_always_upper = True,
+                         one_based_attributes = False)
+
+def test_matches_sequence_windows(tmp_path, monkeypatch):
+    """ Fractions from the index match those computed from the sequence
+        for every read end on both strands, including windows clipped at
+        the ends of the chromosome. The index is built in several blocks. """
+    monkeypatch.setattr(tlr, "FRACA_INDEX_BLOCK_SIZE", 1000)
+    genome = write_genome(str(tmp_path / "genome.fa"))
+
+    for range_size in [1, 20, 300]:
+        counts = tlr.load_fracA_index(genome, "chrRand", range_size,
+                                      str(tmp_path / ("index_%d" % range_size)))
+        assert counts.dtype == tlr.fracA_index_dtype(range_size)
+
+        ends = []
+        is_reverse = []
+        expected = []
+        for end in range(1, 3001):
+            for strand in ["+", "-"]:
+                # pyfaidx cannot slice before the start of the chromosome
+                if strand == "-" and end - range_size - 1 < -3000:
+                    continue
+                ends.append(end)
+                is_reverse.append(strand == "-")
+                expected.append(tlr.compute_frac_as_after_transcript(
+                                    "chrRand", end, strand, range_size, genome))
+
+        assert tlr.compute_frac_As_in_windows(counts, ends, is_reverse,
+                                              range_size) == expected
+def test_index_is_reused(tmp_path):
+    """ An existing index is memory-mapped rather than built again,
+        unless its counts are too narrow for the window size """
+    genome = write_genome(str(tmp_path / "genome.fa"))
+    index_dir = str(tmp_path / "index")
+
+    counts = tlr.load_fracA_index(genome, "chrRand", 20, index_dir)
+    assert isinstance(counts, np.memmap)
+    assert counts.shape == (2, 3001)
+    assert tlr.load_fracA_index(genome, "chrRand", 20, index_dir).dtype == np.uint8
+    assert tlr.load_fracA_index(genome, "chrRand", 300, index_dir).dtype == np.uint16
@@ -18,8 +18,32 @@ def test_main_fn():
     tlr.main(options=options)
 
     # Check that outfiles exist
-    final_sam = "scratch/test_main/test_labeled.sam"
+    final_sam = "scratch/test_main/test_labeled.bam"
     final_log =  "scratch/test_main/test_read_labels.tsv"
 
     assert os.path.isfile(final_sam)
-    assert os.path.isfile(final_log) 
+    assert os.path.isfile(final_sam + ".bai")
+    assert os.path.isfile(final_log)
+
+def test_main_fn_sam_output():
+    """ Labeled reads are written as SAM if requested """
+
+    sam_file = "talon_label_reads/test_inputs/plus_strand_read.sam"
+    genome_file = "talon_label_reads/test_inputs/toy_genome.fa"
+    tmp_dir = "scratch/test_main_sam/tmp"
+    outprefix = "scratch/test_main_sam/test"
+    options = optparse_mock.OptParseMock(sam_file, genome_file,
+                           tmp_dir = tmp_dir, outprefix = outprefix,
+                           output_format = "sam")
+
+    if os.path.exists("scratch/test_main_sam"):
+            os.system("rm -r %s" % ("scratch/test_main_sam"))
+
+    tlr.main(options=options)
+
+    final_sam = "scratch/test_main_sam/test_labeled.sam"
+    with open(final_sam) as f:
+        reads = [ line for line in f if not line.startswith("@") ]
+    assert len(reads) == 1
+    assert "fA:f:" in reads[0]
+
@@ -1,36 +1,69 @@
 from talon import talon_label_reads as tlr
 import pandas as pd
+import pysam
+import re
 
-def test_pool_outputs():
-    """ Given some SAM files and some log files, check the concatenation
+def make_bam(sam, bam):
+    """ Convert a test SAM file (some of its fields are separated by
+        spaces) into a BAM file """
+    tmp_sam = bam + ".sam"
+    with open(sam, 'r') as f, open(tmp_sam, 'w') as o:
+        for line in f:
+            o.write(re.sub(" +", "\t", line))
+    pysam.view("-b", "-o", bam, tmp_sam, catch_stdout=False)
+
+def test_pool_outputs(tmp_path):
+    """ Given some BAM files and some log files, check the concatenation
         process. """
     indir = "talon_label_reads/test_inputs/pool_test"
-    outprefix = "scratch/pool_test"
+    outprefix = str(tmp_path / "pool_test")
 
-    tlr.pool_outputs(indir, outprefix)
+    names = ["file1", "file2", "file3"]
+    bam_files = [str(tmp_path / (name + ".bam")) for name in names]
+    log_files = [indir + "/" + name + "_read_labels.tsv" for name in names]
+    for name, bam in zip(names, bam_files):
+        make_bam(indir + "/" + name + ".sam", bam)
 
-    sam = outprefix + "_labeled.sam"
+    sam = tlr.pool_outputs(bam_files, log_files, outprefix)
     log = outprefix + "_read_labels.tsv"
+    assert sam == outprefix + "_labeled.bam"
+
+    # Check content: BAM file should have the input header and 6 reads, in
+    # the order of the input files
+    expected_read_ids = ["read_1", "read_2", "read_3", "read_4", "read_5",
+                         "read_6"]
+    with pysam.AlignmentFile(sam) as f:
+        assert f.references == ("chrTest1",)
+        assert [record.query_name for record in f] == expected_read_ids
+
+    # Check content: Log should have a header line and 6 entries
+    log_data = pd.read_csv(log, sep="\t", header = 0)
+    assert len(log_data) == 6
+    assert list(log_data.read_name) == expected_read_ids
 
-    # Check content: SAM file should have 2 header lines and 6 reads
-    n_header = 0
-    sam_entries = 0
-    read_ids = set()
-    expected_read_ids = set(["read_1", "read_2", "read_3", "read_4", "read_5",
-                             "read_6"])
+def test_pool_outputs_sam(tmp_path):
+    """ SAM output has the same references and reads as BAM output """
+    indir = "talon_label_reads/test_inputs/pool_test"
+    outprefix = str(tmp_path / "pool_test")
+
+    names = ["file1", "file2", "file3"]
+    bam_files = [str(tmp_path / (name + ".bam")) for name in names]
+    log_files = [indir + "/" + name + "_read_labels.tsv" for name in names]
+    for name, bam in zip(names, bam_files):
+        make_bam(indir + "/" + name + ".sam", bam)
+
+    sam = tlr.pool_outputs(bam_files, log_files, outprefix, output_format = "sam")
+    assert sam == outprefix + "_labeled.sam"
+
+    header = []
+    read_ids = []
     with open(sam, 'r') as f:
         for line in f:
-            line = line.strip()
             if line.startswith("@"):
-                n_header += 1
+                header.append(line.split("\t")[0])
             else:
-                sam_entries += 1
-                read_ids.add(line.split()[0])
-    assert n_header == 2
-    assert sam_entries == 6
-    assert read_ids == expected_read_ids
-    
-    # Check content: Log should have a header line and 6 entries
-    log_data = pd.read_csv(log, sep="\t", header = 0)
-    assert len(log_data) == 6
-    assert set(list(log_data.read_name)) == expected_read_ids
+                read_ids.append(line.split("\t")[0])
+    assert header.count("@HD") == 1
+    assert header.count("@SQ") == 1
+    assert read_ids == ["read_1", "read_2", "read_3", "read_4", "read_5",
+                        "read_6"]
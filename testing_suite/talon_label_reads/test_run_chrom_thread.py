@@ -30,11 +30,12 @@ def test_run_chrom_thread():
     options = optparse_mock.OptParseMock(sam_file, genome_file, 
                            tmp_dir = tmp_dir)
 
-    tlr.run_chrom_thread(sam_file, options)
+    outfiles = tlr.run_chrom_thread(sam_file, options)
 
     # Check existence of outfiles
-    processed_sam = tmp_dir + "/labeled/plus_strand_read.sam"
+    processed_sam = tmp_dir + "/labeled/plus_strand_read.bam"
     outlog_file = tmp_dir + "/labeled/plus_strand_read_read_labels.tsv"
+    assert outfiles == (processed_sam, outlog_file)
     assert os.path.isfile(processed_sam)
     assert os.path.isfile(outlog_file)
 
@@ -50,3 +51,24 @@ def test_run_chrom_thread():
     assert len(outlog.columns) == 2
     assert len(outlog) == 1
 
+
+def test_run_chrom_thread_on_chromosome():
+    """ Given a chromosome, the reads on that chromosome are fetched from the
+        indexed BAM file, and the outfiles are named after it """
+
+    genome_file = "talon_label_reads/test_inputs/toy_genome.fa"
+    tmp_dir = "scratch/test_run_chrom_thread_chromosome"
+    read_files = tlr.split_reads_by_chrom(
+                     "talon_label_reads/test_inputs/plus_strand_read.sam",
+                     tmp_dir = tmp_dir)
+    bam_file, chrom = read_files[0]
+    options = optparse_mock.OptParseMock(bam_file, genome_file,
+                           tmp_dir = tmp_dir)
+
+    processed_sam, outlog_file = tlr.run_chrom_thread(bam_file, options, chromosome = chrom)
+    assert processed_sam == tmp_dir + "/labeled/" + chrom + ".bam"
+
+    with pysam.AlignmentFile(processed_sam) as sam:
+        assert set(record.reference_name for record in sam) == set([chrom])
+    outlog = pd.read_csv(outlog_file, sep = "\t", header = None)
+    assert len(outlog) == 1
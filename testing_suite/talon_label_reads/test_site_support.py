@@ -0,0 +1,66 @@
+from talon import talon_label_reads as tlr
+import optparse_mock
+import pysam
+
+def write_bed(fname, lines):
+    with open(fname, 'w') as f:
+        for line in lines:
+            f.write("\t".join(map(str, line)) + "\n")
+
+def test_read_site_catalog(tmp_path):
+    """ Sites are sorted and merged per chromosome and strand, and sites
+        without a strand are added to both strands """
+    bed = str(tmp_path / "sites.bed")
+    with open(bed, 'w') as f:
+        f.write("track name=sites\n")
+    with open(bed, 'a') as f:
+        f.write("chr1\t500\t510\tb\t0\t+\n")
+        f.write("chr1\t100\t110\ta\t0\t+\n")
+        f.write("chr1\t105\t120\tc\t0\t+\n")
+        f.write("chr1\t300\t301\td\t0\t-\n")
+        f.write("chr2\t10\t20\n")
+
+    catalog = tlr.read_site_catalog(bed)
+    assert sorted(catalog.keys()) == [("chr1", "+"), ("chr1", "-"),
+                                      ("chr2", "+"), ("chr2", "-")]
+    assert [ list(x) for x in catalog[("chr1", "+")] ] == [[100, 500], [120, 510]]
+    assert [ list(x) for x in catalog[("chr1", "-")] ] == [[300], [301]]
+    assert [ list(x) for x in catalog[("chr2", "-")] ] == [[10], [20]]
+
+def test_find_site_support(tmp_path):
+    """ A read end is supported if it lies within the window of a site on
+        its own strand, counting from the first and last base of the site """
+    bed = str(tmp_path / "sites.bed")
+    write_bed(bed, [("chr1", 100, 110, "a", 0, "+"), ("chr1", 1000, 1001, "b", 0, "-")])
+    catalog = tlr.read_site_catalog(bed)
+
+    positions = [89, 90, 119, 120, 105, 990, 1010, 1011, 50]
+    is_reverse = [False, False, False, False, True, True, True, True, False]
+    assert tlr.find_site_support(catalog, "chr1", positions, is_reverse, 10) == \
+           ["no", "yes", "yes", "no", "no", "yes", "yes", "no", "no"]
+    assert tlr.find_site_support(catalog, "chr1", [975, 1026], [True, True], 25) == \
+           ["yes", "no"]
+    assert tlr.find_site_support(catalog, "chr2", [100], [False], 10) == ["no"]
+
+def test_run_chrom_thread_site_labels(tmp_path):
+    """ With site files, reads get tS and tE tags along with fA. The read
+        in plus_strand_read.sam starts at 0-based position 3 and ends at 12.
+    """
+    sam_file = "talon_label_reads/test_inputs/plus_strand_read.sam"
+    genome_file = "talon_label_reads/test_inputs/toy_genome.fa"
+    tss = str(tmp_path / "tss.bed")
+    pas = str(tmp_path / "pas.bed")
+    write_bed(tss, [("chrTest1", 0, 1, "tss", 0, "+")])
+    write_bed(pas, [("chrTest1", 20, 21, "pas", 0, "+")])
+
+    options = optparse_mock.OptParseMock(sam_file, genome_file,
+                                         tmp_dir = str(tmp_path / "tmp"),
+                                         tss_file = tss, pas_file = pas,
+                                         site_window = 5)
+    labeled_sam, log = tlr.run_chrom_thread(sam_file, options)
+    with pysam.AlignmentFile(labeled_sam) as sam:
+        record = next(iter(sam))
+        assert record.reference_start == 3 and record.reference_end == 13
+        assert record.get_tag("tS") == "yes"
+        assert record.get_tag("tE") == "no"
+        assert record.has_tag("fA")
@@ -0,0 +1,80 @@
+import pysam
+import random
+from talon import talon_label_reads as tlr
+import optparse_mock
+
+def write_bam(fname, reads, chroms):
+    """ Write a sorted, indexed BAM file with 100 bp reads at the given
+        (chromosome, start) positions """
+    rng = random.Random(7)
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+              "SQ": [{"SN": chrom, "LN": length} for chrom, length in chroms]}
+    with pysam.AlignmentFile(fname, "wb", header = header) as out:
+        for i, (chrom, start) in enumerate(sorted(reads)):
+            read = pysam.AlignedSegment(out.header)
+            read.query_name = "read_%d" % i
+            read.reference_name = chrom
+            read.reference_start = start
+            read.cigarstring = "100M"
+            read.query_sequence = "".join(rng.choice("ACGT") for j in range(100))
+            read.flag = 16 if i % 2 else 0
+            out.write(read)
+    pysam.index(fname)
+
+def owned_reads(chunks):
+    """ Names of the reads in each chunk, counting each read only in the
+        chunk where it starts """
+    names = []
+    for bam_file, chrom, start, end in chunks:
+        with pysam.AlignmentFile(bam_file) as bam:
+            names.append([ read.query_name for read in bam.fetch(chrom, start, end)
+                           if read.reference_start >= start ])
+    return names
+
+def test_chunks_cover_reads_once(tmp_path):
+    """ Chunks tile each chromosome in file order, every read is in exactly
+        one chunk, and chromosomes with more reads get more chunks """
+    bam = str(tmp_path / "reads.bam")
+    rng = random.Random(3)
+    reads = [("chr1", rng.randint(0, 2000000)) for i in range(20000)] + \
+            [("chr2", rng.randint(0, 100000)) for i in range(500)]
+    write_bam(bam, reads, [("chr1", 2000000), ("chr2", 100000)])
+    read_files = [(bam, "chr1"), (bam, "chr2")]
+
+    assert tlr.split_reads_into_chunks(read_files, 1) == [(bam, "chr1", 0, 2000000),
+                                                           (bam, "chr2", 0, 100000)]
+
+    chunks = tlr.split_reads_into_chunks(read_files, 16)
+    chr1 = [ chunk for chunk in chunks if chunk[1] == "chr1" ]
+    assert [ chunk[1] for chunk in chunks ] == ["chr1"] * len(chr1) + ["chr2"]
+    assert len(chr1) > 8
+    assert chr1[0][2] == 0 and chr1[-1][3] == 2000000
+    assert all(a[3] == b[2] for a, b in zip(chr1[:-1], chr1[1:]))
+    assert all(chunk[2] % tlr.BAI_WINDOW_SIZE == 0 for chunk in chr1)
+
+    names = owned_reads(chunks)
+    assert sum(len(x) for x in names) == len(reads)
+    assert len(set(name for x in names for name in x)) == len(reads)
+    assert max(len(x) for x in names) < 2 * len(reads) / 16
+
+def test_chunked_labels_match_whole_chromosome(tmp_path):
+    """ Labeling a chromosome in chunks gives the same reads in the same
+        order as labeling it in one go, including reads that cross a chunk
+        boundary """
+    bam = str(tmp_path / "reads.bam")
+    write_bam(bam, [("chrTest1", start) for start in range(0, 25)], [("chrTest1", 29)])
+    genome_file = "talon_label_reads/test_inputs/toy_genome.fa"
+    options = optparse_mock.OptParseMock(bam, genome_file, tmp_dir = str(tmp_path / "tmp"))
+
+    whole, whole_log = tlr.run_chrom_thread(bam, options, chromosome = "chrTest1")
+    chunked = [ tlr.run_chrom_thread(bam, options, chromosome = "chrTest1",
+                                     start = start, end = end)
+                for start, end in [(0, 10), (10, 29)] ]
+    assert chunked[0][0] == str(tmp_path / "tmp/labeled/chrTest1_0_10.bam")
+
+    def records(fname):
+        with pysam.AlignmentFile(fname) as f:
+            return [ read.to_string() for read in f ]
+
+    assert records(chunked[0][0]) + records(chunked[1][0]) == records(whole)
+    assert len(records(chunked[0][0])) == 10
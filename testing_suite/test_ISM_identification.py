@@ -13,8 +13,8 @@ class TestIdentifyISM(object):
         database = "scratch/toy.db"
         run_info = talon.init_run_info(database, build)
         talon.get_counters(database)
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         transcript_dict = init_refs.make_transcript_dict(cursor, build)
@@ -39,8 +39,8 @@ class TestIdentifyISM(object):
                                                             edge_dict, location_dict,
                                                             run_info,
                                                             cursor,
-                                                            "temp_gene",
-                                                            "temp_transcript")
+                                                            gene_index,
+                                                            transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
 
@@ -60,8 +60,8 @@ class TestIdentifyISM(object):
         database = "scratch/toy.db"
         run_info = talon.init_run_info(database, build)
         talon.get_counters(database)
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         transcript_dict = init_refs.make_transcript_dict(cursor, build)
@@ -86,8 +86,8 @@ class TestIdentifyISM(object):
                                                             edge_dict, location_dict,
                                                             run_info,
                                                             cursor,
-                                                            "temp_gene",
-                                                            "temp_transcript")
+                                                            gene_index,
+                                                            transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         assert gene_ID == correct_gene_ID
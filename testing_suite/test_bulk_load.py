@@ -0,0 +1,140 @@
+import shutil
+import sqlite3
+import pytest
+from talon import talon, dstruct, initialize_talon_database as init_db
+
+STAGED = ["genes", "transcripts", "edges", "location", "v2g", "observed",
+          "gene_annot", "transcript_annot", "exon_annot"]
+
+def stage_outfiles(tmp_path):
+    """ Staged update files for three reads of known toy transcripts """
+    outfiles = dstruct.Struct()
+    for name in STAGED:
+        setattr(outfiles, name, str(tmp_path / (name + ".tsv")))
+        open(getattr(outfiles, name), "w").close()
+
+    with open(outfiles.observed, "w") as f:
+        for obs_ID, transcript_ID in [(1, 1), (2, 1), (3, 2)]:
+            row = [obs_ID, transcript_ID, transcript_ID, "read_%d" % obs_ID,
+                   "toy", 1, 2, 1, 1, 0, "None", 100, 0.25,
+                   "None", "None", "None", "None"]
+            f.write("\t".join(map(str, row)) + "\n")
+    return outfiles
+
+def stage_database(outfiles, staged_db):
+    """ Copy the staged update files into a staging database """
+    conn = sqlite3.connect("scratch/toy.db")
+    schema = talon.get_shard_schema(conn.cursor())
+    conn.close()
+
+    conn = talon.create_shard_database(staged_db, schema)
+    with open(outfiles.observed) as f:
+        rows = [ [ None if x == "None" else x for x in line.strip().split("\t") ]
+                 for line in f ]
+    conn.executemany("INSERT INTO observed VALUES (%s)" % ",".join(["?"] * 17), rows)
+    conn.commit()
+    conn.close()
+
+def update(database, outfiles, bulk_load, n_observed = 3, staged_db = None):
+    """ Run update_database on the database with the counters it would have
+        after a TALON run that staged n_observed reads """
+    talon.get_counters(database)
+    for i in range(n_observed):
+        talon.observed_counter.increment()
+    talon.dataset_counter.increment()
+    talon.update_database(database, 2, outfiles, [(1, "toy", "toy", "toy")],
+                          bulk_load = bulk_load, staged_db = staged_db)
+
+def dump(database):
+    """ Table rows of the database, without the schema """
+    conn = sqlite3.connect(database)
+    rows = sorted(x for x in conn.iterdump() if x.startswith("INSERT"))
+    conn.close()
+    return rows
+
+def index_names(database):
+    """ Names of the indexes in the database """
+    conn = sqlite3.connect(database)
+    names = set([ x[0] for x in conn.execute("""SELECT name FROM sqlite_master
+                                                WHERE type = 'index'""") ])
+    conn.close()
+    return names
+
+@pytest.mark.dbunit
+
+class TestBulkLoad(object):
+
+    def test_bulk_load_matches_default(self, tmp_path):
+        """ A bulk load leaves the database with the same rows and the same
+            indexes as the default load """
+        outfiles = stage_outfiles(tmp_path)
+        default_db = str(tmp_path / "default.db")
+        bulk_db = str(tmp_path / "bulk.db")
+        shutil.copy("scratch/toy.db", default_db)
+        shutil.copy("scratch/toy.db", bulk_db)
+
+        update(default_db, outfiles, False)
+        update(bulk_db, outfiles, True)
+
+        assert dump(bulk_db) == dump(default_db)
+        assert index_names(bulk_db) == index_names("scratch/toy.db")
+
+    def test_staged_database_matches_default(self, tmp_path):
+        """ Loading from a staging database gives the same rows as loading
+            from the staged files, with abundance in the same order """
+        outfiles = stage_outfiles(tmp_path)
+        staged_db = str(tmp_path / "staged.db")
+        stage_database(outfiles, staged_db)
+        default_db = str(tmp_path / "default.db")
+        shutil.copy("scratch/toy.db", default_db)
+        update(default_db, outfiles, False)
+
+        for bulk_load in [False, True]:
+            database = str(tmp_path / ("staged_%s.db" % bulk_load))
+            shutil.copy("scratch/toy.db", database)
+            update(database, outfiles, bulk_load, staged_db = staged_db)
+            assert dump(database) == dump(default_db)
+            conn = sqlite3.connect(database)
+            assert conn.execute("SELECT * FROM abundance ORDER BY rowid").fetchall() == \
+                   [(1, "toy", 2), (2, "toy", 1)]
+            conn.close()
+
+    def test_deferred_indexes(self, tmp_path):
+        """ Indexes are only deferred on tables that the load at least
+            doubles """
+        outfiles = stage_outfiles(tmp_path)
+        database = str(tmp_path / "toy.db")
+        shutil.copy("scratch/toy.db", database)
+        conn = sqlite3.connect(database)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        dropped = talon.drop_deferred_indexes(cursor, outfiles)
+        assert sorted(dropped) == ["abundance_dataset", "observed_dataset",
+                                   "observed_transcript"]
+        conn.rollback()
+        assert index_names(database) == index_names("scratch/toy.db")
+
+        # One more read would not double the observed or abundance tables
+        update(database, outfiles, False)
+        with open(outfiles.observed) as f:
+            reads = f.readlines()
+        with open(outfiles.observed, "w") as f:
+            f.writelines(reads[:1])
+        cursor.execute("BEGIN")
+        assert talon.drop_deferred_indexes(cursor, outfiles) == []
+        conn.rollback()
+        conn.close()
+
+    def test_failed_bulk_load_is_rolled_back(self, tmp_path):
+        """ If the integrity check fails, neither the new rows nor the index
+            changes are kept """
+        outfiles = stage_outfiles(tmp_path)
+        database = str(tmp_path / "toy.db")
+        shutil.copy("scratch/toy.db", database)
+        before = dump(database)
+
+        with pytest.raises(RuntimeError):
+            update(database, outfiles, True, n_observed = 2)
+
+        assert dump(database) == before
+        assert index_names(database) == index_names("scratch/toy.db")
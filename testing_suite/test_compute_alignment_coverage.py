@@ -1,3 +1,4 @@
+import pysam
 import pytest
 from talon import transcript_utils as tu
 @pytest.mark.unit
@@ -18,3 +19,15 @@ def test_compute_coverage_with_introns():
 
     cigar = "5S45M1000N45=5H"
     assert tu.compute_alignment_coverage(cigar) == 0.9
+
+
+def test_coverage_from_cigar_stats():
+    """ Coverage from the CIGAR operation counts matches coverage from the
+        CIGAR string """
+
+    for cigar in ["5S90M5H", "5S90=5H", "5S45M1000N45=5H", "3H10M2I20M3D7X4S"]:
+        read = pysam.AlignedSegment()
+        read.cigarstring = cigar
+        base_counts = read.get_cigar_stats()[0]
+        assert tu.compute_coverage_from_cigar_stats(base_counts) == \
+               tu.compute_alignment_coverage(cigar)
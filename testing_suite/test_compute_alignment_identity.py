@@ -1,5 +1,6 @@
+import pysam
 import pytest
-from talon import transcript_utils as tu
+from talon import dstruct, transcript_utils as tu
 @pytest.mark.unit
 
 def test_compute_alignment_coverage():
@@ -19,3 +20,45 @@ def test_compute_alignment_coverage():
 
     align_length = len(SEQ) + 1 # incremented by 1 because of single deletion
     assert tu.compute_alignment_identity(MD, SEQ) == 76.0/align_length
+
+
+def make_read(cigar, tags):
+    """ Mapped read with the given CIGAR string and tags """
+    read = pysam.AlignedSegment()
+    read.query_name = "read_1"
+    read.flag = 0
+    read.cigarstring = cigar
+    read.query_sequence = "G" * read.infer_query_length()
+    read.set_tags(tags)
+    return read
+
+def test_identity_from_NM():
+    """ Identity from the CIGAR operation counts and the NM tag matches
+        identity from the MD tag: 4 mismatches, 2 inserted and 3 deleted
+        bases """
+
+    cigar = "5S20M2I30M3D40M5H"
+    MD = "10A10C28^GTC5G20T13"
+    read = make_read(cigar, [("NM", 9), ("MD", MD)])
+    base_counts = read.get_cigar_stats()[0]
+
+    identity = tu.compute_identity_from_cigar_stats(base_counts, 9)
+    assert identity == 86.0/95
+    assert identity == tu.compute_identity_from_MD(MD, read.query_alignment_length)
+    assert identity == tu.compute_alignment_identity(MD, read.query_alignment_sequence)
+
+def test_check_read_quality_falls_back_to_MD():
+    """ Reads without an NM tag get the same QC result from their MD tag,
+        and reads with neither tag are rejected """
+
+    run_info = dstruct.Struct(use_cb_tag = False, min_length = 0,
+                              min_coverage = 0.9, min_identity = 0.9)
+    cigar = "5S20M2I30M3D40M5H"
+    MD = "10A10C28^GTC5G20T13"
+
+    with_NM = tu.check_read_quality(make_read(cigar, [("RG", "toy"), ("NM", 9)]), run_info)
+    with_MD = tu.check_read_quality(make_read(cigar, [("RG", "toy"), ("MD", MD)]), run_info)
+    assert with_NM == with_MD == ["toy", "read_1", 1, 1, 97, 95.0/105, 86.0/95]
+
+    with pytest.raises(ValueError):
+        tu.check_read_quality(make_read(cigar, [("RG", "toy")]), run_info)
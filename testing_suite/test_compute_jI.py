@@ -1,5 +1,21 @@
+import pysam
 import pytest
 from talon import transcript_utils as tu
+
+def splice_sites_from_jI(jI):
+    """ Splice sites in exon terms from a jI string """
+    introns = [ int(x) for x in jI.split(",")[1:] ]
+    if introns == [-1]:
+        return []
+    return [ x + 1 if i % 2 == 1 else x - 1 for i, x in enumerate(introns) ]
+
+def make_read(start, cigar, tags = ()):
+    """ Mapped read with the given 1-based start, CIGAR string and tags """
+    read = pysam.AlignedSegment()
+    read.reference_start = start - 1
+    read.cigarstring = cigar
+    read.set_tags(list(tags))
+    return read
 @pytest.mark.unit
 
 class TestComputejI(object):
@@ -16,3 +32,28 @@ class TestComputejI(object):
                 "76M1043N94M425N113=23956N38="
         assert tu.compute_jI(start, cigar) == jI
 
+
+    def test_splice_sites_from_cigartuples(self):
+        """ Splice sites computed from the CIGAR operations match those from
+            compute_jI, for the example above and for reads with clips,
+            indels and no introns """
+
+        start = 1081827
+        for cigar in ["2557M97N26M1371N135M1126N66M297N96M2755N" + \
+                      "76M1043N94M425N113=23956N38=",
+                      "10S100M5I20M3D50M200N80M30S",
+                      "5H50M2D10X10=300N40M12N8M",
+                      "1500M"]:
+            read = make_read(start, cigar)
+            expected = splice_sites_from_jI(tu.compute_jI(start, cigar))
+            assert tu.compute_splice_sites(start, read.cigartuples) == expected
+            assert tu.get_splice_sites(read, start) == expected
+
+    def test_splice_sites_from_jI_tag(self):
+        """ A jI tag takes precedence over the CIGAR operations """
+
+        read = make_read(101, "50M100N50M", [("jI", [161, 260], "i")])
+        assert tu.get_splice_sites(read, 101) == [160, 261]
+
+        read = make_read(101, "50M100N50M", [("jI", [-1], "i")])
+        assert tu.get_splice_sites(read, 101) == []
@@ -0,0 +1,29 @@
+import pytest
+from talon import talon
+from talon import init_refs
+from .helper_fns import get_db_cursor
+
+
+@pytest.mark.dbunit
+
+class TestMakeGeneIndex(object):
+
+    def test_create_index(self):
+        """ Create the gene index and make sure it is accessible even if it is
+            empty, and make sure it doesn't modify the TALON database
+        """
+        # Open TALON database at the same time
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        gene_index = init_refs.make_gene_interval_index(cursor, build,
+                                                        chrom = "chr1",
+                                                        start = 10000,
+                                                        end = 20000)
+        assert len(gene_index) == 0
+        assert gene_index.overlapping("chr1", 1, 20000) == []
+
+        cursor.execute("SELECT name FROM sqlite_temp_master")
+        assert cursor.fetchall() == []
+
+        conn.close()
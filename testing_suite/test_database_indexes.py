@@ -0,0 +1,116 @@
+import shutil
+import sqlite3
+import pytest
+from talon import init_refs, initialize_talon_database as init_db
+from talon import optimize_talon_database as optimize
+from talon import query_utils as qutils
+
+def index_names(database):
+    """ Names of the secondary indexes in the database """
+    conn = sqlite3.connect(database)
+    names = [ x[0] for x in conn.execute("""SELECT name FROM sqlite_master
+                                            WHERE type = 'index'
+                                            AND name NOT LIKE 'sqlite_%'""") ]
+    conn.close()
+    return set(names)
+
+def query_plans(query_fn):
+    """ Run query_fn against the toy database and return the query plan of
+        each statement that it executed """
+    conn = sqlite3.connect("scratch/toy.db")
+    conn.row_factory = sqlite3.Row
+    statements = []
+    conn.set_trace_callback(statements.append)
+    query_fn(conn.cursor())
+    conn.set_trace_callback(None)
+
+    # Skip the statements that the R-tree module runs on its own tables
+    plans = [ " ".join(x[3] for x in conn.execute("EXPLAIN QUERY PLAN " + s))
+              for s in statements if "_rtree_" not in s ]
+    conn.close()
+    return plans
+
+@pytest.mark.dbunit
+
+class TestDatabaseIndexes(object):
+
+    def test_indexes_created_at_initialization(self):
+        """ A newly initialized database has the full index set """
+        expected = set([ x[0] for x in init_db.INDEXES ])
+        assert expected <= index_names("scratch/toy.db")
+
+    def test_optimize_existing_database(self, tmp_path):
+        """ Optimizing a database without the indexes adds them and collects
+            planner statistics. Running it again is harmless. """
+        database = str(tmp_path / "toy.db")
+        shutil.copy("scratch/toy.db", database)
+        conn = sqlite3.connect(database)
+        for name, table, columns in init_db.INDEXES:
+            conn.execute("DROP INDEX %s" % name)
+        conn.commit()
+        conn.close()
+        assert index_names(database) == set()
+
+        optimize.optimize_database(database)
+        optimize.optimize_database(database)
+        assert index_names(database) == set([ x[0] for x in init_db.INDEXES ])
+
+        conn = sqlite3.connect(database)
+        n_stats = conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+        conn.close()
+        assert n_stats > 0
+
+    def test_optimize_rejects_non_talon_database(self, tmp_path):
+        """ Only v5 TALON databases can be optimized """
+        database = str(tmp_path / "other.db")
+        sqlite3.connect(database).close()
+        with pytest.raises(ValueError):
+            optimize.optimize_database(database)
+
+    def test_init_refs_queries_use_indexes(self):
+        """ Region queries in init_refs look up locations, edges, vertices
+            and annotations through the secondary indexes, and gene and
+            transcript overlaps through the extent R-trees """
+        build = "toy_build"
+        region = dict(chrom = "chr1", start = 1, end = 1000)
+
+        plans = query_plans(lambda c: init_refs.make_location_dict(build, c, **region))
+        assert "USING INDEX location_chromosome_position" in plans[0]
+
+        plans = query_plans(lambda c: init_refs.make_edge_dict(c, build, **region))
+        assert "USING INDEX location_chromosome_position" in plans[0]
+        assert "USING INDEX edge_v1" in plans[0]
+
+        plans = query_plans(lambda c: init_refs.make_vertex_2_gene_dict(c, build, **region))
+        assert "USING INDEX location_chromosome_position" in plans[0]
+
+        plans = query_plans(lambda c: init_refs.make_gene_interval_index(c, build, **region))
+        assert "SCAN r VIRTUAL TABLE" in plans[0]
+
+        plans = query_plans(lambda c: init_refs.make_transcript_interval_index(c, build, **region))
+        assert "SCAN r VIRTUAL TABLE" in plans[0]
+
+        plans = query_plans(lambda c: init_refs.make_monoexon_interval_index(c, build, **region))
+        assert "SCAN r VIRTUAL TABLE" in plans[0]
+
+        plans = query_plans(lambda c: init_refs.make_gene_start_or_end_dict(c, build, "start", **region))
+        assert "USING INDEX transcript_annotations_attribute" in plans[0]
+
+    def test_query_utils_queries_use_indexes(self):
+        """ Dataset-level queries in query_utils filter observed reads and
+            annotations through the secondary indexes """
+        datasets = ["toy"]
+
+        plans = query_plans(lambda c: qutils.count_observed_reads(c, datasets))
+        assert "USING COVERING INDEX observed_dataset" in plans[0]
+
+        plans = query_plans(lambda c: qutils.fetch_known_transcripts_with_gene_label(c, datasets))
+        assert "USING INDEX transcript_annotations_attribute" in plans[0]
+        assert "USING INDEX observed_transcript" in plans[0]
+
+        plans = query_plans(lambda c: qutils.fetch_all_known_genes_detected(c, datasets))
+        assert "USING INDEX gene_annotations_attribute" in plans[0]
+        assert "USING INDEX observed_dataset" in plans[0]
+
+        plans = query_plans(lambda c: qutils.fetch_reproducible_intergenic(c, datasets))
+        assert "USING INDEX transcript_annotations_attribute" in plans[0]
@@ -168,15 +168,14 @@ class TestDatabaseUpdates(object):
         run_info = talon.init_run_info(database, build)
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        talon.create_gene("chr4", 1, 1000, "+", cursor, "temp_gene")
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        talon.create_gene("chr4", 1, 1000, "+", gene_index)
 
         # Write to file
         os.system("mkdir -p scratch/db_updates/")
         with open("scratch/db_updates/genes.tsv", 'w') as f:
-            cursor.execute("SELECT gene_ID, strand FROM temp_gene")
-            for entry in cursor.fetchall():
-                f.write("\t".join([str(x) for x in entry]) + "\n")
+            for entry in gene_index:
+                f.write("\t".join([str(entry["gene_ID"]), entry["strand"]]) + "\n")
 
         talon.batch_add_genes(cursor, "scratch/db_updates/genes.tsv", 10)
 
@@ -195,12 +194,12 @@ class TestDatabaseUpdates(object):
         conn, cursor = get_db_cursor()
         build = "toy_build"
         transcript_dict = init_refs.make_transcript_dict(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
         
         database = "scratch/toy.db"
         talon.get_counters(database)
         talon.create_transcript('+', "chr1", 1, 1000, 1, (1,), (1,2), transcript_dict,
-            "temp_transcript", cursor)
+            transcript_index)
 
         # Write to file
         os.system("mkdir -p scratch/db_updates/")
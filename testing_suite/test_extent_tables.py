@@ -0,0 +1,109 @@
+import shutil
+import sqlite3
+import pytest
+from string import Template
+from talon import init_refs, initialize_talon_database as init_db
+
+def extents(cursor):
+    """ Stored gene and transcript extents """
+    genes = cursor.execute("""SELECT gene_ID, genome_build, chromosome, min_pos, max_pos
+                              FROM gene_extent""").fetchall()
+    transcripts = cursor.execute("""SELECT transcript_ID, genome_build, chromosome,
+                                           min_pos, max_pos
+                                    FROM transcript_extent""").fetchall()
+    return sorted(map(tuple, genes)), sorted(map(tuple, transcripts))
+
+def computed_extents(cursor):
+    """ Gene and transcript extents computed from scratch """
+    genes = cursor.execute(Template(init_db.GENE_EXTENT_QUERY).substitute(where = "1"))
+    genes = genes.fetchall()
+    transcripts = cursor.execute(Template(init_db.TRANSCRIPT_EXTENT_QUERY).substitute(where = "1"))
+    transcripts = transcripts.fetchall()
+    return sorted(map(tuple, genes)), sorted(map(tuple, transcripts))
+
+@pytest.mark.dbunit
+
+class TestExtentTables(object):
+
+    def test_extents_after_talon_runs(self):
+        """ Extents kept up to date by the TALON runs on this database must
+            match extents computed from scratch, and the R-trees must hold
+            one entry per extent """
+        conn = sqlite3.connect("scratch/toy_mod.db")
+        cursor = conn.cursor()
+        genes, transcripts = extents(cursor)
+        assert (genes, transcripts) == computed_extents(cursor)
+        assert len(transcripts) == cursor.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+
+        n_gene_rtree = cursor.execute("SELECT COUNT(*) FROM gene_extent_rtree").fetchone()[0]
+        n_transcript_rtree = cursor.execute("SELECT COUNT(*) FROM transcript_extent_rtree").fetchone()[0]
+        assert n_gene_rtree == len(genes)
+        assert n_transcript_rtree == len(transcripts)
+        conn.close()
+
+    def test_region_queries_match_whole_genome(self):
+        """ Genes and transcripts found through the R-trees for a region are
+            exactly those in the whole-genome set that overlap it """
+        conn = sqlite3.connect("scratch/toy_mod.db")
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        build = "toy_build"
+
+        all_genes = init_refs.make_gene_interval_index(cursor, build).entries
+        all_transcripts = init_refs.query_transcript_interval_rows(cursor, build, None, None, None)
+        for chrom, start, end in [("chr1", 1, 1000), ("chr1", 500, 1500),
+                                  ("chr1", 1, 1), ("chr4", 2000, 3000)]:
+            genes = init_refs.make_gene_interval_index(cursor, build, chrom, start, end).entries
+            assert [ x["gene_ID"] for x in genes ] == \
+                   [ x["gene_ID"] for x in all_genes
+                     if x["chromosome"] == chrom and x["start"] <= end and x["end"] >= start ]
+
+            transcripts = init_refs.query_transcript_interval_rows(cursor, build, chrom, start, end)
+            assert [ x["transcript_ID"] for x in transcripts ] == \
+                   [ x["transcript_ID"] for x in all_transcripts
+                     if x["chromosome"] == chrom and x["min_pos"] <= end and x["max_pos"] >= start ]
+        conn.close()
+
+    def test_incremental_gene_update(self, tmp_path):
+        """ Assigning a new vertex to a gene extends the gene's extent, and
+            overlap queries follow it """
+        database = str(tmp_path / "toy.db")
+        shutil.copy("scratch/toy.db", database)
+        conn = sqlite3.connect(database)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        build = "toy_build"
+
+        genes = init_refs.make_gene_interval_index(cursor, build, "chr1", 50000, 50010)
+        assert genes.entries == []
+
+        cursor.execute("""INSERT INTO location (location_ID, genome_build, chromosome, position)
+                          VALUES (5000, 'toy_build', 'chr1', 50005)""")
+        cursor.execute("INSERT INTO vertex (vertex_ID, gene_ID) VALUES (5000, 1)")
+        init_db.update_gene_extents(cursor, [1])
+
+        genes = init_refs.make_gene_interval_index(cursor, build, "chr1", 50000, 50010)
+        assert [ x["gene_ID"] for x in genes.entries ] == [1]
+        assert genes.entries[0]["end"] == 50005
+        assert extents(cursor) == computed_extents(cursor)
+        conn.close()
+
+    def test_add_to_existing_database(self, tmp_path):
+        """ Databases without extent tables get them filled from scratch """
+        database = str(tmp_path / "toy.db")
+        shutil.copy("scratch/toy.db", database)
+        conn = sqlite3.connect(database)
+        cursor = conn.cursor()
+        expected = extents(cursor)
+        for table in ["gene_extent", "transcript_extent"]:
+            cursor.execute("DROP TABLE %s" % table)
+            cursor.execute("DROP TABLE %s_rtree" % table)
+        conn.commit()
+        conn.close()
+
+        init_db.add_extent_tables(database)
+        init_db.add_extent_tables(database)
+
+        conn = sqlite3.connect(database)
+        assert extents(conn.cursor()) == expected
+        conn.close()
@@ -12,7 +12,6 @@ class TestIdentifyGeneOnVertexBasis(object):
         conn, cursor = get_db_cursor()
         db = "scratch/toy.db"
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
         run_info = talon.init_run_info(db, build)
         vertex2gene = init_refs.make_vertex_2_gene_dict(cursor)
 
@@ -32,7 +31,6 @@ class TestIdentifyGeneOnVertexBasis(object):
         conn, cursor = get_db_cursor()
         db = "scratch/toy.db"
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
         run_info = talon.init_run_info(db, build)
         vertex2gene = init_refs.make_vertex_2_gene_dict(cursor)
 
@@ -52,7 +50,6 @@ class TestIdentifyGeneOnVertexBasis(object):
         conn, cursor = get_db_cursor()
         db = "scratch/toy.db"
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
         run_info = talon.init_run_info(db, build)
         vertex2gene = init_refs.make_vertex_2_gene_dict(cursor)
 
@@ -71,7 +68,6 @@ class TestIdentifyGeneOnVertexBasis(object):
         conn, cursor = get_db_cursor()
         db = "scratch/toy.db"
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
         run_info = talon.init_run_info(db, build)
         vertex2gene = init_refs.make_vertex_2_gene_dict(cursor)
 
@@ -0,0 +1,57 @@
+import pytest
+from talon import talon
+
+@pytest.mark.unit
+
+class TestIDBlocks(object):
+
+    def test_block_increments(self):
+        """ In block mode, IDs come from reserved blocks and the blocks used
+            are reported, while the shared value moves a block at a time """
+
+        counter = talon.Counter(initval = 10)
+        counter.start_blocks(block_size = 3)
+        IDs = [ counter.increment() for i in range(4) ]
+        blocks = counter.stop_blocks()
+
+        assert IDs == [11, 12, 13, 14]
+        assert blocks == [(11, 3), (14, 1)]
+        assert counter.value() == 16
+
+        # Back to ordinary increments
+        assert counter.increment() == 17
+
+    def test_renumber_blocks_in_job_order(self):
+        """ Partially used blocks are packed into a gap-free range in the
+            order they were added, and IDs below the range are untouched """
+
+        id_map = talon.IDMap({"gene": 11}, "TALON", 9)
+        id_map.add_block("gene", 21, 2)   # job 1, reserved second
+        id_map.add_block("gene", 11, 3)   # job 2, reserved first
+        id_map.finalize()
+
+        assert [ id_map.renumber("gene", x) for x in (5, 21, 22, 11, 12, 13) ] \
+               == [5, 11, 12, 13, 14, 15]
+        assert id_map.last_ID("gene") == 15
+
+    def test_renumber_line(self):
+        """ ID columns, ID lists and TALON names are all renumbered """
+
+        id_map = talon.IDMap({"gene": 11, "transcript": 101, "edge": 51,
+                              "vertex": 31, "observed": 1}, "TALON", 9)
+        id_map.add_block("transcript", 201, 1)
+        id_map.add_block("edge", 71, 2)
+        id_map.add_block("gene", 21, 1)
+        id_map.finalize()
+
+        line = "\t".join(["201", "21", "5", "6,71,72", "7", "1", "2", "4"])
+        assert id_map.renumber_line("transcripts", line + "\n") == \
+               "\t".join(["101", "11", "5", "6,51,52", "7", "1", "2", "4"]) + "\n"
+
+        line = "201\tTALON\tTALON\ttranscript_name\tTALONT000000201\n"
+        assert id_map.renumber_line("transcript_annot", line) == \
+               "101\tTALON\tTALON\ttranscript_name\tTALONT000000101\n"
+
+        line = "201\tTALON\tTALON\tISM_to_IDs\t3,201\n"
+        assert id_map.renumber_line("transcript_annot", line) == \
+               "101\tTALON\tTALON\tISM_to_IDs\t3,101\n"
@@ -13,10 +13,10 @@ class TestIdentifyFSM(object):
         build = "toy_build"
         database = "scratch/toy.db"
         talon.get_counters(database)
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
-        init_refs.make_temp_transcript_table(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
@@ -34,7 +34,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         correct_transcript_ID = fetch_correct_ID("TG1-001", "transcript", cursor)
@@ -52,8 +52,8 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -72,7 +72,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG2", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -89,8 +89,8 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -108,7 +108,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "tmp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG5", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -124,8 +124,8 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -143,7 +143,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -161,8 +161,8 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -180,7 +180,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -198,10 +198,10 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
-        init_refs.make_temp_monoexonic_transcript_table(cursor, build)
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
@@ -218,7 +218,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript", "temp_monoexon")
+                                               gene_index, transcript_index, monoexon_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -235,8 +235,8 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -254,7 +254,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -272,8 +272,8 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -291,7 +291,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -308,8 +308,8 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -327,7 +327,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         anti_gene_ID = fetch_correct_ID("TG2", "gene", cursor)
         gene_novelty_types = [ x[-2] for x in annotation['gene_novelty']]
@@ -345,10 +345,10 @@ class TestIdentifyFSM(object):
         database = "scratch/toy.db"
         talon.get_counters(database)
 
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
-        init_refs.make_temp_monoexonic_transcript_table(cursor, build)
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
@@ -365,7 +365,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript", "temp_monoexon")
+                                               gene_index, transcript_index, monoexon_index)
 
         correct_gene_ID = fetch_correct_ID("TG1", "gene", cursor)
         novelty_types = [ x[-2] for x in annotation['transcript_novelty']]
@@ -384,8 +384,8 @@ class TestIdentifyFSM(object):
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         build = "mm10"
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
 
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
@@ -403,7 +403,7 @@ class TestIdentifyFSM(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               "temp_gene", "temp_transcript")
+                                               gene_index, transcript_index)
 
         assert annotation['gene_ID'] == 1
         assert annotation['transcript_ID'] == 8
@@ -0,0 +1,45 @@
+import pytest
+import random
+from talon import dstruct
+
+@pytest.mark.unit
+
+class TestIntervalIndex(object):
+
+    def test_overlap_and_order(self):
+        """ Overlapping entries come back in insertion order, restricted to
+            the requested chromosome and (optionally) strand """
+
+        index = dstruct.IntervalIndex(group_by="gene_ID")
+        index.add("chr1", "+", 500, 900, {"gene_ID": 2, "name": "a"})
+        index.add("chr1", "-", 100, 600, {"gene_ID": 1, "name": "b"})
+        index.add("chr2", "+", 100, 600, {"gene_ID": 3, "name": "c"})
+        index.add("chr1", "+", 1, 50, {"gene_ID": 2, "name": "d"})
+
+        assert [x["name"] for x in index.overlapping("chr1", 550, 560)] == ["a", "b"]
+        assert [x["name"] for x in index.overlapping("chr1", 560, 550, "-")] == ["b"]
+        assert [x["name"] for x in index.overlapping("chr1", 50, 100)] == ["b", "d"]
+        assert index.overlapping("chr3", 1, 1000) == []
+        assert [x["name"] for x in index.lookup([2])] == ["a", "d"]
+        assert len(index) == 4
+
+    def test_matches_linear_scan(self):
+        """ Overlap queries must return exactly what a scan would """
+
+        rng = random.Random(3)
+        index = dstruct.IntervalIndex()
+        intervals = []
+        for i in range(300):
+            start = rng.randint(1, 10000)
+            end = start + rng.randint(0, 800)
+            strand = rng.choice(["+", "-"])
+            intervals.append((strand, start, end, i))
+            index.add("chr1", strand, start, end, i)
+
+        for i in range(500):
+            start = rng.randint(1, 11000)
+            end = start + rng.randint(0, 500)
+            strand = rng.choice(["+", "-", None])
+            expected = [x[3] for x in intervals if x[1] <= end and x[2] >= start
+                        and strand in (None, x[0])]
+            assert index.overlapping("chr1", start, end, strand) == expected
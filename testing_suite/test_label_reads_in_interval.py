@@ -0,0 +1,63 @@
+import pytest
+import pysam
+from talon import talon, dstruct
+from talon import talon_label_reads as tlr
+import sys
+sys.path.append("talon_label_reads")
+import optparse_mock
+
+GENOME = "talon_label_reads/test_inputs/toy_genome.fa"
+
+def make_bam(tmp_path):
+    """ Indexed BAM with a plus and a minus strand read, and a secondary
+        alignment of the first """
+    header = {"HD": {"VN": "1.0", "SO": "coordinate"},
+              "SQ": [{"SN": "chrTest1", "LN": 30}]}
+    bam_file = str(tmp_path / "reads.bam")
+    with pysam.AlignmentFile(bam_file, "wb", header = header) as out:
+        for name, flag, start in [("read_1", 0, 3), ("read_1", 256, 3),
+                                  ("read_2", 16, 12)]:
+            record = pysam.AlignedSegment(out.header)
+            record.query_name = name
+            record.flag = flag
+            record.reference_id = 0
+            record.reference_start = start
+            record.mapping_quality = 40
+            record.cigarstring = "10M"
+            record.query_sequence = "A" * 10
+            out.write(record)
+    pysam.index(bam_file)
+    return bam_file
+
+@pytest.mark.unit
+
+class TestLabelReadsInInterval(object):
+    def test_labels_match_talon_label_reads(self, tmp_path):
+        """ Reads labeled as they are streamed to annotation get the same
+            tags as from talon_label_reads, and secondary alignments are
+            dropped like talon_label_reads does """
+        bam_file = make_bam(tmp_path)
+        bed = str(tmp_path / "tss.bed")
+        with open(bed, "w") as f:
+            f.write("chrTest1\t0\t5\ta\t0\t+\n")
+
+        tmp_dir = str(tmp_path / "label_reads")
+        options = optparse_mock.OptParseMock(bam_file, GENOME, tmp_dir = tmp_dir,
+                                             tss_file = bed)
+        labeled_bam, log = tlr.run_chrom_thread(bam_file, options)
+        with pysam.AlignmentFile(labeled_bam) as sam:
+            expected = [ (r.query_name, r.flag, r.get_tags()) for r in sam ]
+
+        read_labels = dstruct.Struct(genome_file = GENOME, fracA_range_size = 10,
+                                     site_window = 50,
+                                     index_dir = str(tmp_path / "fracA_index"))
+        tss_sites = tlr.select_sites(tlr.read_site_catalog(bed), "chrTest1")
+        with pysam.AlignmentFile(bam_file) as sam:
+            reads = talon.label_reads_in_interval(sam.fetch("chrTest1", 0, 30),
+                                                  "chrTest1", read_labels,
+                                                  tss_sites = tss_sites)
+            labeled = [ (r.query_name, r.flag, r.get_tags()) for r in reads ]
+
+        assert labeled == expected
+        assert [ x[:2] for x in labeled ] == [("read_1", 0), ("read_2", 16)]
+        assert [ dict(x[2])["tS"] for x in labeled ] == ["yes", "no"]
@@ -0,0 +1,52 @@
+import pytest
+from talon import talon, init_refs
+import sqlite3
+from .helper_fns import get_db_cursor
+@pytest.mark.unit
+
+class TestGeneIntervalIndex(object):
+    def test_all(self):
+        """ Get all genes in the database """
+
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+
+        results = [ x["gene_ID"] for x in gene_index ]
+        conn.close()
+        assert results == [1, 2, 3, 4, 5, 6]
+
+    def test_empty_interval(self):
+        """ The specified interval contains no genes """
+
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        gene_index = init_refs.make_gene_interval_index(cursor, build, chrom = "chr1",
+                                                        start = 10000, end = 20000)
+        assert list(gene_index) == []
+
+        conn.close()
+
+    def test_non_empty(self):
+        """ The specified interval contains two genes """
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        gene_index = init_refs.make_gene_interval_index(cursor, build, chrom = "chr1",
+                                                        start = 500, end = 1500)
+        results = [ x["gene_ID"] for x in gene_index ]
+        conn.close()
+        assert results == [1, 2]
+
+    def test_overlap_query(self):
+        """ Overlap queries against the index agree with the interval used
+            to build it """
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        results = [ x["gene_ID"] for x in gene_index.overlapping("chr1", 500, 1500) ]
+        conn.close()
+        assert results == [1, 2]
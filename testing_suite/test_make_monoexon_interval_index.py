@@ -0,0 +1,54 @@
+import pytest
+from talon import talon, init_refs
+import sqlite3
+from .helper_fns import get_db_cursor
+@pytest.mark.unit
+
+class TestMonoexonIndex(object):
+    def test_all(self):
+        """ Get all monoexonic in the database """
+
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
+
+        results = [ x["transcript_ID"] for x in monoexon_index ]
+        conn.close()
+        assert results == [7]
+
+    def test_empty_interval(self):
+        """ The specified interval contains no monoexonic transcripts """
+
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build, chrom = "chr1",
+                                                                start = 1, end = 1000)
+        assert list(monoexon_index) == []
+
+        conn.close()
+
+    def test_non_empty(self):
+        """ The specified interval contains one monoexonic transcript """
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build, chrom = "chr4",
+                                                                start = 2000, end = 3000)
+        results = [ x["transcript_ID"] for x in monoexon_index ]
+        conn.close()
+        assert results == [7]
+
+    def test_strand_aware_overlap(self):
+        """ Overlap queries only return monoexonic transcripts on the
+            requested strand """
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
+        minus = [ x["transcript_ID"] for x in monoexon_index.overlapping("chr4", 2000, 3000, "-") ]
+        plus = [ x["transcript_ID"] for x in monoexon_index.overlapping("chr4", 2000, 3000, "+") ]
+        conn.close()
+        assert minus == [7]
+        assert plus == []
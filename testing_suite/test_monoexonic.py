@@ -12,9 +12,9 @@ class TestIdentifyMonoexonic(object):
         build = "toy_build"
         database = "scratch/toy.db"
         talon.get_counters(database)
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_monoexonic_transcript_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
@@ -32,7 +32,7 @@ class TestIdentifyMonoexonic(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               'temp_gene', 'temp_transcript', 'temp_monoexon')
+                                               gene_index, transcript_index, monoexon_index)
 
         correct_gene_ID = fetch_correct_ID("TG6", "gene", cursor)
         correct_transcript_ID = fetch_correct_ID("TG6-001", "transcript", cursor)
@@ -53,9 +53,9 @@ class TestIdentifyMonoexonic(object):
         build = "toy_build"
         database = "scratch/toy.db"
         talon.get_counters(database)
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
-        init_refs.make_temp_monoexonic_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
@@ -73,7 +73,7 @@ class TestIdentifyMonoexonic(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               'temp_gene', 'temp_transcript', 'temp_monoexon')
+                                               gene_index, transcript_index, monoexon_index)
 
         correct_gene_ID = fetch_correct_ID("TG6", "gene", cursor)
         correct_transcript_ID = fetch_correct_ID("TG6-001", "transcript", cursor)
@@ -97,8 +97,8 @@ class TestIdentifyMonoexonic(object):
 #        build = "toy_build"
 #        database = "scratch/toy.db"
 #        talon.get_counters(database)
-#        init_refs.make_temp_novel_gene_table(cursor, build)
-#        init_refs.make_temp_monoexonic_transcript_table(cursor, build)
+#        gene_index = init_refs.make_gene_interval_index(cursor, build)
+#        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
 #        edge_dict = init_refs.make_edge_dict(cursor)
 #        location_dict = init_refs.make_location_dict(build, cursor)
 #        run_info = talon.init_run_info(database, build)
@@ -115,7 +115,7 @@ class TestIdentifyMonoexonic(object):
 #                                               location_dict, edge_dict,
 #                                               transcript_dict, vertex_2_gene,
 #                                               gene_starts, gene_ends, run_info,
-#                                               'temp_gene', 'temp_monoexon')
+#                                               gene_index, monoexon_index)
 #
 #        correct_gene_ID = fetch_correct_ID("TG6", "gene", cursor)
 #        assert annotation['gene_ID'] == correct_gene_ID
@@ -134,8 +134,8 @@ class TestIdentifyMonoexonic(object):
 #        build = "toy_build"
 #        database = "scratch/toy.db"
 #        talon.get_counters(database)
-#        init_refs.make_temp_novel_gene_table(cursor, build)
-#        init_refs.make_temp_monoexonic_transcript_table(cursor, build)
+#        gene_index = init_refs.make_gene_interval_index(cursor, build)
+#        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
 #        edge_dict = init_refs.make_edge_dict(cursor)
 #        location_dict = init_refs.make_location_dict(build, cursor)
 #        run_info = talon.init_run_info(database, build)
@@ -143,8 +143,7 @@ class TestIdentifyMonoexonic(object):
 #        vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor)
 #        gene_starts, gene_ends = init_refs.make_gene_start_and_end_dict(cursor, build)
 #        tot_vertices = len(vertex_2_gene)
-#        query = """ SELECT COUNT(*) FROM temp_monoexon """
-#        tot_monoexonic = cursor.execute(query).fetchone()[0]
+#        tot_monoexonic = len(monoexon_index)
 #
 #        chrom = "chr4"
 #        strand = "-"
@@ -155,7 +154,7 @@ class TestIdentifyMonoexonic(object):
 #                                               location_dict, edge_dict,
 #                                               transcript_dict, vertex_2_gene,
 #                                               gene_starts, gene_ends, run_info,
-#                                               'temp_gene', 'temp_monoexon')
+#                                               gene_index, monoexon_index)
 #
 #        correct_gene_ID = fetch_correct_ID("TG6", "gene", cursor)
 #        print(annotation['start_vertex'])
@@ -166,7 +165,7 @@ class TestIdentifyMonoexonic(object):
 #
 #        # Now check if the transcript got added to the right data structures
 #        assert len(vertex_2_gene) == tot_vertices + 2
-#        assert cursor.execute(query).fetchone()[0] == tot_monoexonic + 1
+#        assert len(monoexon_index) == tot_monoexonic + 1
 #
 #        conn.close()
 #
@@ -177,9 +176,9 @@ class TestIdentifyMonoexonic(object):
         build = "toy_build"
         database = "scratch/toy.db"
         talon.get_counters(database)
-        init_refs.make_temp_novel_gene_table(cursor, build)
-        init_refs.make_temp_transcript_table(cursor, build)
-        init_refs.make_temp_monoexonic_transcript_table(cursor, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
@@ -197,7 +196,7 @@ class TestIdentifyMonoexonic(object):
                                                location_dict, edge_dict,
                                                transcript_dict, vertex_2_gene,
                                                gene_starts, gene_ends, run_info,
-                                               'temp_gene', 'temp_transcript', 'temp_monoexon')
+                                               gene_index, transcript_index, monoexon_index)
 
         anti_gene_ID = fetch_correct_ID("TG6", "gene", cursor)
         gene_novelty_types = [ x[-2] for x in annotation['gene_novelty']]
@@ -207,3 +206,51 @@ class TestIdentifyMonoexonic(object):
         assert "antisense_transcript" in t_novelty_types
 
         conn.close()
+
+    def test_novel_monoexon_is_reused(self):
+        """ A novel monoexonic transcript is added to the monoexon index, so
+            a second read at the same locus matches it rather than creating
+            another transcript """
+
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+        database = "scratch/toy.db"
+        talon.get_counters(database)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
+        monoexon_index = init_refs.make_monoexon_interval_index(cursor, build)
+        edge_dict = init_refs.make_edge_dict(cursor)
+        location_dict = init_refs.make_location_dict(build, cursor)
+        run_info = talon.init_run_info(database, build)
+        transcript_dict = init_refs.make_transcript_dict(cursor, build)
+        vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor)
+        gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start")
+        gene_ends = init_refs.make_gene_start_or_end_dict(cursor, build, "end")
+        tot_monoexonic = len(monoexon_index)
+
+        chrom = "chr4"
+        strand = "+"
+        positions = ( 1300, 3900 )
+
+        first = talon.identify_monoexon_transcript(chrom, positions,
+                                               strand, cursor,
+                                               location_dict, edge_dict,
+                                               transcript_dict, vertex_2_gene,
+                                               gene_starts, gene_ends, run_info,
+                                               gene_index, transcript_index, monoexon_index)
+        assert len(monoexon_index) == tot_monoexonic + 1
+
+        second = talon.identify_monoexon_transcript(chrom, ( 1350, 3850 ),
+                                               strand, cursor,
+                                               location_dict, edge_dict,
+                                               transcript_dict, vertex_2_gene,
+                                               gene_starts, gene_ends, run_info,
+                                               gene_index, transcript_index, monoexon_index)
+        assert second['gene_ID'] == first['gene_ID']
+        assert second['transcript_ID'] == first['transcript_ID']
+        assert second['transcript_novelty'] == []
+        assert second['start_delta'] == 50
+        assert second['end_delta'] == -50
+        assert len(monoexon_index) == tot_monoexonic + 1
+
+        conn.close()
@@ -23,7 +23,7 @@ class TestMultExonReadOverlapsMonoGene(object):
         talon.get_counters(database)
         run_info = talon.init_run_info(database, build)
         struct_collection = talon.prepare_data_structures(cursor, run_info)
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
 
         # Use pysam to get the read from the SAM file
         sam_file = "input_files/multiexon_read_overlapping_monoexon_transcript/read.sam"
@@ -41,9 +41,8 @@ class TestMultExonReadOverlapsMonoGene(object):
         # Do we get any overlap with the reference gene?
         best_gene, match_strand = talon.search_for_overlap_with_gene(chrom, min(sam_start, sam_end),
                                                                      max(sam_start, sam_end), strand,
-                                                                     cursor, run_info,
-                                                                     struct_collection.tmp_gene,
-                                                                     struct_collection.tmp_t)
+                                                                     run_info,
+                                                                     struct_collection.transcript_index)
         assert best_gene == 1
         assert match_strand == "-"
 
@@ -0,0 +1,115 @@
+import sqlite3
+import pytest
+from talon import talon, dstruct
+
+@pytest.mark.unit
+
+class TestOutputShards(object):
+
+    def test_batches_are_written_in_order(self, tmp_path):
+        """ Lines buffered past the batch size are flushed to the shard,
+            and nothing is lost or reordered on the final flush """
+
+        outfiles = dstruct.Struct(qc = str(tmp_path / "qc.log"),
+                                  observed = str(tmp_path / "observed.tsv"))
+        shard_dir = str(tmp_path)
+
+        with talon.OutputShard(shard_dir, "chr1_1_100",
+                               batch_size = 3) as shard:
+            for i in range(4):
+                shard.write("observed", "obs_%d" % i)
+            assert open(talon.shard_path(shard_dir, "chr1_1_100",
+                        "observed")).read() == "obs_0\nobs_1\nobs_2\n"
+
+        assert open(talon.shard_path(shard_dir, "chr1_1_100",
+                    "observed")).read() == "obs_0\nobs_1\nobs_2\nobs_3\n"
+
+    def test_merge_follows_shard_order(self, tmp_path):
+        """ Shards are concatenated in the order given, the QC header comes
+            first, and the shard files are cleaned up afterwards """
+
+        outfiles = dstruct.Struct(qc = str(tmp_path / "qc.log"),
+                                  observed = str(tmp_path / "observed.tsv"))
+        shard_dir = str(tmp_path)
+
+        for shard_id in ["b", "a"]:
+            with talon.OutputShard(shard_dir, shard_id) as shard:
+                shard.write("qc", "qc_" + shard_id)
+                if shard_id == "a":
+                    shard.write("observed", "obs_a")
+
+        talon.merge_output_shards(outfiles, shard_dir, ["a", "b"], "# header")
+
+        assert open(outfiles.qc).read() == "# header\nqc_a\nqc_b\n"
+        assert open(outfiles.observed).read() == "obs_a\n"
+        assert sorted(p.name for p in tmp_path.iterdir()) == \
+               ["observed.tsv", "qc.log"]
+
+def shard_schema():
+    """ Schema of the database tables that jobs stage rows for """
+    conn = sqlite3.connect("scratch/toy.db")
+    schema = talon.get_shard_schema(conn.cursor())
+    conn.close()
+    return schema
+
+@pytest.mark.dbunit
+
+class TestDatabaseShards(object):
+
+    def test_rows_go_to_the_shard_database(self, tmp_path):
+        """ Rows for database tables are stored in the job's SQLite shard,
+            while other outfiles are still written as text """
+
+        shard_dir = str(tmp_path)
+        with talon.DatabaseShard(shard_dir, "chr1_1_100", shard_schema(),
+                                 batch_size = 2) as shard:
+            shard.write_row("qc", ("toy", "read_1", 1))
+            shard.write_row("genes", (21, "+"))
+            shard.write_row("genes", (21, "+"))
+            shard.write_row("v2g", (31, 21))
+
+        assert open(talon.shard_path(shard_dir, "chr1_1_100", "qc")).read() \
+               == "toy\tread_1\t1\n"
+        conn = sqlite3.connect(talon.shard_db_path(shard_dir, "chr1_1_100"))
+        assert conn.execute("SELECT * FROM genes").fetchall() == [(21, "+")]
+        assert conn.execute("SELECT * FROM vertex").fetchall() == [(31, 21)]
+        conn.close()
+
+    def test_merge_renumbers_in_shard_order(self, tmp_path):
+        """ Shards are merged into the staging database in the order given,
+            with block IDs renumbered, and are cleaned up afterwards """
+
+        shard_dir = str(tmp_path)
+        schema = shard_schema()
+        id_map = talon.IDMap({"gene": 11, "transcript": 101, "edge": 51,
+                              "vertex": 31, "observed": 1}, "TALON", 9)
+        id_map.add_block("gene", 21, 1)
+        id_map.add_block("gene", 41, 1)
+        id_map.add_block("transcript", 201, 1)
+        id_map.add_block("edge", 71, 2)
+        id_map.finalize()
+
+        with talon.DatabaseShard(shard_dir, "a", schema) as shard:
+            shard.write_row("genes", (21, "+"))
+            shard.write_row("transcripts", (201, 21, 5, "6,71,72", 7, 1, 2, 4))
+            shard.write_row("transcript_annot", (201, "TALON", "TALON", "transcript_name",
+                                                 "TALONT000000201"))
+            shard.write_row("transcript_annot", (201, "TALON", "TALON", "ISM_to_IDs", "3,201"))
+        with talon.DatabaseShard(shard_dir, "b", schema) as shard:
+            shard.write_row("genes", (41, "-"))
+            shard.write_row("gene_annot", (41, "TALON", "TALON", "gene_status", "NOVEL"))
+
+        staged_db = str(tmp_path / "staged.db")
+        talon.merge_shard_databases(staged_db, shard_dir, ["b", "a"], schema, id_map)
+
+        conn = sqlite3.connect(staged_db)
+        assert conn.execute("SELECT * FROM genes ORDER BY rowid").fetchall() == \
+               [(11, "+"), (12, "-")]
+        assert conn.execute("SELECT * FROM transcripts").fetchall() == \
+               [(101, 11, 5, "6,51,52", 7, 1, 2, 4)]
+        assert conn.execute("SELECT attribute, value FROM transcript_annotations").fetchall() == \
+               [("transcript_name", "TALONT000000101"), ("ISM_to_IDs", "3,101")]
+        assert conn.execute("SELECT * FROM gene_annotations").fetchall() == \
+               [(12, "TALON", "TALON", "gene_status", "NOVEL")]
+        conn.close()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["staged.db"]
@@ -17,14 +17,85 @@ class TestPartitionReads(object):
         datasets = ["dataset1", "dataset2"]
         tmp_dir = "scratch/test_read_partition/"
 
-        read_groups, intervals, merged_bam = procsam.partition_reads(sams, datasets, tmp_dir = tmp_dir, use_cb_tag = False)
+        intervals, merged_bam = procsam.partition_reads(sams, datasets, tmp_dir = tmp_dir, use_cb_tag = False)
 
         # Check length and membership of read groups
-        assert len(read_groups) == 2
+        assert len(intervals) == 2
 
-        assert [ entry.query_name for entry in read_groups[0] ] == ["read_1", "read_2"]
-        assert [ entry.query_name for entry in read_groups[1] ] == ["read_3"]
+        with pysam.AlignmentFile(merged_bam) as bam:
+            read_groups = [ [ entry.query_name for entry in
+                              procsam.get_reads_in_interval(bam, interval) ]
+                            for interval in intervals ]
+        assert read_groups[0] == ["read_1", "read_2"]
+        assert read_groups[1] == ["read_3"]
 
         # Check the intervals
         assert intervals[0] == ("chr1", 1, 1004)
         assert intervals[1] == ("chr2", 1, 100)
+
+    def test_gene_extent_joins_loci(self):
+        """ read_2 and read_3 do not overlap, but a reference gene spans
+            both of them, so they have to be processed together """
+
+        sams = ["input_files/preprocess_sam/read1.sam",
+                "input_files/preprocess_sam/read2.sam"]
+        datasets = ["dataset1", "dataset2"]
+        tmp_dir = "scratch/test_read_partition/"
+        genes = [("chr2", 50, 5000)]
+
+        intervals, merged_bam = procsam.partition_reads(sams, datasets,
+                                                        tmp_dir = tmp_dir,
+                                                        use_cb_tag = False,
+                                                        gene_extents = genes)
+
+        assert len(intervals) == 2
+        assert intervals[0] == ("chr1", 1, 1004)
+        assert intervals[1] == ("chr2", 1, 5000)
+
+
+@pytest.mark.unit
+
+class TestFindLoci(object):
+    def test_slack(self):
+        """ Reads closer than the slack distance end up in the same locus """
+
+        reads = [("chr1", 0, 100), ("chr1", 150, 300), ("chr1", 1000, 1200)]
+
+        assert procsam.find_loci(reads) == [("chr1", 0, 100, 1), ("chr1", 150, 300, 1),
+                                            ("chr1", 1000, 1200, 1)]
+        assert procsam.find_loci(reads, slack = 50) == [("chr1", 0, 300, 2),
+                                                        ("chr1", 1000, 1200, 1)]
+
+    def test_genes_without_reads_dropped(self):
+        """ Gene extents bridge reads, but loci made only of genes are
+            left out """
+
+        reads = [("chr1", 0, 100), ("chr1", 500, 600)]
+        genes = [("chr1", 90, 510), ("chr1", 5000, 6000), ("chr2", 1, 100)]
+
+        assert procsam.find_loci(reads, gene_extents = genes) == [("chr1", 0, 600, 2)]
+
+    def test_streamed_reads(self):
+        """ Reads can be streamed in BAM order: contained and touching
+            reads join a locus, and chromosomes come out in natural order """
+
+        reads = [("chr10", 0, 100), ("chr2", 0, 500), ("chr2", 100, 200),
+                 ("chr2", 500, 600), ("chr2", 700, 800)]
+
+        assert procsam.find_loci(iter(reads)) == [("chr2", 0, 600, 3), ("chr2", 700, 800, 1),
+                                                  ("chr10", 0, 100, 1)]
+
+@pytest.mark.unit
+
+class TestGroupLoci(object):
+    def test_target_size(self):
+        """ Consecutive loci are packed up to the target size, never across
+            chromosomes, and oversized loci stand alone """
+
+        loci = [("chr1", 0, 100, 2), ("chr1", 200, 300, 1), ("chr1", 400, 500, 5),
+                ("chr1", 600, 700, 1), ("chr2", 0, 100, 1)]
+
+        assert procsam.group_loci(loci, 3) == [("chr1", 0, 300), ("chr1", 400, 500),
+                                               ("chr1", 600, 700), ("chr2", 0, 100)]
+        assert procsam.group_loci(loci, 100) == [("chr1", 0, 700), ("chr2", 0, 100)]
+        assert procsam.group_loci(loci, 1) == [locus[:3] for locus in loci]
@@ -0,0 +1,123 @@
+import pytest
+import random
+from talon import talon, dstruct
+
+@pytest.mark.unit
+
+class TestPositionDict(object):
+
+    def test_sorted_after_inserts(self):
+        """ Positions stay sorted no matter what order they are added in """
+
+        locs = dstruct.PositionDict({500: "a", 100: "b"})
+        locs[300] = "c"
+        locs[50] = "d"
+        locs[300] = "e"
+
+        assert locs.positions == [50, 100, 300, 500]
+        assert locs[300] == "e"
+        assert locs == {500: "a", 100: "b", 300: "e", 50: "d"}
+
+    def test_closest_in_window(self):
+        """ Closest position is restricted to the supplied window """
+
+        locs = dstruct.PositionDict({100: "a", 200: "b", 260: "c"})
+
+        assert locs.closest(210, 0, 1000) == 200
+        assert locs.closest(210, 230, 1000) == 260
+        assert locs.closest(210, 0, 150) == 100
+        assert locs.closest(210, 110, 190) == None
+
+    def test_closest_tiebreak(self):
+        """ Equidistant positions are resolved by direction or insert order """
+
+        locs = dstruct.PositionDict({300: "a", 100: "b"})
+
+        assert locs.closest(200, 0, 1000, prefer=-1) == 100
+        assert locs.closest(200, 0, 1000, prefer=1) == 300
+        assert locs.closest(200, 0, 1000, prefer=None) == 300
+
+    def test_permissive_search_matches_linear_probe(self):
+        """ The bisection-based permissive search must return exactly what
+            probing the location dict one position at a time returns """
+
+        def linear_probe(chrom, position, strand, sj_pos, pos_type, locations,
+                         run_info):
+            if position in locations[chrom]:
+                return locations[chrom][position]["location_ID"], 0
+            max_dist = run_info.cutoff_5p if pos_type == "start" \
+                                          else run_info.cutoff_3p
+            if (strand == "+" and pos_type == "start") or \
+               (strand == "-" and pos_type == "end"):
+                direction = -1
+                window = (position - max_dist, sj_pos)
+            else:
+                direction = 1
+                window = (sj_pos, position + max_dist)
+            for dist in range(1, max_dist):
+                for curr_pos in (position + dist*direction,
+                                 position - dist*direction):
+                    if window[0] < curr_pos < window[1] and \
+                       curr_pos in locations[chrom]:
+                        delta = talon.compute_delta(curr_pos, position, strand)
+                        return locations[chrom][curr_pos]["location_ID"], delta
+            return None, None
+
+        rng = random.Random(7)
+        positions = rng.sample(range(1, 5000), 150)
+        locations = {"chr1": dstruct.PositionDict(
+                        {pos: {"location_ID": i} for i, pos in enumerate(positions)})}
+        run_info = dstruct.Struct(cutoff_5p=120, cutoff_3p=80)
+
+        for i in range(2000):
+            position = rng.randint(1, 5000)
+            sj_pos = position + rng.randint(-300, 300)
+            strand = rng.choice(["+", "-"])
+            pos_type = rng.choice(["start", "end"])
+            args = ("chr1", position, strand, sj_pos, pos_type, locations,
+                    run_info)
+            assert talon.permissive_vertex_search(*args) == linear_probe(*args)
+
+    def test_gene_priority_matches_linear_scan(self):
+        """ Gene-priority matching must pick the same known start/end as
+            scanning every position of the gene """
+
+        def linear_scan(position, strand, sj_pos, pos_type, known, run_info):
+            max_dist = run_info.cutoff_5p if pos_type == "start" \
+                                          else run_info.cutoff_3p
+            if (strand == "+" and pos_type == "start") or \
+               (strand == "-" and pos_type == "end"):
+                window = (position - max_dist, sj_pos)
+            else:
+                window = (sj_pos, position + max_dist)
+            best = (None, None)
+            min_abs_dist = max_dist + 1
+            for loc in known:
+                if loc < window[0] or loc > window[1]:
+                    continue
+                dist = talon.compute_delta(loc, position, strand)
+                if abs(dist) < min_abs_dist:
+                    min_abs_dist = abs(dist)
+                    best = (known[loc], dist)
+            return best
+
+        rng = random.Random(11)
+        known = {pos: "v%d" % pos for pos in rng.sample(range(1, 5000), 60)}
+        gene_locs = {"g1": dstruct.PositionDict(known)}
+        locations = {"chr1": dstruct.PositionDict()}
+        run_info = dstruct.Struct(cutoff_5p=150, cutoff_3p=150)
+
+        for i in range(2000):
+            position = rng.randint(1, 5000)
+            sj_pos = position + rng.randint(-300, 300)
+            strand = rng.choice(["+", "-"])
+            pos_type = rng.choice(["start", "end"])
+            vertex, dist, known_flag = talon.permissive_match_with_gene_priority(
+                "chr1", position, strand, sj_pos, pos_type, "g1", gene_locs,
+                locations, run_info)
+            expected = linear_scan(position, strand, sj_pos, pos_type, known,
+                                   run_info)
+            if expected[0] != None:
+                assert (vertex, dist, known_flag) == expected + (1,)
+            else:
+                assert known_flag == 0
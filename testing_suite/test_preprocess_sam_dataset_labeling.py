@@ -1,3 +1,4 @@
+import os
 import pytest
 import pysam
 from talon import process_sams as procsam
@@ -41,3 +42,81 @@ class TestMergeReads(object):
             for entry in bam:
                 assert entry.query_name == "m54284_180814_002203/19268005/ccs"
                 break
+
+    def test_sorted_inputs_are_not_copied(self, tmp_path):
+        """ Inputs that are sorted already are linked for the merge, and
+            only unsorted ones are sorted """
+
+        tmp_dir = str(tmp_path) + "/"
+        sorted_bam = "input_files/readthrough/hl60_1_1_subset_remapped_sorted.bam"
+        unsorted_sam = "input_files/toy_transcript/toy_reads_for_partition_test.sam"
+
+        link = procsam.sort_input(sorted_bam, tmp_dir + "hl60")
+        assert link == tmp_dir + "hl60.bam"
+        assert os.path.islink(link)
+
+        copy = procsam.sort_input(unsorted_sam, tmp_dir + "toy")
+        assert copy == tmp_dir + "toy.bam"
+        assert not os.path.islink(copy)
+        assert procsam.is_coordinate_sorted(copy)
+
+    def test_labeled_input_is_used_directly(self, tmp_path):
+        """ A single sorted and indexed BAM file is used as it is once every
+            read carries its dataset label, and relabeled otherwise """
+
+        tmp_dir = str(tmp_path) + "/"
+        bam = "input_files/readthrough/hl60_1_1_subset_remapped_sorted.bam"
+
+        # The reads in this file have no RG tag yet
+        merged_bam = procsam.preprocess_sam([bam], ["hl60"], tmp_dir = tmp_dir + "run1/",
+                                            use_cb_tag = False)
+        assert merged_bam != bam
+        with pysam.AlignmentFile(merged_bam) as f:
+            assert set(entry.get_tag("RG") for entry in f) == set(["hl60"])
+
+        assert procsam.preprocess_sam([merged_bam], ["hl60"], tmp_dir = tmp_dir + "run2/",
+                                      use_cb_tag = False) == merged_bam
+        assert procsam.preprocess_sam([merged_bam], ["other"], tmp_dir = tmp_dir + "run3/",
+                                      use_cb_tag = False) != merged_bam
+
+    def test_labeled_input_without_filter_expressions(self, tmp_path, monkeypatch):
+        """ If samtools is too old to count the labeled reads with a filter
+            expression, a labeled input is merged like any other """
+
+        tmp_dir = str(tmp_path) + "/"
+        bam = "input_files/readthrough/hl60_1_1_subset_remapped_sorted.bam"
+        labeled_bam = procsam.preprocess_sam([bam], ["hl60"], tmp_dir = tmp_dir + "run1/",
+                                             use_cb_tag = False)
+
+        def old_view(*args):
+            if "-e" in args:
+                raise pysam.SamtoolsError("view: invalid option -- 'e'")
+            return pysam.samtools.view(*args)
+
+        monkeypatch.setattr(pysam, "view", old_view)
+        assert not procsam.is_ready_for_annotation(labeled_bam, "hl60", False)
+        merged_bam = procsam.preprocess_sam([labeled_bam], ["hl60"], tmp_dir = tmp_dir + "run2/",
+                                            use_cb_tag = False)
+        assert merged_bam != labeled_bam
+        with pysam.AlignmentFile(merged_bam) as f:
+            assert set(entry.get_tag("RG") for entry in f) == set(["hl60"])
+
+    def test_unsorted_input_with_sorted_header(self, tmp_path):
+        """ An input whose header says that it is sorted when it is not is
+            sorted before the merge """
+
+        tmp_dir = str(tmp_path) + "/"
+        sam = str(tmp_path / "unsorted.sam")
+        with pysam.AlignmentFile("input_files/toy_transcript/toy_reads_for_partition_test.sam") as f:
+            header = f.header.to_dict()
+            header["HD"] = {"VN": "1.6", "SO": "coordinate"}
+            with pysam.AlignmentFile(sam, "w", header = header) as out:
+                for entry in f:
+                    out.write(entry)
+
+        merged_bam = procsam.preprocess_sam([sam], ["toy"], tmp_dir = tmp_dir + "run/",
+                                            use_cb_tag = False)
+        with pysam.AlignmentFile(merged_bam) as f:
+            positions = [(entry.reference_id, entry.reference_start) for entry in f]
+        assert positions == sorted(positions)
+        assert len(positions) > 0
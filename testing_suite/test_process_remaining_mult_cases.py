@@ -20,8 +20,8 @@ class TestIdentifyRemaining(object):
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(db, build, create_novel_spliced_genes=True)
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         transcript_dict = init_refs.make_transcript_dict(cursor, build)
         vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor)
         gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start")
@@ -36,7 +36,7 @@ class TestIdentifyRemaining(object):
         v_novelty = [0, 0, 0, 0, 0, 0]
 
         # Construct temp novel gene db
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
         fusion = True
 
         gene_ID, transcript_ID, gene_novelty, transcript_novelty, start_end_info = \
@@ -47,8 +47,8 @@ class TestIdentifyRemaining(object):
                                                                 gene_starts, gene_ends,
                                                                 edge_dict, location_dict,
                                                                 vertex_2_gene, run_info,
-                                                                cursor, "temp_gene",
-                                                                "temp_transcript",
+                                                                cursor, gene_index,
+                                                                transcript_index,
                                                                 fusion)
 
         assert gene_ID == correct_gene_ID
@@ -69,8 +69,8 @@ class TestIdentifyRemaining(object):
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         transcript_dict = init_refs.make_transcript_dict(cursor, build)
         vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor)
         gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start")
@@ -78,7 +78,7 @@ class TestIdentifyRemaining(object):
         correct_gene_ID = talon.gene_counter.value() + 1
 
         # Construct temp novel gene db
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
 
         chrom = "chrX"
         positions = [ 1, 100, 900, 1000]
@@ -95,8 +95,8 @@ class TestIdentifyRemaining(object):
                                                                 gene_starts, gene_ends,
                                                                 edge_dict, location_dict,
                                                                 vertex_2_gene, run_info,
-                                                                cursor, "temp_gene",
-                                                                "temp_transcript",
+                                                                cursor, gene_index,
+                                                                transcript_index,
                                                                 fusion)
 
         assert gene_ID == correct_gene_ID
@@ -116,8 +116,8 @@ class TestIdentifyRemaining(object):
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         transcript_dict = init_refs.make_transcript_dict(cursor, build)
         vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor)
         gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start")
@@ -125,7 +125,7 @@ class TestIdentifyRemaining(object):
         correct_gene_ID = talon.gene_counter.value() + 1
 
         # Construct temp novel gene db
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
 
         chrom = "chr2"
         positions = [ 1000, 950, 700, 600]
@@ -142,8 +142,8 @@ class TestIdentifyRemaining(object):
                                                                 gene_starts, gene_ends,
                                                                 edge_dict, location_dict,
                                                                 vertex_2_gene, run_info,
-                                                                cursor, "temp_gene",
-                                                                "temp_transcript",
+                                                                cursor, gene_index,
+                                                                transcript_index,
                                                                 fusion)
         assert gene_ID == correct_gene_ID
         assert transcript_dict[frozenset(start_end_info["edge_IDs"])] != None
@@ -161,15 +161,15 @@ class TestIdentifyRemaining(object):
         edge_dict = init_refs.make_edge_dict(cursor)
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         transcript_dict = init_refs.make_transcript_dict(cursor, build)
         vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor)
         gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start")
         gene_ends = init_refs.make_gene_start_or_end_dict(cursor, build, "end")
 
         # Construct temp novel gene db
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
+        gene_index = init_refs.make_gene_interval_index(cursor, "toy_build")
 
         chrom = "chr1"
         positions = [ 1000, 950, 700, 600]
@@ -186,8 +186,8 @@ class TestIdentifyRemaining(object):
                                                                 gene_starts, gene_ends,
                                                                 edge_dict, location_dict,
                                                                 vertex_2_gene, run_info,
-                                                                cursor, "temp_gene",
-                                                                "temp_transcript",
+                                                                cursor, gene_index,
+                                                                transcript_index,
                                                                 fusion)
         correct_gene_ID = fetch_correct_ID("TG3", "gene", cursor)
         assert gene_ID == correct_gene_ID
@@ -0,0 +1,125 @@
+import pytest
+from talon import talon, init_refs, dstruct
+from .helper_fns import fetch_correct_ID, get_db_cursor
+@pytest.mark.integration
+
+class TestReadStructureCache(object):
+
+    def annotate(self, cursor, read_cache, reads, known_chains=False):
+        build = "toy_build"
+        database = "scratch/toy.db"
+        talon.get_counters(database)
+        run_info = talon.init_run_info(database, build)
+        gene_index = init_refs.make_gene_interval_index(cursor, build)
+        transcript_index = init_refs.make_transcript_interval_index(cursor, build)
+        edge_dict = init_refs.make_edge_dict(cursor)
+        location_dict = init_refs.make_location_dict(build, cursor)
+        transcript_dict = init_refs.make_transcript_dict(cursor, build)
+        vertex_2_gene = init_refs.make_vertex_2_gene_dict(cursor)
+        gene_starts = init_refs.make_gene_start_or_end_dict(cursor, build, "start")
+        gene_ends = init_refs.make_gene_start_or_end_dict(cursor, build, "end")
+        if read_cache:
+            read_cache = dstruct.ReadStructureCache(transcript_dict)
+        else:
+            read_cache = None
+        if known_chains:
+            known_chains = init_refs.make_known_splice_chains(transcript_dict, edge_dict,
+                                                              location_dict)
+        else:
+            known_chains = None
+
+        annotations = []
+        for chrom, strand, positions in reads:
+            annotations.append(talon.identify_transcript(chrom, positions, strand, cursor,
+                                                         location_dict, edge_dict,
+                                                         transcript_dict, vertex_2_gene,
+                                                         gene_starts, gene_ends, run_info,
+                                                         gene_index, transcript_index,
+                                                         read_cache=read_cache,
+                                                         known_chains=known_chains))
+        return annotations, read_cache, known_chains
+
+    def test_repeated_FSM(self):
+        """ Reads with the same splice chain as an earlier FSM are served from
+            the cache, with deltas recomputed from their own ends """
+        conn, cursor = get_db_cursor()
+        reads = [("chr1", "+", [ 1, 100, 500, 600, 900, 1000 ]),
+                 ("chr1", "+", [ 5, 100, 500, 600, 900, 990 ]),
+                 ("chr1", "+", [ 1, 100, 500, 600, 900, 1000 ])]
+
+        annotations, read_cache, _ = self.annotate(cursor, True, reads)
+
+        correct_transcript_ID = fetch_correct_ID("TG1-001", "transcript", cursor)
+        assert [ x['transcript_ID'] for x in annotations ] == [correct_transcript_ID]*3
+        assert annotations[1]['start_delta'] == 4
+        assert annotations[1]['end_delta'] == -10
+        assert read_cache.hits == 2
+        assert read_cache.misses == 1
+        conn.close()
+
+    def test_matches_uncached(self):
+        """ Turning the cache on must not change any annotation, including
+            for reads that create novel structures along the way """
+        conn, cursor = get_db_cursor()
+        reads = [("chr1", "+", [ 1, 100, 500, 600, 900, 1000 ]),
+                 ("chr1", "+", [ 1, 100, 500, 600, 900, 1500 ]),
+                 ("chr1", "+", [ 1, 100, 900, 1000 ]),
+                 ("chr1", "+", [ 1, 100, 900, 1000 ]),
+                 ("chr1", "+", [ 1, 100, 500, 600, 900, 1500 ]),
+                 ("chr1", "+", [ 1, 100, 550, 600, 900, 1000 ]),
+                 ("chr1", "+", [ 20, 100, 550, 600, 900, 1000 ]),
+                 ("chr1", "+", [ 1, 100, 900, 1000 ]),
+                 ("chr2", "+", [ 1, 100, 500, 600, 900, 1000 ]),
+                 ("chr1", "-", [ 2000, 1500, 1000, 900 ]),
+                 ("chr1", "-", [ 1950, 1500, 1000, 820 ]),
+                 ("chr3", "+", [ 850, 1000, 1200, 1400, 2000, 2200 ]),
+                 ("chr3", "+", [ 850, 1000, 1200, 1400, 2000, 2200 ]),
+                 ("chr3", "+", [ 800, 1000, 1200, 1400, 2000, 2200, 2400, 2550 ])]
+
+        cached, read_cache, _ = self.annotate(cursor, True, reads)
+        fast, _, known_chains = self.annotate(cursor, True, reads, known_chains=True)
+        uncached, _, _ = self.annotate(cursor, False, reads)
+
+        assert cached == uncached
+        assert fast == uncached
+        assert read_cache.hits > 0
+        assert known_chains.hits > 0
+        conn.close()
+
+    def test_known_chain_fast_path(self):
+        """ A read whose splice chain exactly matches a known transcript is
+            served by the known-structure fast path """
+        conn, cursor = get_db_cursor()
+        reads = [("chr1", "+", [ 10, 100, 500, 600, 900, 1010 ])]
+
+        annotations, _, known_chains = self.annotate(cursor, False, reads,
+                                                     known_chains=True)
+
+        correct_transcript_ID = fetch_correct_ID("TG1-001", "transcript", cursor)
+        assert ("chr1", "+", (100, 500, 600, 900)) in known_chains
+        assert annotations[0]['transcript_ID'] == correct_transcript_ID
+        assert annotations[0]['start_delta'] == 9
+        assert annotations[0]['end_delta'] == 10
+        assert known_chains.hits == 1
+        conn.close()
+
+
+@pytest.mark.unit
+
+class TestReadStructureCacheInvalidation(object):
+
+    def test_replaced_path_clears_cache(self):
+        """ Appending transcripts leaves cached entries alone, but replacing
+            an existing path empties the cache """
+
+        transcript_dict = dstruct.PathDict({frozenset([1, 2, 3]): "t1"})
+        read_cache = dstruct.ReadStructureCache(transcript_dict)
+        read_cache[("chr1", "+", (100, 200))] = "result"
+
+        transcript_dict[frozenset([3, 4, 5])] = "t2"
+        assert read_cache.lookup(("chr1", "+", (100, 200))) == "result"
+
+        transcript_dict[frozenset([1, 2, 3])] = "t3"
+        assert read_cache.lookup(("chr1", "+", (100, 200))) == None
+        assert read_cache.hits == 1
+        assert read_cache.misses == 1
@@ -0,0 +1,135 @@
+import os
+import shutil
+import sqlite3
+import pytest
+from talon import talon, init_refs, dstruct
+from talon import initialize_talon_database as init_db
+from .helper_fns import get_db_cursor
+
+@pytest.mark.unit
+
+class TestReferenceTable(object):
+
+    def make_table(self):
+        rows = [ {"ID": 1, "chrom": "chr1", "start": 500, "end": 900, "name": "c"},
+                 {"ID": 2, "chrom": "chr1", "start": 100, "end": 300, "name": None},
+                 {"ID": 3, "chrom": "chr2", "start": 100, "end": 200, "name": "a"},
+                 {"ID": 4, "chrom": "chr1", "start": 250, "end": 260, "name": "b"},
+                 {"ID": 5, "chrom": None, "start": 1, "end": 2, "name": "d"} ]
+        return dstruct.ReferenceTable.from_rows(rows, "chrom", "start", "end")
+
+    def test_overlap_and_within(self):
+        """ Overlapping and contained rows are found, and come back in the
+            order the rows were given in """
+
+        table = self.make_table()
+
+        assert [ x["ID"] for x in table.query("chr1", 280, 600) ] == [1, 2]
+        assert [ x["ID"] for x in table.query("chr1", 200, 950) ] == [1, 2, 4]
+        assert [ x["ID"] for x in table.query("chr1", 200, 950, within = True) ] == [1, 4]
+        assert [ x["ID"] for x in table.query("chr1", 0, 1000, where = ("ID", 4)) ] == [4]
+        assert table.query("chr3", 0, 1000) == []
+        assert len(table) == 4
+
+    def test_save_and_load(self, tmp_path):
+        """ A saved table loads back with the same values and types """
+
+        table = self.make_table()
+        table.save(str(tmp_path), "test")
+        loaded = dstruct.ReferenceTable.load(str(tmp_path), "test")
+
+        rows = loaded.query("chr1", 0, 1000, columns = {"ID": "ID", "label": "name"})
+        assert rows == [ {"ID": 1, "label": "c"}, {"ID": 2, "label": None},
+                         {"ID": 4, "label": "b"} ]
+        assert type(rows[0]) is not dict
+        assert type(rows[0]["ID"]) is int
+
+@pytest.mark.dbunit
+
+class TestReferenceTablesMatchDatabase(object):
+
+    def test_region_structures(self, tmp_path):
+        """ Region structures read from the reference tables must match the
+            ones queried from the database, including their order """
+
+        conn, cursor = get_db_cursor()
+        build = "toy_build"
+        reference = init_refs.make_reference_tables(cursor, build, str(tmp_path))
+
+        for region in [("chr1", 1, 1000), ("chr1", 500, 1500), ("chr4", 2000, 3000)]:
+            from_db = init_refs.make_transcript_dict(cursor, build, *region)
+            from_tables = init_refs.make_transcript_dict(cursor, build, *region,
+                                                         reference = reference)
+            assert [ (k, dict(v)) for k, v in from_db.items() ] == \
+                   [ (k, dict(v)) for k, v in from_tables.items() ]
+
+            from_db = init_refs.make_location_dict(build, cursor, *region)
+            from_tables = init_refs.make_location_dict(build, cursor, *region,
+                                                       reference = reference)
+            for chrom in from_db:
+                assert [ dict(x) for x in from_db[chrom].values() ] == \
+                       [ dict(x) for x in from_tables[chrom].values() ]
+
+            from_db = init_refs.make_edge_dict(cursor, build, *region)
+            from_tables = init_refs.make_edge_dict(cursor, build, *region,
+                                                   reference = reference)
+            assert { k: dict(v) for k, v in from_db.items() } == \
+                   { k: dict(v) for k, v in from_tables.items() }
+
+            from_db = init_refs.make_monoexon_interval_index(cursor, build, *region)
+            from_tables = init_refs.make_monoexon_interval_index(cursor, build, *region,
+                                                                 reference = reference)
+            assert [ dict(x) for x in from_db ] == [ dict(x) for x in from_tables ]
+        conn.close()
+
+@pytest.mark.dbunit
+
+class TestReferenceSnapshot(object):
+
+    def test_snapshot_reuse_and_rebuild(self, tmp_path, monkeypatch):
+        """ A snapshot is reused while the reference counters are unchanged,
+            not invalidated by new reads, and rebuilt once genes are added """
+
+        database = str(tmp_path / "toy.db")
+        shutil.copy("scratch/toy.db", database)
+        conn = sqlite3.connect(database)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        reference, directory = init_refs.load_reference_snapshot(cursor, "toy_build", database)
+        assert directory == database + ".reference/toy_build"
+        assert os.path.exists(os.path.join(directory, "key.json"))
+        n_genes = len(reference.genes)
+
+        def fail(*args):
+            raise AssertionError("Snapshot should not have been rebuilt")
+
+        monkeypatch.setattr(init_refs, "make_reference_tables", fail)
+        cursor.execute("UPDATE counters SET count = count + 5 WHERE category = 'observed'")
+        reference, directory = init_refs.load_reference_snapshot(cursor, "toy_build", database)
+        assert len(reference.genes) == n_genes
+
+        monkeypatch.undo()
+        cursor.execute("""INSERT INTO genes (gene_ID, strand) VALUES (1000, '+')""")
+        cursor.execute("""INSERT INTO vertex (vertex_ID, gene_ID) VALUES (1, 1000)""")
+        init_db.update_gene_extents(cursor, [1000])
+        cursor.execute("UPDATE counters SET count = count + 1 WHERE category = 'genes'")
+        reference, directory = init_refs.load_reference_snapshot(cursor, "toy_build", database)
+        assert len(reference.genes) == n_genes + 1
+        conn.close()
+
+    def test_new_database_clears_old_snapshot(self, tmp_path):
+        """ Re-initializing a database at the path of a deleted one removes
+            the old snapshot, which could otherwise match the new counters """
+
+        database = str(tmp_path / "toy.db")
+        shutil.copy("scratch/toy.db", database)
+        conn = sqlite3.connect(database)
+        conn.row_factory = sqlite3.Row
+        directory = init_refs.load_reference_snapshot(conn.cursor(), "toy_build", database)[1]
+        conn.close()
+        assert os.path.exists(directory)
+
+        os.remove(database)
+        init_db.create_database(database)
+        assert not os.path.exists(database + ".reference")
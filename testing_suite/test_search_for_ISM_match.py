@@ -1,5 +1,6 @@
 import pytest
-from talon import talon,init_refs
+import random
+from talon import talon, init_refs, dstruct
 from .helper_fns import fetch_correct_ID, get_db_cursor
 @pytest.mark.dbunit
 
@@ -53,3 +54,25 @@ class TestSearchForISM(object):
         assert matches[0]["gene_ID"] == correct_gene_ID
         conn.close()
 
+
+    def test_index_matches_linear_scan(self):
+        """ Candidates found through the edge index must be the same matches,
+            in the same order, as testing every path in a plain dict """
+
+        rng = random.Random(3)
+        paths = {}
+        for i in range(500):
+            path = frozenset(rng.sample(range(1, 60), rng.randint(1, 9)))
+            paths[path] = {"transcript_ID": i}
+        indexed = dstruct.PathDict(paths)
+
+        # Transcripts created during the run must be indexed as well
+        for i in range(500, 550):
+            path = frozenset(rng.sample(range(1, 60), rng.randint(1, 9)))
+            paths[path] = {"transcript_ID": i}
+            indexed[path] = {"transcript_ID": i}
+
+        for i in range(500):
+            edges = rng.sample(range(1, 65), rng.randint(1, 4))
+            assert talon.search_for_ISM(edges, indexed) == \
+                   talon.search_for_ISM(edges, paths)
@@ -13,8 +13,7 @@ class TestSearchForOverlapWithGene(object):
         build = "toy_build"
         database = "scratch/toy.db"
         run_info = talon.init_run_info(database, build, tmp_dir = "scratch/tmp/")
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build, tmp_dir = "scratch/tmp/")
 
@@ -23,19 +22,15 @@ class TestSearchForOverlapWithGene(object):
         strand = "+"
         gene_ID, match_strand = talon.search_for_overlap_with_gene(chrom, pos[0],
                                                                    pos[1],
-                                                                   strand, cursor,
-                                                                   run_info,
-                                                                   "temp_gene",
-                                                                   "temp_transcript")
+                                                                   strand, run_info,
+                                                                   transcript_index)
         assert gene_ID == None
 
         # Should get same results for flipped interval
         gene_ID, match_strand = talon.search_for_overlap_with_gene(chrom, pos[0],
                                                                    pos[1],
-                                                                   strand, cursor,
-                                                                   run_info,
-                                                                   "temp_gene",
-                                                                   "temp_transcript")
+                                                                   strand, run_info,
+                                                                   transcript_index)
         assert gene_ID == None
         conn.close()
 
@@ -44,8 +39,7 @@ class TestSearchForOverlapWithGene(object):
         conn, cursor = get_db_cursor()
         database = "scratch/toy.db"
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build, tmp_dir = "scratch/tmp/")
 
@@ -55,10 +49,8 @@ class TestSearchForOverlapWithGene(object):
 
         gene_ID, match_strand = talon.search_for_overlap_with_gene(chrom, pos[0],
                                                                    pos[1],
-                                                                   strand, cursor,
-                                                                   run_info,
-                                                                   "temp_gene",
-                                                                   "temp_transcript")
+                                                                   strand, run_info,
+                                                                   transcript_index)
 
 
         assert gene_ID == fetch_correct_ID("TG1", "gene", cursor)
@@ -72,8 +64,7 @@ class TestSearchForOverlapWithGene(object):
         database = "scratch/toy.db"
         conn, cursor = get_db_cursor()
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
 
@@ -83,10 +74,8 @@ class TestSearchForOverlapWithGene(object):
 
         gene_ID, match_strand = talon.search_for_overlap_with_gene(chrom, pos[0],
                                                                    pos[1],
-                                                                   strand, cursor,
-                                                                   run_info,
-                                                                   "temp_gene",
-                                                                   "temp_transcript")
+                                                                   strand, run_info,
+                                                                   transcript_index)
 
         assert gene_ID == fetch_correct_ID("TG3", "gene", cursor)
         assert match_strand == strand
@@ -99,8 +88,7 @@ class TestSearchForOverlapWithGene(object):
         database = "scratch/toy.db"
         conn, cursor = get_db_cursor()
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
 
@@ -110,10 +98,8 @@ class TestSearchForOverlapWithGene(object):
 
         gene_ID, match_strand = talon.search_for_overlap_with_gene(chrom, pos[0],
                                                                    pos[1],
-                                                                   strand, cursor,
-                                                                   run_info,
-                                                                   "temp_gene",
-                                                                   "temp_transcript")
+                                                                   strand, run_info,
+                                                                   transcript_index)
 
         assert gene_ID == fetch_correct_ID("TG3", "gene", cursor)
         assert match_strand == strand
@@ -126,8 +112,7 @@ class TestSearchForOverlapWithGene(object):
         database = "scratch/toy.db"
         conn, cursor = get_db_cursor()
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
 
@@ -137,10 +122,8 @@ class TestSearchForOverlapWithGene(object):
 
         gene_ID, match_strand = talon.search_for_overlap_with_gene(chrom, pos[0],
                                                                    pos[1],
-                                                                   strand, cursor,
-                                                                   run_info,
-                                                                   "temp_gene",
-                                                                   "temp_transcript")
+                                                                   strand, run_info,
+                                                                   transcript_index)
 
         assert gene_ID == fetch_correct_ID("TG3", "gene", cursor)
         assert match_strand == "-"
@@ -153,8 +136,7 @@ class TestSearchForOverlapWithGene(object):
         database = "scratch/toy.db"
         conn, cursor = get_db_cursor()
         build = "toy_build"
-        init_refs.make_temp_novel_gene_table(cursor, "toy_build")
-        init_refs.make_temp_transcript_table(cursor, "toy_build")
+        transcript_index = init_refs.make_transcript_interval_index(cursor, "toy_build")
         location_dict = init_refs.make_location_dict(build, cursor)
         run_info = talon.init_run_info(database, build)
 
@@ -164,10 +146,8 @@ class TestSearchForOverlapWithGene(object):
 
         gene_ID, match_strand = talon.search_for_overlap_with_gene(chrom, pos[0],
                                                                    pos[1],
-                                                                   strand, cursor,
-                                                                   run_info,
-                                                                   "temp_gene",
-                                                                   "temp_transcript")
+                                                                   strand, run_info,
+                                                                   transcript_index)
 
         assert gene_ID == fetch_correct_ID("TG1", "gene", cursor)
         assert match_strand == "+"